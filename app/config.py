@@ -0,0 +1,116 @@
+import os
+import hashlib
+import logging
+from dataclasses import dataclass
+from datetime import tzinfo
+from typing import Callable, FrozenSet, List, Optional
+
+import pytz
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+# Called with the new snapshot after reload_settings() swapped it in
+_reload_listeners: List[Callable[["Settings"], None]] = []
+
+def parse_admin_ids(value: str) -> FrozenSet[int]:
+    """Parse a comma separated ADMIN_IDS value"""
+    return frozenset(int(id.strip()) for id in (value or "").split(",") if id.strip())
+
+@dataclass(frozen=True)
+class Settings:
+    """Immutable configuration snapshot, built once at startup"""
+
+    bot_token: str
+    database_url: str
+    payment_provider_token: Optional[str]
+    admin_ids: FrozenSet[int]
+    admin_password: str
+    timezone: tzinfo
+    invite_link_expire_time: int
+    invite_pool_size: int
+    invite_pool_refill_interval: int
+    admin_digest_interval: int
+    update_workers: int
+    update_queue_limit: int
+    throttle_rate: float
+    throttle_burst: int
+    check_subscription_interval: int
+    expiry_max_concurrency: int
+    reminder_interval: int
+    stats_reconcile_interval: int
+    report_max_concurrency: int
+    report_cache_ttl: int
+    broadcast_rate: float
+    db_reset: bool
+    app_url: Optional[str]
+    payload_secret: bytes
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        """Build settings from the process environment"""
+        database_url = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///bot_database.db")
+        # Make sure SQLite uses the async driver
+        if database_url.startswith("sqlite:///"):
+            database_url = database_url.replace("sqlite:///", "sqlite+aiosqlite:///")
+        
+        bot_token = os.getenv("BOT_TOKEN", "")
+        # Invoice payloads must stay verifiable across restarts, so never use a random key
+        payload_secret = os.getenv("PAYLOAD_SECRET") or hashlib.sha256(f"invoice-payload:{bot_token}".encode()).hexdigest()
+        
+        return cls(
+            bot_token=bot_token,
+            database_url=database_url,
+            payment_provider_token=os.getenv("PAYMENT_PROVIDER_TOKEN"),
+            admin_ids=parse_admin_ids(os.getenv("ADMIN_IDS", "")),
+            admin_password=os.getenv("ADMIN_PASSWORD", "301402503"),
+            timezone=pytz.timezone(os.getenv("TIMEZONE", "UTC")),
+            invite_link_expire_time=int(os.getenv("INVITE_LINK_EXPIRE_TIME", 3600)),
+            invite_pool_size=int(os.getenv("INVITE_POOL_SIZE", 5)),
+            invite_pool_refill_interval=int(os.getenv("INVITE_POOL_REFILL_INTERVAL", 60)),
+            admin_digest_interval=int(os.getenv("ADMIN_DIGEST_INTERVAL", 5)),
+            update_workers=int(os.getenv("UPDATE_WORKERS", 8)),
+            update_queue_limit=int(os.getenv("UPDATE_QUEUE_LIMIT", 200)),
+            throttle_rate=float(os.getenv("THROTTLE_RATE", 1)),
+            throttle_burst=int(os.getenv("THROTTLE_BURST", 5)),
+            check_subscription_interval=int(os.getenv("CHECK_SUBSCRIPTION_INTERVAL", 3600)),
+            expiry_max_concurrency=int(os.getenv("EXPIRY_MAX_CONCURRENCY", 10)),
+            reminder_interval=int(os.getenv("REMINDER_INTERVAL", 900)),
+            stats_reconcile_interval=int(os.getenv("STATS_RECONCILE_INTERVAL", 3600)),
+            report_max_concurrency=int(os.getenv("REPORT_MAX_CONCURRENCY", 2)),
+            report_cache_ttl=int(os.getenv("REPORT_CACHE_TTL", 60)),
+            broadcast_rate=float(os.getenv("BROADCAST_RATE", 20)),
+            db_reset=os.getenv("DB_RESET", "").lower() in ("true", "1", "yes"),
+            app_url=os.getenv("RENDER_EXTERNAL_URL") or os.getenv("APP_URL"),
+            payload_secret=payload_secret.encode()
+        )
+
+def load_settings(override: bool = False) -> Settings:
+    """Read .env and return a settings snapshot; ``override`` lets .env win over the environment"""
+    load_dotenv(override=override)
+    return Settings.from_env()
+
+def on_settings_reload(callback: Callable[[Settings], None]):
+    """Call ``callback(settings)`` whenever reload_settings() swaps the snapshot"""
+    _reload_listeners.append(callback)
+
+def reload_settings(dp) -> Settings:
+    """Re-read .env and the environment and swap the snapshot used by handlers
+
+    The whole snapshot is replaced in one assignment, so an update sees
+    either the old settings or the new ones, never a mix. Listeners then
+    rebuild what was derived from it, such as the admin set. Values used
+    to set up the process (bot token, database URL, update workers and
+    scheduler intervals) still take a restart.
+    """
+    settings = load_settings(override=True)
+    dp["settings"] = settings
+
+    for callback in _reload_listeners:
+        try:
+            callback(settings)
+        except Exception as e:
+            logger.error(f"Settings listener {callback} failed: {e}", exc_info=True)
+
+    logger.info("Settings reloaded")
+    return settings
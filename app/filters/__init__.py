@@ -0,0 +1,3 @@
+from app.filters.admin import AdminFilter
+
+__all__ = ["AdminFilter"]
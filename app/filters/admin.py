@@ -0,0 +1,16 @@
+from aiogram import types
+from aiogram.dispatcher.filters import BoundFilter
+
+from app.services.auth import admin_registry
+
+class AdminFilter(BoundFilter):
+    """Pass updates from admins only: ``is_admin=True``"""
+
+    key = "is_admin"
+
+    def __init__(self, is_admin: bool):
+        self.is_admin = is_admin
+
+    async def check(self, obj: types.base.TelegramObject) -> bool:
+        # Plain frozenset lookup, no database access
+        return admin_registry.is_admin(obj.from_user.id) is self.is_admin
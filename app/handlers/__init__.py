@@ -1,6 +1,8 @@
 from app.handlers.base import register_base_handlers
 from app.handlers.subscription import register_subscription_handlers
 from app.handlers.admin import register_admin_handlers
+from app.filters import AdminFilter
+from app.utils.callback_router import CallbackRouter
 import logging
 
 logger = logging.getLogger(__name__)
@@ -9,16 +11,24 @@ def register_all_handlers(dp):
     """Register all handlers"""
     logger.info("Начинаем регистрацию обработчиков")
     
+    # Bind custom filters before any handler uses them
+    dp.filters_factory.bind(AdminFilter)
+    
+    # All callback queries go through one prefix table
+    router = CallbackRouter()
+    
     # Register base handlers first
     logger.info("Регистрируем базовые обработчики")
-    register_base_handlers(dp)
+    register_base_handlers(dp, router)
     
     # Register subscription handlers
     logger.info("Регистрируем обработчики подписок")
-    register_subscription_handlers(dp)
+    register_subscription_handlers(dp, router)
     
     # Register admin handlers last
     logger.info("Регистрируем обработчики админа")
-    register_admin_handlers(dp)
+    register_admin_handlers(dp, router)
+    
+    router.setup(dp)
     
     logger.info("Регистрация обработчиков завершена") 
\ No newline at end of file
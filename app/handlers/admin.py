@@ -1,20 +1,53 @@
+import io
 import logging
+import os
 import re
+import tempfile
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from typing import Callable, Dict
 from aiogram import Dispatcher, types
 from aiogram.dispatcher.filters import Command
-from aiogram.utils.markdown import hbold, hcode
-from sqlalchemy import text
+from aiogram.utils.markdown import hbold, hcode, hpre, quote_html
+from sqlalchemy import DateTime, func, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
-from app.utils.db import get_session
-from app.services.user import is_admin
-from app.models import User, Channel, Tariff, Subscription
+from app.config import Settings, reload_settings
+from app.models import User, Channel, Tariff, Subscription, Broadcast, BroadcastDeadLetter
+from app.models.channel import ACCESS_JOIN_REQUEST, ACCESS_MODES
+from app.services.analytics import build_report, render_report
+from app.services.bulk_import import (
+    IMPORT_SUBSCRIPTIONS, MAX_IMPORT_SIZE, OPTIONAL_COLUMNS, REQUIRED_COLUMNS, ImportSummary, RowError,
+    import_csv, render_results
+)
+from app.services.broadcast import broadcaster, render_progress as render_broadcast_progress
+from app.services.catalog import catalog, mark_catalog_changed
+from app.services.forecast import HORIZON, build_forecast, revocation_concurrency
+from app.services.entitlements import get_access_link, revoke_after_commit
+from app.services.export import (
+    EXPORT_FORMATS, EXPORTS, FORMAT_CSV, MAX_DOCUMENT_SIZE, export_filename, export_path, export_table
+)
+from app.services.screens import screens
+from app.services.stats import channel_added, channel_toggled, get_channel_counters, get_counters, subscription_ended
+from app.services.subscription import create_subscription
+from app.services.render_cache import RenderedScreen, render_cache
+from app.services.reports import Progress, report_runner
+from app.services.revenue import REPORT_PERIODS, RevenueReport, get_revenue_report
+from app.filters import AdminFilter
+from app.utils.callback_router import CallbackRouter
+from app.utils.pagination import BACKWARD, FORWARD, INTEGER, START, TIMESTAMP, KeysetPaginator, Page
+from app.utils.tracing import PRE_CHECKOUT_DEADLINE, tracer
 
 logger = logging.getLogger(__name__)
 
 # Создаем клавиатуру для админ-панели
 def get_admin_keyboard():
+    """Keyboard for admin panel, serialized once"""
+    return render_cache.markup("admin_keyboard", build_admin_keyboard)
+
+def build_admin_keyboard():
     """Create keyboard for admin panel"""
     keyboard = InlineKeyboardMarkup(row_width=1)
     keyboard.add(
@@ -27,6 +60,10 @@ def get_admin_keyboard():
 
 # Создаем клавиатуру для управления каналами
 def get_channels_keyboard():
+    """Keyboard for channel management, serialized once"""
+    return render_cache.markup("channels_keyboard", build_channels_keyboard)
+
+def build_channels_keyboard():
     """Create keyboard for channel management"""
     keyboard = InlineKeyboardMarkup(row_width=1)
     keyboard.add(
@@ -39,6 +76,10 @@ def get_channels_keyboard():
 
 # Создаем клавиатуру для управления подписками
 def get_subscriptions_keyboard():
+    """Keyboard for subscription management, serialized once"""
+    return render_cache.markup("subscriptions_keyboard", build_subscriptions_keyboard)
+
+def build_subscriptions_keyboard():
     """Create keyboard for subscription management"""
     keyboard = InlineKeyboardMarkup(row_width=1)
     keyboard.add(
@@ -48,6 +89,137 @@ def get_subscriptions_keyboard():
     )
     return keyboard
 
+# Постраничные списки: admin_page:<список>:<направление>:<курсор>
+PAGE_CALLBACK = "admin_page"
+
+@dataclass(frozen=True)
+class AdminListing:
+    """A keyset-paginated admin list, its page text and the menu under it"""
+
+    paginator: KeysetPaginator
+    render: Callable[[Page], str]
+    menu: Callable[[], InlineKeyboardMarkup]
+
+def render_subscriptions_page(page: Page) -> str:
+    subs_text = f"{hbold('Последние активные подписки:')}\n\n"
+    
+    if not page.rows:
+        subs_text += "Нет активных подписок.\n\n"
+    else:
+        for id, user_id, username, channel, tariff, start_date, end_date in page.rows:
+            subs_text += f"ID: {id} | Пользователь: @{username or 'без юзернейма'} ({user_id})\n"
+            subs_text += f"Канал: {channel} | Тариф: {tariff}\n"
+            subs_text += f"Начало: {start_date.strftime('%d.%m.%Y')} | Окончание: {end_date.strftime('%d.%m.%Y')}\n\n"
+    
+    subs_text += f"{hbold('Выберите действие:')}"
+    return subs_text
+
+def render_channels_page(page: Page) -> str:
+    channels_text = f"{hbold('Список каналов:')}\n\n"
+    
+    if not page.rows:
+        channels_text += "Нет настроенных каналов.\n\n"
+    else:
+        for id, channel_id, name, is_active in page.rows:
+            status = "✅ Активен" if is_active else "❌ Неактивен"
+            channels_text += f"ID: {id} | {name} | {status}\n"
+            channels_text += f"Telegram ID: {channel_id}\n\n"
+    
+    channels_text += f"{hbold('Выберите действие:')}"
+    return channels_text
+
+def render_toggle_page(page: Page) -> str:
+    channels_text = f"{hbold('Управление статусом каналов:')}\n\n"
+    if page.rows:
+        for id, channel_id, name, is_active in page.rows:
+            status = "✅ Активен" if is_active else "❌ Неактивен"
+            channels_text += f"ID: {id} | {name} | {status}\n"
+        
+        channels_text += f"\n{hbold('Для вкл/выкл канала используйте команду:')}\n/toggle_channel ID"
+        channels_text += f"\n{hbold('Режим доступа (ссылки или заявки):')}\n/access_mode ID {'|'.join(ACCESS_MODES)}"
+    else:
+        channels_text += "Нет настроенных каналов."
+    return channels_text
+
+def render_users_page(page: Page) -> str:
+    response = ["🔍 <b>Пользователи, новые сначала:</b>"]
+    for user_id, username, created_at in page.rows:
+        username_display = f"@{username}" if username else "Без username"
+        created_date = created_at.strftime('%d.%m.%Y') if created_at else "Дата неизвестна"
+        response.append(f"• ID: {user_id} | {username_display} | {created_date}")
+    return "\n".join(response)
+
+CHANNELS_QUERY = select(Channel.id, Channel.channel_id, Channel.name, Channel.is_active)
+
+ADMIN_LISTINGS: Dict[str, AdminListing] = {
+    "subs": AdminListing(
+        paginator=KeysetPaginator(
+            select(Subscription.id, User.user_id, User.username, Channel.name, Tariff.name,
+                   Subscription.start_date, Subscription.end_date)
+            .join(User, Subscription.user_id == User.id)
+            .join(Channel, Subscription.channel_id == Channel.id)
+            .join(Tariff, Subscription.tariff_id == Tariff.id)
+            .where(Subscription.is_active == True),
+            keys=[(Subscription.id, INTEGER)]
+        ),
+        render=render_subscriptions_page,
+        menu=build_subscriptions_keyboard
+    ),
+    "channels": AdminListing(
+        paginator=KeysetPaginator(CHANNELS_QUERY, keys=[(Channel.id, INTEGER)], descending=False),
+        render=render_channels_page,
+        menu=build_channels_keyboard
+    ),
+    "toggle": AdminListing(
+        paginator=KeysetPaginator(CHANNELS_QUERY, keys=[(Channel.id, INTEGER)], descending=False),
+        render=render_toggle_page,
+        menu=build_channels_keyboard
+    ),
+    "users": AdminListing(
+        paginator=KeysetPaginator(
+            select(User.user_id, User.username, User.created_at),
+            keys=[(User.created_at, TIMESTAMP), (User.id, INTEGER)]
+        ),
+        render=render_users_page,
+        menu=InlineKeyboardMarkup
+    ),
+}
+
+def page_keyboard(listing: str, page: Page, menu: Callable[[], InlineKeyboardMarkup]) -> InlineKeyboardMarkup:
+    """The listing's menu with a ◀️/▶️ row on top whose callbacks carry the page cursors"""
+    keyboard = menu()
+    navigation = []
+    if page.has_prev:
+        navigation.append(InlineKeyboardButton("◀️ Назад", callback_data=f"{PAGE_CALLBACK}:{listing}:{BACKWARD}:{page.first_cursor}"))
+    if page.has_next:
+        navigation.append(InlineKeyboardButton("Вперёд ▶️", callback_data=f"{PAGE_CALLBACK}:{listing}:{FORWARD}:{page.last_cursor}"))
+    if navigation:
+        keyboard.inline_keyboard.insert(0, navigation)
+    return keyboard
+
+async def render_listing(session: AsyncSession, listing: str, direction: str = FORWARD, cursor: str = START,
+                         header: str = "") -> RenderedScreen:
+    """One page of an admin listing with its navigation"""
+    admin_listing = ADMIN_LISTINGS[listing]
+    page = await admin_listing.paginator.fetch(session, direction, cursor)
+    return RenderedScreen.build(header + admin_listing.render(page), page_keyboard(listing, page, admin_listing.menu))
+
+async def callback_admin_page(callback_query: types.CallbackQuery, session: AsyncSession,
+                              listing: str, direction: str, cursor: str):
+    """Next/previous page of an admin listing, edited in place"""
+    if listing not in ADMIN_LISTINGS or direction not in (FORWARD, BACKWARD):
+        await callback_query.answer()
+        return
+    
+    try:
+        screen = await render_listing(session, listing, direction, cursor)
+    except ValueError:
+        # Malformed cursor: back to the first page
+        screen = await render_listing(session, listing)
+    
+    await screens.show(callback_query.message, screen)
+    await callback_query.answer()
+
 # Admin command handler
 async def cmd_admin(message: types.Message):
     """Handle /admin command - show admin panel"""
@@ -55,145 +227,74 @@ async def cmd_admin(message: types.Message):
     logger.info(f"[DEBUG] cmd_admin for user {user_id}")
     
     try:
-        # Create a fresh database connection for this event loop
-        import os
-        from dotenv import load_dotenv
-        from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-        from sqlalchemy.orm import sessionmaker
-        
-        # Load environment variables if needed
-        load_dotenv()
-        
-        # Get database URL
-        db_url = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///bot_database.db")
-        logger.info(f"[DEBUG] Creating new DB engine for admin with URL: {db_url[:db_url.find(':')]}://...elided...")
-        
-        # Create new engine and session factory for this event loop
-        engine = create_async_engine(db_url, echo=False, pool_timeout=30)
-        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        # Show admin panel
+        admin_text = f"{hbold('Панель администратора:')}\n\nВыберите действие:"
         
-        async with get_session(session_factory) as session:
-            # Check if user is admin
-            if not await is_admin(session, user_id):
-                await message.answer("У вас нет прав администратора.")
-                await engine.dispose()
-                return
-            
-            # Show admin panel
-            admin_text = f"{hbold('Панель администратора:')}\n\nВыберите действие:"
-            
-            await message.answer(admin_text, parse_mode="HTML", reply_markup=get_admin_keyboard())
-            await engine.dispose()
+        await message.answer(admin_text, parse_mode="HTML", reply_markup=get_admin_keyboard())
     
     except Exception as e:
         logger.error(f"[DEBUG] Error in cmd_admin: {e}", exc_info=True)
         await message.answer("Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 # Обработчик callback-запросов для админ-панели
-async def admin_callback_handler(callback_query: types.CallbackQuery):
+async def admin_callback_handler(callback_query: types.CallbackQuery, session: AsyncSession):
     """Handle admin panel callbacks"""
     user_id = callback_query.from_user.id
     callback_data = callback_query.data
     logger.info(f"[DEBUG] admin_callback_handler for user {user_id}, data: {callback_data}")
     
     try:
-        # Create a fresh database connection for this event loop
-        import os
-        from dotenv import load_dotenv
-        from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-        from sqlalchemy.orm import sessionmaker
-        
-        # Load environment variables if needed
-        load_dotenv()
-        
-        # Get database URL
-        db_url = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///bot_database.db")
-        logger.info(f"[DEBUG] Creating new DB engine for admin_callback with URL: {db_url[:db_url.find(':')]}://...elided...")
-        
-        # Create new engine and session factory for this event loop
-        engine = create_async_engine(db_url, echo=False, pool_timeout=30)
-        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
-        
-        async with get_session(session_factory) as session:
-            # Check if user is admin
-            if not await is_admin(session, user_id):
-                await callback_query.answer("У вас нет прав администратора.")
-                await engine.dispose()
-                return
-                
-            # Обработка различных callback-запросов
-            if callback_data == "admin_stats":
-                await process_admin_stats(callback_query, session)
-            elif callback_data == "admin_channels":
-                await process_admin_channels(callback_query, session)
-            elif callback_data == "admin_subs":
-                await process_admin_subs(callback_query, session)
-            elif callback_data == "back_to_admin":
-                admin_text = f"{hbold('Панель администратора:')}\n\nВыберите действие:"
-                await callback_query.message.edit_text(admin_text, parse_mode="HTML", reply_markup=get_admin_keyboard())
-            elif callback_data == "add_channel":
-                await callback_query.message.edit_text(
-                    f"{hbold('Добавление канала:')}\n\n"
-                    f"Используйте команду:\n"
-                    f"/add_channel CHANNEL_ID NAME\n\n"
-                    f"Пример: /add_channel -1001234567890 Мой канал", 
-                    parse_mode="HTML", 
-                    reply_markup=get_channels_keyboard()
-                )
-            elif callback_data == "toggle_channel":
-                # Получаем список каналов для отображения
-                channels = await session.execute(
-                    text("SELECT id, channel_id, name, is_active FROM channels")
-                )
-                channels = channels.all()
-                
-                channels_text = f"{hbold('Управление статусом каналов:')}\n\n"
-                if channels:
-                    for channel in channels:
-                        id, channel_id, name, is_active = channel
-                        status = "✅ Активен" if is_active else "❌ Неактивен"
-                        channels_text += f"ID: {id} | {name} | {status}\n"
-                    
-                    channels_text += f"\n{hbold('Для вкл/выкл канала используйте команду:')}\n/toggle_channel ID"
-                else:
-                    channels_text += "Нет настроенных каналов."
-                
-                await callback_query.message.edit_text(
-                    channels_text, 
-                    parse_mode="HTML", 
-                    reply_markup=get_channels_keyboard()
-                )
-            elif callback_data == "add_tariff":
-                await callback_query.message.edit_text(
-                    f"{hbold('Добавление тарифа:')}\n\n"
-                    f"Используйте команду:\n"
-                    f"/add_tariff CHANNEL_ID NAME DAYS PRICE\n\n"
-                    f"Пример: /add_tariff 1 Месяц 30 1000",
-                    parse_mode="HTML", 
-                    reply_markup=get_channels_keyboard()
-                )
-            elif callback_data == "add_sub":
-                await callback_query.message.edit_text(
-                    f"{hbold('Добавление подписки:')}\n\n"
-                    f"Используйте команду:\n"
-                    f"/add_sub USER_ID CHANNEL_ID TARIFF_ID\n\n"
-                    f"Пример: /add_sub 123456789 1 1",
-                    parse_mode="HTML", 
-                    reply_markup=get_subscriptions_keyboard()
-                )
-            elif callback_data == "del_sub":
-                await callback_query.message.edit_text(
-                    f"{hbold('Удаление подписки:')}\n\n"
-                    f"Используйте команду:\n"
-                    f"/del_sub SUBSCRIPTION_ID\n\n"
-                    f"Пример: /del_sub 5",
-                    parse_mode="HTML", 
-                    reply_markup=get_subscriptions_keyboard()
-                )
-            
-            await callback_query.answer()
+        # Обработка различных callback-запросов
+        if callback_data == "admin_stats":
+            await process_admin_stats(callback_query, session)
+        elif callback_data == "admin_channels":
+            await process_admin_channels(callback_query, session)
+        elif callback_data == "admin_subs":
+            await process_admin_subs(callback_query, session)
+        elif callback_data == "back_to_admin":
+            admin_text = f"{hbold('Панель администратора:')}\n\nВыберите действие:"
+            await callback_query.message.edit_text(admin_text, parse_mode="HTML", reply_markup=get_admin_keyboard())
+        elif callback_data == "add_channel":
+            await callback_query.message.edit_text(
+                f"{hbold('Добавление канала:')}\n\n"
+                f"Используйте команду:\n"
+                f"/add_channel CHANNEL_ID NAME\n\n"
+                f"Пример: /add_channel -1001234567890 Мой канал", 
+                parse_mode="HTML", 
+                reply_markup=get_channels_keyboard()
+            )
+        elif callback_data == "toggle_channel":
+            # Первая страница списка каналов
+            await screens.show(callback_query.message, await render_listing(session, "toggle"))
+        elif callback_data == "add_tariff":
+            await callback_query.message.edit_text(
+                f"{hbold('Добавление тарифа:')}\n\n"
+                f"Используйте команду:\n"
+                f"/add_tariff CHANNEL_ID NAME DAYS PRICE\n\n"
+                f"Пример: /add_tariff 1 Месяц 30 1000",
+                parse_mode="HTML", 
+                reply_markup=get_channels_keyboard()
+            )
+        elif callback_data == "add_sub":
+            await callback_query.message.edit_text(
+                f"{hbold('Добавление подписки:')}\n\n"
+                f"Используйте команду:\n"
+                f"/add_sub USER_ID CHANNEL_ID TARIFF_ID\n\n"
+                f"Пример: /add_sub 123456789 1 1",
+                parse_mode="HTML", 
+                reply_markup=get_subscriptions_keyboard()
+            )
+        elif callback_data == "del_sub":
+            await callback_query.message.edit_text(
+                f"{hbold('Удаление подписки:')}\n\n"
+                f"Используйте команду:\n"
+                f"/del_sub SUBSCRIPTION_ID\n\n"
+                f"Пример: /del_sub 5",
+                parse_mode="HTML", 
+                reply_markup=get_subscriptions_keyboard()
+            )
         
-        await engine.dispose()
+        await callback_query.answer()
     
     except Exception as e:
         logger.error(f"[DEBUG] Error in admin_callback_handler: {e}", exc_info=True)
@@ -203,48 +304,8 @@ async def admin_callback_handler(callback_query: types.CallbackQuery):
 async def process_admin_stats(callback_query: types.CallbackQuery, session):
     """Process admin_stats callback"""
     try:
-        # Check if user is admin
-        user_id = callback_query.from_user.id
-        if not await is_admin(session, user_id):
-            await callback_query.answer("У вас нет прав администратора.")
-            return
-            
-        # Get statistics from database
-        stats = {}
-        
-        # Users count
-        result = await session.execute(text("SELECT COUNT(*) FROM users"))
-        stats['users_total'] = result.scalar() or 0
-        
-        # Active users (with at least one active subscription)
-        result = await session.execute(
-            text("""
-            SELECT COUNT(DISTINCT user_id) 
-            FROM subscriptions 
-            WHERE is_active = true
-            """)
-        )
-        stats['users_active'] = result.scalar() or 0
-        
-        # Channels count
-        result = await session.execute(text("SELECT COUNT(*) FROM channels"))
-        stats['channels_total'] = result.scalar() or 0
-        
-        # Active channels
-        result = await session.execute(
-            text("SELECT COUNT(*) FROM channels WHERE is_active = true")
-        )
-        stats['channels_active'] = result.scalar() or 0
-        
-        # Subscriptions count
-        result = await session.execute(text("SELECT COUNT(*) FROM subscriptions"))
-        stats['subscriptions_total'] = result.scalar() or 0
-        
-        # Active subscriptions
-        result = await session.execute(
-            text("SELECT COUNT(*) FROM subscriptions WHERE is_active = true")
-        )
-        stats['subscriptions_active'] = result.scalar() or 0
+        # Counters are kept up to date by the write paths
+        stats = await get_counters(session)
         
         # Format message
         stats_text = f"{hbold('Статистика бота')}\n\n"
@@ -286,36 +347,8 @@ async def process_admin_stats(callback_query: types.CallbackQuery, session):
 async def process_admin_channels(callback_query: types.CallbackQuery, session):
     """Process admin_channels callback"""
     try:
-        # Check if user is admin
-        user_id = callback_query.from_user.id
-        if not await is_admin(session, user_id):
-            await callback_query.answer("У вас нет прав администратора.")
-            return
-            
-        # Get all channels
-        channels = await session.execute(
-            text("SELECT id, channel_id, name, is_active FROM channels")
-        )
-        channels = channels.all()
-        
-        channels_text = f"{hbold('Список каналов:')}\n\n"
-        
-        if not channels:
-            channels_text += "Нет настроенных каналов.\n\n"
-        else:
-            for channel in channels:
-                id, channel_id, name, is_active = channel
-                status = "✅ Активен" if is_active else "❌ Неактивен"
-                channels_text += f"ID: {id} | {name} | {status}\n"
-                channels_text += f"Telegram ID: {channel_id}\n\n"
-        
-        channels_text += f"{hbold('Выберите действие:')}"
-        
-        await callback_query.message.edit_text(
-            channels_text, 
-            parse_mode="HTML",
-            reply_markup=get_channels_keyboard()
-        )
+        # First page of the channel list
+        await screens.show(callback_query.message, await render_listing(session, "channels"))
     except Exception as e:
         logger.error(f"[DEBUG] Error in process_admin_channels: {e}", exc_info=True)
         await callback_query.message.edit_text(
@@ -327,44 +360,8 @@ async def process_admin_channels(callback_query: types.CallbackQuery, session):
 async def process_admin_subs(callback_query: types.CallbackQuery, session):
     """Process admin_subs callback"""
     try:
-        # Check if user is admin
-        user_id = callback_query.from_user.id
-        if not await is_admin(session, user_id):
-            await callback_query.answer("У вас нет прав администратора.")
-            return
-            
-        # Get recent active subscriptions (limit 10)
-        query = text("""
-            SELECT s.id, u.user_id, u.username, c.name, t.name, s.start_date, s.end_date
-            FROM subscriptions s
-            JOIN users u ON s.user_id = u.id
-            JOIN channels c ON s.channel_id = c.id
-            JOIN tariffs t ON s.tariff_id = t.id
-            WHERE s.is_active = true
-            ORDER BY s.start_date DESC
-            LIMIT 10
-        """)
-        subscriptions = await session.execute(query)
-        subscriptions = subscriptions.all()
-        
-        subs_text = f"{hbold('Последние активные подписки:')}\n\n"
-        
-        if not subscriptions:
-            subs_text += "Нет активных подписок.\n\n"
-        else:
-            for sub in subscriptions:
-                id, user_id, username, channel, tariff, start_date, end_date = sub
-                subs_text += f"ID: {id} | Пользователь: @{username or 'без юзернейма'} ({user_id})\n"
-                subs_text += f"Канал: {channel} | Тариф: {tariff}\n"
-                subs_text += f"Начало: {start_date.strftime('%d.%m.%Y')} | Окончание: {end_date.strftime('%d.%m.%Y')}\n\n"
-        
-        subs_text += f"{hbold('Выберите действие:')}"
-        
-        await callback_query.message.edit_text(
-            subs_text, 
-            parse_mode="HTML",
-            reply_markup=get_subscriptions_keyboard()
-        )
+        # First page of active subscriptions, newest first
+        await screens.show(callback_query.message, await render_listing(session, "subs"))
     except Exception as e:
         logger.error(f"[DEBUG] Error in process_admin_subs: {e}", exc_info=True)
         await callback_query.message.edit_text(
@@ -373,1024 +370,1038 @@ async def process_admin_subs(callback_query: types.CallbackQuery, session):
         )
 
 # Admin stats command handler
-async def cmd_admin_stats(message: types.Message):
+async def cmd_admin_stats(message: types.Message, session: AsyncSession):
     """Handle /admin_stats command - show bot statistics"""
     user_id = message.from_user.id
     logger.info(f"[DEBUG] cmd_admin_stats for user {user_id}")
     
     try:
-        # Create a fresh database connection for this event loop
-        import os
-        from dotenv import load_dotenv
-        from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-        from sqlalchemy.orm import sessionmaker
+        # Counters are kept up to date by the write paths
+        stats = await get_counters(session)
         
-        # Load environment variables if needed
-        load_dotenv()
+        # Average subscriptions per user
+        if stats['users_total'] > 0:
+            stats['avg_subs_per_user'] = round(stats['subscriptions_total'] / stats['users_total'], 2)
+        else:
+            stats['avg_subs_per_user'] = 0
+            
+        # Average active subscriptions per active user
+        if stats['users_active'] > 0:
+            stats['avg_active_subs_per_user'] = round(stats['subscriptions_active'] / stats['users_active'], 2)
+        else:
+            stats['avg_active_subs_per_user'] = 0
+            
+        # Format message
+        stats_text = f"{hbold('Статистика бота')}\n\n"
         
-        # Get database URL
-        db_url = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///bot_database.db")
-        logger.info(f"[DEBUG] Creating new DB engine for admin_stats with URL: {db_url[:db_url.find(':')]}://...elided...")
+        stats_text += f"👤 {hbold('Пользователи:')}\n"
+        stats_text += f"   • Всего: {stats['users_total']}\n"
+        stats_text += f"   • Активных: {stats['users_active']} ({round(stats['users_active']/stats['users_total']*100, 1) if stats['users_total'] > 0 else 0}% от общего числа)\n\n"
         
-        # Create new engine and session factory for this event loop
-        engine = create_async_engine(db_url, echo=False, pool_timeout=30)
-        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        stats_text += f"📺 {hbold('Каналы:')}\n"
+        stats_text += f"   • Всего: {stats['channels_total']}\n"
+        stats_text += f"   • Активных: {stats['channels_active']} ({round(stats['channels_active']/stats['channels_total']*100, 1) if stats['channels_total'] > 0 else 0}% от общего числа)\n\n"
         
-        async with get_session(session_factory) as session:
-            # Check if user is admin
-            if not await is_admin(session, user_id):
-                await message.answer("У вас нет прав администратора.")
-                await engine.dispose()
-                return
-                
-            # Get statistics from database
-            stats = {}
-            
-            # Users count
-            result = await session.execute(text("SELECT COUNT(*) FROM users"))
-            stats['users_total'] = result.scalar() or 0
-            
-            # Active users (with at least one active subscription)
-            result = await session.execute(
-                text("""
-                SELECT COUNT(DISTINCT user_id) 
-                FROM subscriptions 
-                WHERE is_active = true
-                """)
-            )
-            stats['users_active'] = result.scalar() or 0
-            
-            # Channels count
-            result = await session.execute(text("SELECT COUNT(*) FROM channels"))
-            stats['channels_total'] = result.scalar() or 0
-            
-            # Active channels
-            result = await session.execute(
-                text("SELECT COUNT(*) FROM channels WHERE is_active = true")
-            )
-            stats['channels_active'] = result.scalar() or 0
-            
-            # Subscriptions count
-            result = await session.execute(text("SELECT COUNT(*) FROM subscriptions"))
-            stats['subscriptions_total'] = result.scalar() or 0
-            
-            # Active subscriptions
-            result = await session.execute(
-                text("SELECT COUNT(*) FROM subscriptions WHERE is_active = true")
-            )
-            stats['subscriptions_active'] = result.scalar() or 0
-            
-            # Average subscriptions per user
-            if stats['users_total'] > 0:
-                stats['avg_subs_per_user'] = round(stats['subscriptions_total'] / stats['users_total'], 2)
-            else:
-                stats['avg_subs_per_user'] = 0
-                
-            # Average active subscriptions per active user
-            if stats['users_active'] > 0:
-                stats['avg_active_subs_per_user'] = round(stats['subscriptions_active'] / stats['users_active'], 2)
-            else:
-                stats['avg_active_subs_per_user'] = 0
-                
-            # Format message
-            stats_text = f"{hbold('Статистика бота')}\n\n"
-            
-            stats_text += f"👤 {hbold('Пользователи:')}\n"
-            stats_text += f"   • Всего: {stats['users_total']}\n"
-            stats_text += f"   • Активных: {stats['users_active']} ({round(stats['users_active']/stats['users_total']*100, 1)}% от общего числа)\n\n"
-            
-            stats_text += f"📺 {hbold('Каналы:')}\n"
-            stats_text += f"   • Всего: {stats['channels_total']}\n"
-            stats_text += f"   • Активных: {stats['channels_active']} ({round(stats['channels_active']/stats['channels_total']*100, 1) if stats['channels_total'] > 0 else 0}% от общего числа)\n\n"
-            
-            stats_text += f"🔗 {hbold('Подписки:')}\n"
-            stats_text += f"   • Всего: {stats['subscriptions_total']}\n"
-            stats_text += f"   • Активных: {stats['subscriptions_active']} ({round(stats['subscriptions_active']/stats['subscriptions_total']*100, 1) if stats['subscriptions_total'] > 0 else 0}% от общего числа)\n\n"
-            
-            stats_text += f"📊 {hbold('В среднем:')}\n"
-            stats_text += f"   • {stats['avg_subs_per_user']} подписок на пользователя\n"
-            stats_text += f"   • {stats['avg_active_subs_per_user']} активных подписок на активного пользователя\n"
-                
-            # Show stats
-            await message.answer(stats_text, parse_mode="HTML")
-            await engine.dispose()
+        stats_text += f"🔗 {hbold('Подписки:')}\n"
+        stats_text += f"   • Всего: {stats['subscriptions_total']}\n"
+        stats_text += f"   • Активных: {stats['subscriptions_active']} ({round(stats['subscriptions_active']/stats['subscriptions_total']*100, 1) if stats['subscriptions_total'] > 0 else 0}% от общего числа)\n\n"
+        
+        stats_text += f"📊 {hbold('В среднем:')}\n"
+        stats_text += f"   • {stats['avg_subs_per_user']} подписок на пользователя\n"
+        stats_text += f"   • {stats['avg_active_subs_per_user']} активных подписок на активного пользователя\n"
             
+        # Show stats
+        await message.answer(stats_text, parse_mode="HTML")
+        
     except Exception as e:
         logger.error(f"[DEBUG] Error in cmd_admin_stats: {e}", exc_info=True)
         await message.answer("Произошла ошибка при получении статистики.")
 
 # Admin channels command handler
-async def cmd_admin_channels(message: types.Message):
+async def cmd_admin_channels(message: types.Message, session: AsyncSession):
     """Command /admin_channels - показывает статистику по каналам."""
     try:
         user_id = message.from_user.id
         
-        # Create a fresh database connection for this event loop
-        import os
-        from dotenv import load_dotenv
-        from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-        from sqlalchemy.orm import sessionmaker
+        logger.debug(f"Admin {user_id} requested channels statistics")
         
-        # Load environment variables if needed
-        load_dotenv()
+        # Получаем статистику по каналам из счётчиков
+        counters = await get_counters(session)
+        total_channels = counters['channels_total']
+        active_channels = counters['channels_active']
         
-        # Get database URL
-        db_url = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///bot_database.db")
-        logger.info(f"[DEBUG] Creating new DB engine for admin_channels with URL: {db_url[:db_url.find(':')]}://...elided...")
+        # Каналы с наибольшим количеством подписчиков (подписок)
+        top_channels_list = await get_channel_counters(session, limit=10)
         
-        # Create new engine and session factory for this event loop
-        engine = create_async_engine(db_url, echo=False, pool_timeout=30)
-        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        # Формируем ответ
+        response = [
+            f"📺 <b>Статистика каналов:</b>\n",
+            f"📢 Всего каналов: <b>{total_channels}</b>",
+            f"✅ Активных каналов: <b>{active_channels}</b>\n",
+            f"🏆 <b>Топ-10 каналов по количеству подписок:</b>"
+        ]
         
-        async with get_session(session_factory) as session:
-            # Проверяем права администратора
-            if not await is_admin(session, user_id):
-                await message.answer("⛔️ У вас нет прав для выполнения этой команды.")
-                await engine.dispose()
-                return
-            
-            logger.debug(f"Admin {user_id} requested channels statistics")
-            
-            # Получаем статистику по каналам
-            # Общее количество каналов
-            total_channels = await session.scalar(
-                text("SELECT COUNT(*) FROM channels")
-            )
-            
-            # Активные каналы
-            active_channels = await session.scalar(
-                text("SELECT COUNT(*) FROM channels WHERE is_active = true")
+        for channel in top_channels_list:
+            status = "✅" if channel[3] else "❌"
+            response.append(
+                f"• {status} {channel[2]} | ID: {channel[1]} | {channel[5]:,} подписчиков"
             )
-            
-            # Каналы с наибольшим количеством подписчиков (подписок)
-            top_channels = await session.execute(
-                text("""
-                SELECT 
-                    c.id,
-                    c.channel_id,
-                    c.name,
-                    c.is_active,
-                    COUNT(s.id) as subscription_count
-                FROM 
-                    channels c
-                LEFT JOIN 
-                    subscriptions s ON c.id = s.channel_id AND s.is_active = true
-                GROUP BY 
-                    c.id, c.channel_id, c.name, c.is_active
-                ORDER BY 
-                    subscription_count DESC
-                LIMIT 10
-                """)
-            )
-            top_channels_list = top_channels.fetchall()
-            
-            # Формируем ответ
-            response = [
-                f"📺 <b>Статистика каналов:</b>\n",
-                f"📢 Всего каналов: <b>{total_channels}</b>",
-                f"✅ Активных каналов: <b>{active_channels}</b>\n",
-                f"🏆 <b>Топ-10 каналов по количеству подписок:</b>"
-            ]
-            
-            for channel in top_channels_list:
-                status = "✅" if channel[3] else "❌"
-                response.append(
-                    f"• {status} {channel[2]} | ID: {channel[1]} | {channel[4]:,} подписчиков"
-                )
-            
-            await message.answer("\n".join(response), parse_mode="HTML")
-            await engine.dispose()
         
+        await message.answer("\n".join(response), parse_mode="HTML")
+    
     except Exception as e:
         logger.error(f"Error in cmd_admin_channels: {e}")
         await message.answer(f"❌ Произошла ошибка: {e}")
 
+# Admin subscriptions report
+async def build_subscriptions_report(session: AsyncSession, progress: Progress) -> str:
+    """Subscription totals, top-15 channels and the 10 latest subscriptions"""
+    # Get statistics from the counters
+    await progress("Счётчики подписок (1/3)")
+    counters = await get_counters(session)
+    active_subs = counters['subscriptions_active']
+    inactive_subs = counters['subscriptions_total'] - active_subs
+    
+    # Subscriptions by channel
+    await progress("Топ каналов (2/3)")
+    channels_subs = await get_channel_counters(session, limit=15)
+    
+    # Format response
+    response_text = f"{hbold('Статистика подписок')}\n\n"
+    response_text += f"Активных подписок: {active_subs}\n"
+    response_text += f"Неактивных подписок: {inactive_subs}\n"
+    response_text += f"Всего подписок: {active_subs + inactive_subs}\n\n"
+    
+    response_text += f"{hbold('Топ-15 каналов по подпискам:')}\n\n"
+    
+    for idx, channel in enumerate(channels_subs, 1):
+        channel_id = channel[1] or "Неизвестный ID"
+        channel_title = channel[2] or "Неизвестный канал"
+        total_subs = channel[4]
+        channel_active_subs = channel[5]
+        
+        response_text += f"{idx}. {hbold(channel_title)}\n"
+        response_text += f"   • ID канала: {channel_id}\n"
+        response_text += f"   • Всего подписок: {total_subs}\n"
+        response_text += f"   • Активных подписок: {channel_active_subs}\n\n"
+    
+    # Recent subscriptions
+    await progress("Последние подписки (3/3)")
+    recent_result = await session.execute(
+        text("""
+        SELECT 
+            s.id,
+            s.user_id,
+            u.username,
+            c.name as channel_title,
+            s.start_date,
+            s.is_active
+        FROM 
+            subscriptions s
+        LEFT JOIN 
+            users u ON s.user_id = u.id
+        LEFT JOIN 
+            channels c ON s.channel_id = c.id
+        ORDER BY 
+            s.start_date DESC
+        LIMIT 10
+        """).columns(start_date=DateTime)
+    )
+    
+    recent_subs = recent_result.fetchall()
+    
+    response_text += f"{hbold('Последние 10 подписок:')}\n\n"
+    
+    for sub in recent_subs:
+        sub_id = sub[0]
+        user_id = sub[1]
+        username = sub[2] or "Неизвестный пользователь"
+        channel_title = sub[3] or "Неизвестный канал"
+        created_at = sub[4].strftime('%d.%m.%Y %H:%M') if sub[4] else "Не указано"
+        is_active = "Активна" if sub[5] else "Неактивна"
+        
+        response_text += f"{hbold(f'Подписка ID: {sub_id}')}\n"
+        response_text += f"   • Пользователь: {username} (ID: {user_id})\n"
+        response_text += f"   • Канал: {channel_title}\n"
+        response_text += f"   • Дата создания: {created_at}\n"
+        response_text += f"   • Статус: {is_active}\n\n"
+    
+    return response_text
+
 # Admin subscriptions command handler
 async def cmd_admin_subscriptions(message: types.Message):
     """Handle /admin_subscriptions command - show subscription details"""
     user_id = message.from_user.id
     logger.info(f"[DEBUG] cmd_admin_subscriptions for user {user_id}")
     
-    try:
-        # Create a fresh database connection for this event loop
-        import os
-        from dotenv import load_dotenv
-        from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-        from sqlalchemy.orm import sessionmaker
-        
-        # Load environment variables if needed
-        load_dotenv()
-        
-        # Get database URL
-        db_url = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///bot_database.db")
-        logger.info(f"[DEBUG] Creating new DB engine for admin_subscriptions with URL: {db_url[:db_url.find(':')]}://...elided...")
-        
-        # Create new engine and session factory for this event loop
-        engine = create_async_engine(db_url, echo=False, pool_timeout=30)
-        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
-        
-        async with get_session(session_factory) as session:
-            # Check if user is admin
-            if not await is_admin(session, user_id):
-                await message.answer("У вас нет прав администратора.")
-                await engine.dispose()
-                return
-            
-            # Get statistics
-            # Active subscriptions
-            active_result = await session.execute(
-                text("SELECT COUNT(*) FROM subscriptions WHERE is_active = true")
-            )
-            active_subs = active_result.scalar() or 0
-            
-            # Inactive subscriptions
-            inactive_result = await session.execute(
-                text("SELECT COUNT(*) FROM subscriptions WHERE is_active = false")
-            )
-            inactive_subs = inactive_result.scalar() or 0
-            
-            # Subscriptions by channel
-            channels_result = await session.execute(
-                text("""
-                SELECT 
-                    c.id,
-                    c.channel_id,
-                    c.name,
-                    COUNT(s.id) as total_subs,
-                    SUM(CASE WHEN s.is_active = true THEN 1 ELSE 0 END) as active_subs
-                FROM 
-                    channels c
-                LEFT JOIN 
-                    subscriptions s ON c.id = s.channel_id
-                GROUP BY 
-                    c.id, c.channel_id, c.name
-                ORDER BY 
-                    active_subs DESC
-                LIMIT 15
-                """)
-            )
-            
-            channels_subs = channels_result.fetchall()
-            
-            # Format response
-            response_text = f"{hbold('Статистика подписок')}\n\n"
-            response_text += f"Активных подписок: {active_subs}\n"
-            response_text += f"Неактивных подписок: {inactive_subs}\n"
-            response_text += f"Всего подписок: {active_subs + inactive_subs}\n\n"
-            
-            response_text += f"{hbold('Топ-15 каналов по подпискам:')}\n\n"
-            
-            for idx, channel in enumerate(channels_subs, 1):
-                channel_id = channel[1] or "Неизвестный ID"
-                channel_title = channel[2] or "Неизвестный канал"
-                total_subs = channel[3] or 0
-                active_subs = channel[4] or 0
-                
-                response_text += f"{idx}. {hbold(channel_title)}\n"
-                response_text += f"   • ID канала: {channel_id}\n"
-                response_text += f"   • Всего подписок: {total_subs}\n"
-                response_text += f"   • Активных подписок: {active_subs}\n\n"
-            
-            # Recent subscriptions
-            recent_result = await session.execute(
-                text("""
-                SELECT 
-                    s.id,
-                    s.user_id,
-                    u.username,
-                    c.name as channel_title,
-                    s.created_at,
-                    s.is_active
-                FROM 
-                    subscriptions s
-                LEFT JOIN 
-                    users u ON s.user_id = u.id
-                LEFT JOIN 
-                    channels c ON s.channel_id = c.id
-                ORDER BY 
-                    s.created_at DESC
-                LIMIT 10
-                """)
-            )
-            
-            recent_subs = recent_result.fetchall()
-            
-            response_text += f"{hbold('Последние 10 подписок:')}\n\n"
-            
-            for sub in recent_subs:
-                sub_id = sub[0]
-                user_id = sub[1]
-                username = sub[2] or "Неизвестный пользователь"
-                channel_title = sub[3] or "Неизвестный канал"
-                created_at = sub[4].strftime('%d.%m.%Y %H:%M') if sub[4] else "Не указано"
-                is_active = "Активна" if sub[5] else "Неактивна"
-                
-                response_text += f"{hbold(f'Подписка ID: {sub_id}')}\n"
-                response_text += f"   • Пользователь: {username} (ID: {user_id})\n"
-                response_text += f"   • Канал: {channel_title}\n"
-                response_text += f"   • Дата создания: {created_at}\n"
-                response_text += f"   • Статус: {is_active}\n\n"
-            
-            # Show statistics
-            await message.answer(response_text, parse_mode="HTML")
-            await engine.dispose()
-            
-    except Exception as e:
-        logger.error(f"[DEBUG] Error in cmd_admin_subscriptions: {e}", exc_info=True)
-        await message.answer("Произошла ошибка при получении статистики подписок.")
+    await report_runner.run(message, "admin_subscriptions", build_subscriptions_report)
 
 # Add channel command handler
-async def cmd_add_channel(message: types.Message):
+async def cmd_add_channel(message: types.Message, session: AsyncSession):
     """Handle /add_channel command - add a new channel"""
     user_id = message.from_user.id
     logger.info(f"[DEBUG] cmd_add_channel for user {user_id}")
     
     try:
-        # Create a fresh database connection for this event loop
-        import os
-        from dotenv import load_dotenv
-        from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-        from sqlalchemy.orm import sessionmaker
-        
-        # Load environment variables if needed
-        load_dotenv()
+        # Parse command arguments
+        try:
+            _, channel_id, *name_parts = message.text.split()
+            channel_id = int(channel_id)
+            name = " ".join(name_parts)
+            
+            if not name:
+                raise ValueError("Name is required")
+                
+        except ValueError as e:
+            await message.answer(
+                f"❌ Ошибка в формате команды: {e}\n"
+                f"Формат: /add_channel CHANNEL_ID NAME"
+            )
+            return
         
-        # Get database URL
-        db_url = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///bot_database.db")
-        logger.info(f"[DEBUG] Creating new DB engine for add_channel with URL: {db_url[:db_url.find(':')]}://...elided...")
+        # Check if channel already exists
+        existing_channel = await session.scalar(
+            text("SELECT id FROM channels WHERE channel_id = :channel_id").bindparams(channel_id=channel_id)
+        )
         
-        # Create new engine and session factory for this event loop
-        engine = create_async_engine(db_url, echo=False, pool_timeout=30)
-        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        if existing_channel:
+            await message.answer(f"❌ Канал с ID {channel_id} уже существует.")
+            return
         
-        async with get_session(session_factory) as session:
-            # Check if user is admin
-            if not await is_admin(session, user_id):
-                await message.answer("У вас нет прав администратора.")
-                await engine.dispose()
-                return
-            
-            # Parse command arguments
-            try:
-                _, channel_id, *name_parts = message.text.split()
-                channel_id = int(channel_id)
-                name = " ".join(name_parts)
-                
-                if not name:
-                    raise ValueError("Name is required")
-                    
-            except ValueError as e:
-                await message.answer(
-                    f"❌ Ошибка в формате команды: {e}\n"
-                    f"Формат: /add_channel CHANNEL_ID NAME"
-                )
-                await engine.dispose()
-                return
-            
-            # Check if channel already exists
-            existing_channel = await session.scalar(
-                text("SELECT id FROM channels WHERE channel_id = :channel_id").bindparams(channel_id=channel_id)
+        # Add channel to database
+        try:
+            # Create new channel
+            await session.execute(
+                text("INSERT INTO channels (channel_id, name, is_active) VALUES (:channel_id, :name, true)"),
+                {"channel_id": channel_id, "name": name}
             )
+            await channel_added(session, is_active=True)
+            mark_catalog_changed(session)
             
-            if existing_channel:
-                await message.answer(f"❌ Канал с ID {channel_id} уже существует.")
-                await engine.dispose()
-                return
-            
-            # Add channel to database
-            try:
-                # Create new channel
-                await session.execute(
-                    text("INSERT INTO channels (channel_id, name, is_active) VALUES (:channel_id, :name, true)"),
-                    {"channel_id": channel_id, "name": name}
-                )
-                await session.commit()
-                
-                await message.answer(f"✅ Канал {name} успешно добавлен!")
-            except Exception as e:
-                logger.error(f"Failed to add channel: {e}")
-                await message.answer(f"❌ Ошибка при добавлении канала: {e}")
-            
-            await engine.dispose()
+            await message.answer(f"✅ Канал {name} успешно добавлен!")
+        except Exception as e:
+            logger.error(f"Failed to add channel: {e}")
+            await message.answer(f"❌ Ошибка при добавлении канала: {e}")
+        
     
     except Exception as e:
         logger.error(f"[DEBUG] Error in cmd_add_channel: {e}", exc_info=True)
         await message.answer("Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 # Toggle channel command handler
-async def cmd_toggle_channel(message: types.Message):
+async def cmd_toggle_channel(message: types.Message, session: AsyncSession):
     """Handle /toggle_channel command - toggle channel active status"""
     user_id = message.from_user.id
     logger.info(f"[DEBUG] cmd_toggle_channel for user {user_id}")
     
     try:
-        # Create a fresh database connection for this event loop
-        import os
-        from dotenv import load_dotenv
-        from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-        from sqlalchemy.orm import sessionmaker
-        
-        # Load environment variables if needed
-        load_dotenv()
+        # Parse command arguments
+        try:
+            _, channel_id = message.text.split()
+            channel_id = int(channel_id)
+        except ValueError:
+            await message.answer(
+                "❌ Ошибка в формате команды.\n"
+                "Формат: /toggle_channel CHANNEL_ID"
+            )
+            return
         
-        # Get database URL
-        db_url = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///bot_database.db")
-        logger.info(f"[DEBUG] Creating new DB engine for toggle_channel with URL: {db_url[:db_url.find(':')]}://...elided...")
+        # Check if channel exists
+        channel = await session.scalar(
+            text("SELECT is_active FROM channels WHERE id = :channel_id").bindparams(channel_id=channel_id)
+        )
         
-        # Create new engine and session factory for this event loop
-        engine = create_async_engine(db_url, echo=False, pool_timeout=30)
-        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        if channel is None:
+            await message.answer(f"❌ Канал с ID {channel_id} не найден.")
+            return
         
-        async with get_session(session_factory) as session:
-            # Check if user is admin
-            if not await is_admin(session, user_id):
-                await message.answer("У вас нет прав администратора.")
-                await engine.dispose()
-                return
-            
-            # Parse command arguments
-            try:
-                _, channel_id = message.text.split()
-                channel_id = int(channel_id)
-            except ValueError:
-                await message.answer(
-                    "❌ Ошибка в формате команды.\n"
-                    "Формат: /toggle_channel CHANNEL_ID"
-                )
-                await engine.dispose()
-                return
-            
-            # Check if channel exists
-            channel = await session.scalar(
-                text("SELECT is_active FROM channels WHERE id = :channel_id").bindparams(channel_id=channel_id)
+        # Toggle channel status
+        try:
+            new_status = not channel
+            await session.execute(
+                text("UPDATE channels SET is_active = :new_status WHERE id = :channel_id"),
+                {"new_status": new_status, "channel_id": channel_id}
             )
+            await channel_toggled(session, new_status)
+            mark_catalog_changed(session)
             
-            if channel is None:
-                await message.answer(f"❌ Канал с ID {channel_id} не найден.")
-                await engine.dispose()
-                return
-            
-            # Toggle channel status
-            try:
-                new_status = not channel
-                await session.execute(
-                    text("UPDATE channels SET is_active = :new_status WHERE id = :channel_id"),
-                    {"new_status": new_status, "channel_id": channel_id}
-                )
-                await session.commit()
-                
-                status_text = "активирован" if new_status else "деактивирован"
-                await message.answer(f"✅ Канал успешно {status_text}!")
-            except Exception as e:
-                logger.error(f"Failed to toggle channel: {e}")
-                await message.answer(f"❌ Ошибка при изменении статуса канала: {e}")
-            
-            await engine.dispose()
+            status_text = "активирован" if new_status else "деактивирован"
+            await message.answer(f"✅ Канал успешно {status_text}!")
+        except Exception as e:
+            logger.error(f"Failed to toggle channel: {e}")
+            await message.answer(f"❌ Ошибка при изменении статуса канала: {e}")
+        
     
     except Exception as e:
         logger.error(f"[DEBUG] Error in cmd_toggle_channel: {e}", exc_info=True)
         await message.answer("Произошла ошибка. Пожалуйста, попробуйте позже.")
 
-# Add tariff command handler
-async def cmd_add_tariff(message: types.Message):
-    """Handle /add_tariff command - add a new tariff"""
+# Access mode command handler
+async def cmd_access_mode(message: types.Message, session: AsyncSession):
+    """Handle /access_mode command - switch between single-use invite links and join requests"""
     user_id = message.from_user.id
-    logger.info(f"[DEBUG] cmd_add_tariff for user {user_id}")
+    logger.info(f"[DEBUG] cmd_access_mode for user {user_id}")
     
     try:
-        # Create a fresh database connection for this event loop
-        import os
-        from dotenv import load_dotenv
-        from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-        from sqlalchemy.orm import sessionmaker
+        # Parse command arguments
+        try:
+            _, channel_id, mode = message.text.split()
+            channel_id = int(channel_id)
+            if mode not in ACCESS_MODES:
+                raise ValueError(f"Unknown mode {mode}")
+        except ValueError:
+            await message.answer(
+                "❌ Ошибка в формате команды.\n"
+                f"Формат: /access_mode CHANNEL_ID {'|'.join(ACCESS_MODES)}"
+            )
+            return
         
-        # Load environment variables if needed
-        load_dotenv()
+        channel = await session.get(Channel, channel_id)
+        if channel is None:
+            await message.answer(f"❌ Канал с ID {channel_id} не найден.")
+            return
         
-        # Get database URL
-        db_url = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///bot_database.db")
-        logger.info(f"[DEBUG] Creating new DB engine for add_tariff with URL: {db_url[:db_url.find(':')]}://...elided...")
+        # One shared link; the bot approves join requests from subscribers
+        if mode == ACCESS_JOIN_REQUEST and not channel.join_link:
+            join_link = await message.bot.create_chat_invite_link(
+                chat_id=channel.channel_id,
+                name="Подписчики",
+                creates_join_request=True
+            )
+            channel.join_link = join_link.invite_link
         
-        # Create new engine and session factory for this event loop
-        engine = create_async_engine(db_url, echo=False, pool_timeout=30)
-        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        channel.access_mode = mode
+        mark_catalog_changed(session)
         
-        async with get_session(session_factory) as session:
-            # Check if user is admin
-            if not await is_admin(session, user_id):
-                await message.answer("У вас нет прав администратора.")
-                await engine.dispose()
-                return
-            
-            # Parse command arguments
-            try:
-                parts = message.text.split()
-                if len(parts) < 5:
-                    raise ValueError("Not enough arguments")
-                    
-                _, channel_id, name, days, price = parts[0], int(parts[1]), parts[2], int(parts[3]), int(parts[4])
-                
-                # Check if channel exists
-                channel = await session.scalar(
-                    text("SELECT id FROM channels WHERE channel_id = :channel_id").bindparams(channel_id=channel_id)
-                )
-                
-                if channel is None:
-                    await message.answer(f"❌ Канал с ID {channel_id} не найден.")
-                    await engine.dispose()
-                    return
+        await message.answer(f"✅ Режим доступа канала {channel.name}: {mode}")
+    
+    except Exception as e:
+        logger.error(f"[DEBUG] Error in cmd_access_mode: {e}", exc_info=True)
+        await message.answer(f"❌ Произошла ошибка: {e}")
+
+# Add tariff command handler
+async def cmd_add_tariff(message: types.Message, session: AsyncSession):
+    """Handle /add_tariff command - add a new tariff"""
+    user_id = message.from_user.id
+    logger.info(f"[DEBUG] cmd_add_tariff for user {user_id}")
+    
+    try:
+        # Parse command arguments
+        try:
+            parts = message.text.split()
+            if len(parts) < 5:
+                raise ValueError("Not enough arguments")
                 
-            except ValueError as e:
-                await message.answer(
-                    f"❌ Ошибка в формате команды: {e}\n"
-                    f"Формат: /add_tariff CHANNEL_ID NAME DAYS PRICE"
-                )
-                await engine.dispose()
+            _, channel_id, name, days, price = parts[0], int(parts[1]), parts[2], int(parts[3]), int(parts[4])
+            
+            # Check if channel exists
+            channel = await session.scalar(
+                text("SELECT id FROM channels WHERE channel_id = :channel_id").bindparams(channel_id=channel_id)
+            )
+            
+            if channel is None:
+                await message.answer(f"❌ Канал с ID {channel_id} не найден.")
                 return
             
-            # Add tariff to database
-            try:
-                # Create new tariff
-                await session.execute(
-                    text("""
-                    INSERT INTO tariffs (channel_id, name, description, duration_days, price_stars, is_active) 
-                    VALUES (:channel_id, :name, :description, :duration_days, :price_stars, 1)
-                    """),
-                    {
-                        "channel_id": channel_id, 
-                        "name": name, 
-                        "description": f"Подписка на {days} дней",
-                        "duration_days": days,
-                        "price_stars": price
-                    }
-                )
-                await session.commit()
-                
-                await message.answer(
-                    f"✅ Тариф {name} успешно добавлен!\n"
-                    f"Длительность: {days} дней\n"
-                    f"Цена: {price} Stars"
-                )
-            except Exception as e:
-                logger.error(f"Failed to add tariff: {e}")
-                await message.answer(f"❌ Ошибка при добавлении тарифа: {e}")
+        except ValueError as e:
+            await message.answer(
+                f"❌ Ошибка в формате команды: {e}\n"
+                f"Формат: /add_tariff CHANNEL_ID NAME DAYS PRICE"
+            )
+            return
+        
+        # Add tariff to database
+        try:
+            # Create new tariff
+            await session.execute(
+                text("""
+                INSERT INTO tariffs (channel_id, name, description, duration_days, price_stars, is_active) 
+                VALUES (:channel_id, :name, :description, :duration_days, :price_stars, 1)
+                """),
+                {
+                    "channel_id": channel_id, 
+                    "name": name, 
+                    "description": f"Подписка на {days} дней",
+                    "duration_days": days,
+                    "price_stars": price
+                }
+            )
+            mark_catalog_changed(session)
             
-            await engine.dispose()
+            await message.answer(
+                f"✅ Тариф {name} успешно добавлен!\n"
+                f"Длительность: {days} дней\n"
+                f"Цена: {price} Stars"
+            )
+        except Exception as e:
+            logger.error(f"Failed to add tariff: {e}")
+            await message.answer(f"❌ Ошибка при добавлении тарифа: {e}")
+        
     
     except Exception as e:
         logger.error(f"[DEBUG] Error in cmd_add_tariff: {e}", exc_info=True)
         await message.answer("Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 # Add subscription command handler
-async def cmd_add_sub(message: types.Message):
+async def cmd_add_sub(message: types.Message, session: AsyncSession):
     """Handle /add_sub command - add a subscription manually"""
     user_id = message.from_user.id
     logger.info(f"[DEBUG] cmd_add_sub for user {user_id}")
     
     try:
-        # Create a fresh database connection for this event loop
-        import os
-        from dotenv import load_dotenv
-        from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-        from sqlalchemy.orm import sessionmaker
-        
-        # Load environment variables if needed
-        load_dotenv()
-        
-        # Get database URL
-        db_url = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///bot_database.db")
-        logger.info(f"[DEBUG] Creating new DB engine for add_sub with URL: {db_url[:db_url.find(':')]}://...elided...")
-        
-        # Create new engine and session factory for this event loop
-        engine = create_async_engine(db_url, echo=False, pool_timeout=30)
-        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
-        
-        async with get_session(session_factory) as session:
-            # Check if user is admin
-            if not await is_admin(session, user_id):
-                await message.answer("У вас нет прав администратора.")
-                await engine.dispose()
-                return
+        # Parse command arguments
+        try:
+            _, target_user_id, channel_id, tariff_id = message.text.split()
+            target_user_id = int(target_user_id)
+            channel_id = int(channel_id)
+            tariff_id = int(tariff_id)
+            
+            # Check if user exists
+            user = await session.scalar(
+                text("SELECT id FROM users WHERE user_id = :user_id").bindparams(user_id=target_user_id)
+            )
             
-            # Parse command arguments
-            try:
-                _, target_user_id, channel_id, tariff_id = message.text.split()
-                target_user_id = int(target_user_id)
-                channel_id = int(channel_id)
-                tariff_id = int(tariff_id)
-                
-                # Check if user exists
-                user = await session.scalar(
-                    text("SELECT id FROM users WHERE user_id = :user_id").bindparams(user_id=target_user_id)
-                )
-                
-                if user is None:
-                    await message.answer(f"❌ Пользователь с ID {target_user_id} не найден.")
-                    await engine.dispose()
-                    return
-                    
-                # Check if channel exists
-                channel = await session.scalar(
-                    text("SELECT id FROM channels WHERE channel_id = :channel_id").bindparams(channel_id=channel_id)
-                )
-                
-                if channel is None:
-                    await message.answer(f"❌ Канал с ID {channel_id} не найден.")
-                    await engine.dispose()
-                    return
-                    
-                # Check if tariff exists
-                tariff_query = await session.execute(
-                    text("SELECT id, duration_days FROM tariffs WHERE id = :tariff_id").bindparams(tariff_id=tariff_id)
-                )
-                tariff = tariff_query.first()
+            if user is None:
+                await message.answer(f"❌ Пользователь с ID {target_user_id} не найден.")
+                return
                 
-                if tariff is None:
-                    await message.answer(f"❌ Тариф с ID {tariff_id} не найден.")
-                    await engine.dispose()
-                    return
-                    
-                duration_days = tariff[1]
+            # Check if channel exists
+            channel = await session.scalar(
+                text("SELECT id FROM channels WHERE channel_id = :channel_id").bindparams(channel_id=channel_id)
+            )
+            
+            if channel is None:
+                await message.answer(f"❌ Канал с ID {channel_id} не найден.")
+                return
                 
-            except ValueError:
-                await message.answer(
-                    "❌ Ошибка в формате команды.\n"
-                    "Формат: /add_sub USER_ID CHANNEL_ID TARIFF_ID"
-                )
-                await engine.dispose()
+            # Check if tariff exists
+            tariff_query = await session.execute(
+                text("SELECT id, duration_days FROM tariffs WHERE id = :tariff_id").bindparams(tariff_id=tariff_id)
+            )
+            tariff = tariff_query.first()
+            
+            if tariff is None:
+                await message.answer(f"❌ Тариф с ID {tariff_id} не найден.")
                 return
+                
+            duration_days = tariff[1]
+            
+        except ValueError:
+            await message.answer(
+                "❌ Ошибка в формате команды.\n"
+                "Формат: /add_sub USER_ID CHANNEL_ID TARIFF_ID"
+            )
+            return
+        
+        # Add subscription to database
+        try:
+            # Creates the row or extends the active one, and keeps the counters in step
+            _, end_date = await create_subscription(
+                session,
+                target_user_id,
+                channel,
+                tariff_id,
+                duration_days=duration_days
+            )
             
-            # Add subscription to database
+            # Generate invite link
             try:
-                # Calculate end date
-                start_date = datetime.utcnow()
-                end_date = start_date.replace(
-                    day=(start_date.day + duration_days) % 30 or 30,
-                    month=start_date.month + (start_date.day + duration_days) // 30
-                )
-                
-                # Create new subscription
-                await session.execute(
-                    text("""
-                    INSERT INTO subscriptions 
-                    (user_id, channel_id, tariff_id, start_date, end_date, is_active) 
-                    VALUES (:user_id, :channel_id, :tariff_id, :start_date, :end_date, true)
-                    """),
-                    {
-                        "user_id": user, 
-                        "channel_id": channel, 
-                        "tariff_id": tariff_id,
-                        "start_date": start_date,
-                        "end_date": end_date
-                    }
-                )
-                await session.commit()
-                
-                # Generate invite link
-                try:
-                    channel_tg_id = await session.scalar(
-                        text("SELECT channel_id FROM channels WHERE id = :channel_id").bindparams(channel_id=channel_id)
-                    )
-                    invite_link = await message.bot.create_chat_invite_link(
-                        chat_id=channel_tg_id,
-                        expire_date=datetime.now() + timedelta(hours=1),
-                        member_limit=1
-                    )
-                    link_text = f"\n\nПригласительная ссылка: {invite_link.invite_link}"
-                except Exception as e:
-                    logger.error(f"Failed to generate invite link: {e}")
-                    link_text = "\n\nНе удалось создать пригласительную ссылку."
-                
-                await message.answer(
-                    f"✅ Подписка успешно добавлена!\n"
-                    f"Пользователь: {target_user_id}\n"
-                    f"Канал ID: {channel_id}\n"
-                    f"Тариф ID: {tariff_id}\n"
-                    f"Действует до: {end_date.strftime('%d.%m.%Y')}"
-                    f"{link_text}"
-                )
+                invite_link = await get_access_link(channel_id)
+                link_text = f"\n\nПригласительная ссылка: {invite_link}"
             except Exception as e:
-                logger.error(f"Failed to add subscription: {e}")
-                await message.answer(f"❌ Ошибка при добавлении подписки: {e}")
-            
-            await engine.dispose()
+                logger.error(f"Failed to generate invite link: {e}")
+                link_text = "\n\nНе удалось создать пригласительную ссылку."
+            
+            await message.answer(
+                f"✅ Подписка успешно добавлена!\n"
+                f"Пользователь: {target_user_id}\n"
+                f"Канал ID: {channel_id}\n"
+                f"Тариф ID: {tariff_id}\n"
+                f"Действует до: {end_date.strftime('%d.%m.%Y')}"
+                f"{link_text}"
+            )
+        except Exception as e:
+            logger.error(f"Failed to add subscription: {e}")
+            await message.answer(f"❌ Ошибка при добавлении подписки: {e}")
+        
     
     except Exception as e:
         logger.error(f"[DEBUG] Error in cmd_add_sub: {e}", exc_info=True)
         await message.answer("Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 # Delete subscription command handler
-async def cmd_del_sub(message: types.Message):
+async def cmd_del_sub(message: types.Message, session: AsyncSession):
     """Handle /del_sub command - delete a subscription"""
     user_id = message.from_user.id
     logger.info(f"[DEBUG] cmd_del_sub for user {user_id}")
     
     try:
-        # Create a fresh database connection for this event loop
-        import os
-        from dotenv import load_dotenv
-        from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-        from sqlalchemy.orm import sessionmaker
-        
-        # Load environment variables if needed
-        load_dotenv()
+        # Parse command arguments
+        try:
+            _, sub_id = message.text.split()
+            sub_id = int(sub_id)
+        except ValueError:
+            await message.answer(
+                "❌ Ошибка в формате команды.\n"
+                "Формат: /del_sub SUBSCRIPTION_ID"
+            )
+            return
         
-        # Get database URL
-        db_url = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///bot_database.db")
-        logger.info(f"[DEBUG] Creating new DB engine for del_sub with URL: {db_url[:db_url.find(':')]}://...elided...")
+        # Check if subscription exists
+        sub_query = await session.execute(
+            text("""
+            SELECT s.id, u.user_id, c.channel_id, c.name, s.user_id, s.channel_id
+            FROM subscriptions s
+            JOIN users u ON s.user_id = u.id
+            JOIN channels c ON s.channel_id = c.id
+            WHERE s.id = :sub_id
+            """).bindparams(sub_id=sub_id)
+        )
+        sub = sub_query.first()
         
-        # Create new engine and session factory for this event loop
-        engine = create_async_engine(db_url, echo=False, pool_timeout=30)
-        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        if sub is None:
+            await message.answer(f"❌ Подписка с ID {sub_id} не найдена.")
+            return
         
-        async with get_session(session_factory) as session:
-            # Check if user is admin
-            if not await is_admin(session, user_id):
-                await message.answer("У вас нет прав администратора.")
-                await engine.dispose()
-                return
-            
-            # Parse command arguments
-            try:
-                _, sub_id = message.text.split()
-                sub_id = int(sub_id)
-            except ValueError:
-                await message.answer(
-                    "❌ Ошибка в формате команды.\n"
-                    "Формат: /del_sub SUBSCRIPTION_ID"
-                )
-                await engine.dispose()
-                return
-            
-            # Check if subscription exists
-            sub_query = await session.execute(
-                text("""
-                SELECT s.id, u.user_id, c.channel_id, c.name
-                FROM subscriptions s
-                JOIN users u ON s.user_id = u.id
-                JOIN channels c ON s.channel_id = c.id
-                WHERE s.id = :sub_id
-                """).bindparams(sub_id=sub_id)
+        # Delete subscription from database
+        try:
+            # Mark subscription as inactive
+            result = await session.execute(
+                text("UPDATE subscriptions SET is_active = false WHERE id = :sub_id AND is_active = true").bindparams(sub_id=sub_id)
             )
-            sub = sub_query.first()
-            
-            if sub is None:
-                await message.answer(f"❌ Подписка с ID {sub_id} не найдена.")
-                await engine.dispose()
-                return
+            if result.rowcount:
+                await subscription_ended(session, sub[4], sub[5])
+            revoke_after_commit(session, sub[1], sub[2])
             
-            # Delete subscription from database
+            # Try to kick user from channel
             try:
-                # Mark subscription as inactive
-                await session.execute(
-                    text("UPDATE subscriptions SET is_active = false WHERE id = :sub_id").bindparams(sub_id=sub_id)
+                await message.bot.ban_chat_member(
+                    chat_id=sub[2],  # channel_id
+                    user_id=sub[1],  # user_id
                 )
-                await session.commit()
-                
-                # Try to kick user from channel
-                try:
-                    await message.bot.ban_chat_member(
-                        chat_id=sub[2],  # channel_id
-                        user_id=sub[1],  # user_id
-                    )
-                    
-                    # Immediately unban so user can re-subscribe later
-                    await message.bot.unban_chat_member(
-                        chat_id=sub[2],  # channel_id
-                        user_id=sub[1],  # user_id
-                        only_if_banned=True
-                    )
-                    
-                    kick_text = "\nПользователь удален из канала."
-                except Exception as e:
-                    logger.error(f"Failed to kick user from channel: {e}")
-                    kick_text = "\nНе удалось удалить пользователя из канала."
                 
-                await message.answer(
-                    f"✅ Подписка успешно деактивирована!\n"
-                    f"ID: {sub_id}\n"
-                    f"Пользователь: {sub[1]}\n"
-                    f"Канал: {sub[3]}{kick_text}"
+                # Immediately unban so user can re-subscribe later
+                await message.bot.unban_chat_member(
+                    chat_id=sub[2],  # channel_id
+                    user_id=sub[1],  # user_id
+                    only_if_banned=True
                 )
+                
+                kick_text = "\nПользователь удален из канала."
             except Exception as e:
-                logger.error(f"Failed to deactivate subscription: {e}")
-                await message.answer(f"❌ Ошибка при деактивации подписки: {e}")
-            
-            await engine.dispose()
+                logger.error(f"Failed to kick user from channel: {e}")
+                kick_text = "\nНе удалось удалить пользователя из канала."
+            
+            await message.answer(
+                f"✅ Подписка успешно деактивирована!\n"
+                f"ID: {sub_id}\n"
+                f"Пользователь: {sub[1]}\n"
+                f"Канал: {sub[3]}{kick_text}"
+            )
+        except Exception as e:
+            logger.error(f"Failed to deactivate subscription: {e}")
+            await message.answer(f"❌ Ошибка при деактивации подписки: {e}")
+        
     
     except Exception as e:
         logger.error(f"[DEBUG] Error in cmd_del_sub: {e}", exc_info=True)
         await message.answer("Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 # Admin users command handler
-async def cmd_admin_users(message: types.Message):
+async def cmd_admin_users(message: types.Message, session: AsyncSession):
     """Command /admin_users - показывает статистику по пользователям."""
     try:
         user_id = message.from_user.id
         
-        # Create a fresh database connection for this event loop
-        import os
-        from dotenv import load_dotenv
-        from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-        from sqlalchemy.orm import sessionmaker
+        logger.debug(f"Admin {user_id} requested users statistics")
         
-        # Load environment variables if needed
-        load_dotenv()
+        # Получаем общее количество пользователей
+        total_users = (await get_counters(session))['users_total']
         
-        # Get database URL
-        db_url = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///bot_database.db")
-        logger.info(f"[DEBUG] Creating new DB engine for admin_users with URL: {db_url[:db_url.find(':')]}://...elided...")
+        # Количество пользователей за последние 7 дней
+        week_ago = datetime.now() - timedelta(days=7)
+        new_users_week = await session.scalar(
+            text("SELECT COUNT(*) FROM users WHERE created_at >= :week_ago").bindparams(week_ago=week_ago)
+        )
         
-        # Create new engine and session factory for this event loop
-        engine = create_async_engine(db_url, echo=False, pool_timeout=30)
-        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        # Количество активных пользователей (отправивших сообщение за последние 30 дней)
+        month_ago = datetime.now() - timedelta(days=30)
+        active_users = await session.scalar(
+            text("SELECT COUNT(*) FROM users WHERE last_active >= :month_ago").bindparams(month_ago=month_ago)
+        )
         
-        async with get_session(session_factory) as session:
-            # Проверяем права администратора
-            if not await is_admin(session, user_id):
-                await message.answer("⛔️ У вас нет прав для выполнения этой команды.")
-                await engine.dispose()
-                return
-            
-            logger.debug(f"Admin {user_id} requested users statistics")
-            
-            # Получаем общее количество пользователей
-            total_users = await session.scalar(
-                text("SELECT COUNT(*) FROM users")
-            )
-            
-            # Количество пользователей за последние 7 дней
-            week_ago = datetime.now() - timedelta(days=7)
-            new_users_week = await session.scalar(
-                text("SELECT COUNT(*) FROM users WHERE created_at >= :week_ago").bindparams(week_ago=week_ago)
-            )
-            
-            # Количество активных пользователей (отправивших сообщение за последние 30 дней)
-            month_ago = datetime.now() - timedelta(days=30)
-            active_users = await session.scalar(
-                text("SELECT COUNT(*) FROM users WHERE last_active >= :month_ago").bindparams(month_ago=month_ago)
-            )
-            
-            # Последние 10 зарегистрированных пользователей
-            latest_users = await session.execute(
-                text("SELECT user_id, username, created_at FROM users ORDER BY created_at DESC LIMIT 10")
-            )
-            latest_users_list = latest_users.fetchall()
-            
-            # Формируем ответ
-            response = [
-                f"📊 <b>Статистика пользователей:</b>\n",
-                f"👥 Всего пользователей: <b>{total_users}</b>",
-                f"🆕 Новых за неделю: <b>{new_users_week}</b>",
-                f"🔄 Активных за месяц: <b>{active_users}</b>\n",
-                f"🔍 <b>Последние 10 пользователей:</b>"
-            ]
-            
-            for user in latest_users_list:
-                user_id, username, created_at = user
-                username_display = f"@{username}" if username else "Без username"
-                created_date = created_at.strftime('%d.%m.%Y') if created_at else "Дата неизвестна"
-                response.append(
-                    f"• ID: {user_id} | {username_display} | {created_date}"
-                )
-            
-            await message.answer("\n".join(response), parse_mode="HTML")
-            await engine.dispose()
+        # Формируем ответ: статистика и первая страница пользователей
+        header = "\n".join([
+            f"📊 <b>Статистика пользователей:</b>\n",
+            f"👥 Всего пользователей: <b>{total_users}</b>",
+            f"🆕 Новых за неделю: <b>{new_users_week}</b>",
+            f"🔄 Активных за месяц: <b>{active_users}</b>\n\n"
+        ])
         
+        await screens.send(message, await render_listing(session, "users", header=header))
+    
     except Exception as e:
         logger.error(f"Error in cmd_admin_users: {e}")
         await message.answer(f"❌ Произошла ошибка: {e}")
 
+# Admin posts report
+async def build_posts_report(session: AsyncSession, progress: Progress) -> str:
+    """Статистика по постам: всего, за неделю, по каналам и последние 5."""
+    # Получаем статистику по постам
+    # Общее количество постов
+    await progress("Количество постов (1/3)")
+    total_posts = await session.scalar(
+        text("SELECT COUNT(*) FROM posts")
+    )
+    
+    # Количество постов за последние 7 дней
+    week_ago = datetime.now() - timedelta(days=7)
+    new_posts_week = await session.scalar(
+        text("SELECT COUNT(*) FROM posts WHERE created_at >= :week_ago").bindparams(week_ago=week_ago)
+    )
+    
+    # Количество постов по каналам
+    await progress("Посты по каналам (2/3)")
+    channel_stats = await session.execute(
+        text("""
+        SELECT 
+            c.name,
+            COUNT(p.id) as post_count
+        FROM 
+            posts p
+        JOIN 
+            channels c ON p.channel_id = c.id
+        GROUP BY 
+            c.id, c.name
+        ORDER BY 
+            post_count DESC
+        LIMIT 10
+        """)
+    )
+    channel_stats_list = channel_stats.fetchall()
+    
+    # Последние 5 постов
+    await progress("Последние посты (3/3)")
+    latest_posts = await session.execute(
+        text("""
+        SELECT 
+            p.id,
+            p.created_at,
+            p.text,
+            c.name
+        FROM 
+            posts p
+        JOIN
+            channels c ON p.channel_id = c.id
+        ORDER BY 
+            p.created_at DESC
+        LIMIT 5
+        """)
+    )
+    latest_posts_list = latest_posts.fetchall()
+    
+    # Формируем ответ
+    response = [
+        f"📝 <b>Статистика постов:</b>\n",
+        f"📄 Всего постов: <b>{total_posts}</b>",
+        f"🆕 Новых за неделю: <b>{new_posts_week}</b>\n",
+        f"📊 <b>Топ-10 каналов по количеству постов:</b>"
+    ]
+    
+    for channel_name, post_count in channel_stats_list:
+        channel_name = channel_name or "Неизвестный канал"
+        response.append(f"• {channel_name}: <b>{post_count}</b> постов")
+    
+    response.append("\n🔍 <b>Последние 5 постов:</b>")
+    
+    for post in latest_posts_list:
+        post_id, created_at, post_text, channel_name = post
+        created_date = created_at.strftime('%d.%m.%Y %H:%M') if created_at else "Дата неизвестна"
+        channel_name = channel_name or "Неизвестный канал"
+        truncated_text = post_text[:50] + "..." if post_text and len(post_text) > 50 else "Нет текста"
+        response.append(
+            f"• {created_date} | {channel_name} | {truncated_text}"
+        )
+    
+    return "\n".join(response)
+
 # Admin posts command handler
 async def cmd_admin_posts(message: types.Message):
     """Command /admin_posts - показывает статистику по постам."""
+    user_id = message.from_user.id
+    
+    logger.debug(f"Admin {user_id} requested posts statistics")
+    
+    await report_runner.run(message, "admin_posts", build_posts_report)
+
+# Payment funnel latency command handler
+async def cmd_latency(message: types.Message):
+    """Command /latency - p50/p95/p99 of each payment funnel stage since startup"""
+    snapshot = tracer.snapshot()
+    
+    if not snapshot:
+        await message.answer("Данных о задержках пока нет.")
+        return
+    
+    response = ["⏱ <b>Задержки воронки оплаты (мс):</b>\n"]
+    for stage, stats in snapshot.items():
+        response.append(
+            f"{hcode(stage)}\n"
+            f"  n={stats['count']} | p50={stats['p50']:.0f} | p95={stats['p95']:.0f} | p99={stats['p99']:.0f}"
+        )
+    
+    response.append(
+        f"\nPre-checkout: лимит {PRE_CHECKOUT_DEADLINE:.0f} с, "
+        f"просрочено ответов: <b>{tracer.deadline_misses}</b>"
+    )
+    
+    await message.answer("\n".join(response), parse_mode="HTML")
+
+# Revenue report command handler
+def render_revenue(report: RevenueReport) -> str:
+    """Text of the /revenue report: totals, channels, then days (or weeks for longer periods)"""
+    days = (report.until - report.since).days + 1
+    total = report.total
+    response = [
+        f"📈 <b>Выручка за {days} дн.</b> ({report.since.strftime('%d.%m')} – {report.until.strftime('%d.%m.%Y')})\n",
+        f"⭐ Заработано: <b>{total.stars:,}</b> Stars",
+        f"🆕 Новых подписок: <b>{total.new_subscriptions}</b>",
+        f"🔁 Продлений: <b>{total.renewals}</b>",
+        f"⌛ Истекло: <b>{total.expirations}</b>"
+    ]
+    
+    if report.by_channel:
+        response.append("\n📺 <b>По каналам:</b>")
+        for channel_id, totals in sorted(report.by_channel.items(), key=lambda item: -item[1].stars):
+            channel = catalog.channels.get(channel_id)
+            name = channel.name if channel else f"ID {channel_id}"
+            response.append(f"• {name}: {totals.stars:,} ⭐ | +{totals.new_subscriptions} / 🔁{totals.renewals} / ⌛{totals.expirations}")
+    
+    # A line per day for a week, per week for longer periods
+    step = 1 if days <= 7 else 7
+    response.append(f"\n🗓 <b>{'По дням' if step == 1 else 'По неделям'}:</b>")
+    start = report.since
+    while start <= report.until:
+        end = min(start + timedelta(days=step - 1), report.until)
+        stars = sum(
+            totals.stars for day, totals in report.by_day.items() if start <= day <= end
+        )
+        label = start.strftime('%d.%m') if step == 1 else f"{start.strftime('%d.%m')}–{end.strftime('%d.%m')}"
+        response.append(f"{label}: {stars:,} ⭐")
+        start = end + timedelta(days=1)
+    
+    return "\n".join(response)
+
+async def cmd_revenue(message: types.Message, session: AsyncSession):
+    """Command /revenue [7|30|90] - stars and subscription activity from the daily rollups"""
     try:
-        user_id = message.from_user.id
-        
-        # Create a fresh database connection for this event loop
-        import os
-        from dotenv import load_dotenv
-        from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-        from sqlalchemy.orm import sessionmaker
-        
-        # Load environment variables if needed
-        load_dotenv()
-        
-        # Get database URL
-        db_url = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///bot_database.db")
-        logger.info(f"[DEBUG] Creating new DB engine for admin_posts with URL: {db_url[:db_url.find(':')]}://...elided...")
-        
-        # Create new engine and session factory for this event loop
-        engine = create_async_engine(db_url, echo=False, pool_timeout=30)
-        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        args = message.get_args()
+        days = int(args) if args else REPORT_PERIODS[0]
+        if days not in REPORT_PERIODS:
+            raise ValueError(days)
+    except ValueError:
+        await message.answer(
+            "❌ Ошибка в формате команды.\n"
+            f"Формат: /revenue [{'|'.join(str(days) for days in REPORT_PERIODS)}]"
+        )
+        return
+    
+    try:
+        report = await get_revenue_report(session, days)
+        await message.answer(render_revenue(report), parse_mode="HTML")
+    except Exception as e:
+        logger.error(f"[DEBUG] Error in cmd_revenue: {e}", exc_info=True)
+        await message.answer("Произошла ошибка при получении отчёта о выручке.")
+
+# Cohort retention command handler
+async def cmd_cohorts(message: types.Message, session: AsyncSession):
+    """Command /cohorts [CHANNEL_ID] - retention by monthly cohort, churn and renewals"""
+    try:
+        args = message.get_args()
+        channel_id = int(args) if args else None
+    except ValueError:
+        await message.answer(
+            "❌ Ошибка в формате команды.\n"
+            "Формат: /cohorts [CHANNEL_ID]"
+        )
+        return
+    
+    try:
+        report = await build_report(session, channel_id)
         
-        async with get_session(session_factory) as session:
-            # Проверяем права администратора
-            if not await is_admin(session, user_id):
-                await message.answer("⛔️ У вас нет прав для выполнения этой команды.")
-                await engine.dispose()
-                return
-            
-            logger.debug(f"Admin {user_id} requested posts statistics")
-            
-            # Получаем статистику по постам
-            # Общее количество постов
-            total_posts = await session.scalar(
-                text("SELECT COUNT(*) FROM posts")
-            )
-            
-            # Количество постов за последние 7 дней
-            week_ago = datetime.now() - timedelta(days=7)
-            new_posts_week = await session.scalar(
-                text("SELECT COUNT(*) FROM posts WHERE created_at >= :week_ago").bindparams(week_ago=week_ago)
-            )
-            
-            # Количество постов по каналам
-            channel_stats = await session.execute(
-                text("""
-                SELECT 
-                    c.name,
-                    COUNT(p.id) as post_count
-                FROM 
-                    posts p
-                JOIN 
-                    channels c ON p.channel_id = c.id
-                GROUP BY 
-                    c.id, c.name
-                ORDER BY 
-                    post_count DESC
-                LIMIT 10
-                """)
-            )
-            channel_stats_list = channel_stats.fetchall()
-            
-            # Последние 5 постов
-            latest_posts = await session.execute(
-                text("""
-                SELECT 
-                    p.id,
-                    p.created_at,
-                    p.text,
-                    c.name
-                FROM 
-                    posts p
-                JOIN
-                    channels c ON p.channel_id = c.id
-                ORDER BY 
-                    p.created_at DESC
-                LIMIT 5
-                """)
+        title = "📉 <b>Удержание по когортам</b>"
+        if channel_id is not None:
+            channel = catalog.channels.get(channel_id)
+            title += f" — {channel.name if channel else f'ID {channel_id}'}"
+        await message.answer(f"{title}\n\n{hpre(render_report(report))}", parse_mode="HTML")
+    except Exception as e:
+        logger.error(f"[DEBUG] Error in cmd_cohorts: {e}", exc_info=True)
+        await message.answer("Произошла ошибка при расчёте удержания.")
+
+# Expiration forecast command handler
+async def cmd_expiry_forecast(message: types.Message, session: AsyncSession, settings: Settings):
+    """Command /expiry_forecast - subscriptions expected to expire over the next 7 days"""
+    try:
+        forecast = await build_forecast(session)
+        
+        response = [
+            f"⏳ <b>Окончания подписок на {HORIZON.days} дн.</b>\n",
+            f"Всего: <b>{forecast.total}</b>\n",
+            "🗓 <b>По дням:</b>"
+        ]
+        for day, count in enumerate(forecast.per_day().tolist()):
+            response.append(f"{(forecast.start + timedelta(days=day)).strftime('%d.%m')}: {count}")
+        
+        busiest = forecast.busiest_hours(5)
+        if busiest:
+            response.append("\n🔥 <b>Пиковые часы (UTC):</b>")
+            for hour, count in busiest:
+                workers = revocation_concurrency(count, settings.expiry_max_concurrency)
+                response.append(f"{hour.strftime('%d.%m %H:00')} — {count} (воркеров: {workers})")
+        
+        per_channel = forecast.per_channel()
+        if per_channel:
+            response.append("\n📺 <b>По каналам:</b>")
+            for channel_id, count in sorted(per_channel.items(), key=lambda item: -item[1]):
+                channel = catalog.channels.get(channel_id)
+                response.append(f"• {channel.name if channel else f'ID {channel_id}'}: {count}")
+        
+        response.append(f"\nМаксимум воркеров отзыва: {settings.expiry_max_concurrency}")
+        await message.answer("\n".join(response), parse_mode="HTML")
+    except Exception as e:
+        logger.error(f"[DEBUG] Error in cmd_expiry_forecast: {e}", exc_info=True)
+        await message.answer("Произошла ошибка при построении прогноза.")
+
+# Export command handler
+async def cmd_export(message: types.Message):
+    """Command /export TABLE [csv|jsonl] - the whole table as a compressed document"""
+    args = message.get_args().split()
+    table = args[0].lower() if args else ""
+    fmt = args[1].lower() if len(args) > 1 else FORMAT_CSV
+    if table not in EXPORTS or fmt not in EXPORT_FORMATS or len(args) > 2:
+        await message.answer(
+            "❌ Ошибка в формате команды.\n"
+            f"Формат: /export {'|'.join(EXPORTS)} [{'|'.join(EXPORT_FORMATS)}]"
+        )
+        return
+    
+    async def work(session: AsyncSession, progress: Progress) -> str:
+        async def rows_written(count: int):
+            await progress(f"Выгружено строк: {count}")
+        
+        path = export_path(table, fmt)
+        try:
+            count = await export_table(session, table, fmt, path, rows_written)
+            size = os.path.getsize(path)
+            if size > MAX_DOCUMENT_SIZE:
+                return f"❌ Файл выгрузки ({size // 2**20} МБ) больше лимита Telegram в {MAX_DOCUMENT_SIZE // 2**20} МБ."
+            
+            await message.answer_document(
+                types.InputFile(path, filename=export_filename(table, fmt)),
+                caption=f"{table}: {count} строк"
             )
-            latest_posts_list = latest_posts.fetchall()
-            
-            # Формируем ответ
-            response = [
-                f"📝 <b>Статистика постов:</b>\n",
-                f"📄 Всего постов: <b>{total_posts}</b>",
-                f"🆕 Новых за неделю: <b>{new_posts_week}</b>\n",
-                f"📊 <b>Топ-10 каналов по количеству постов:</b>"
-            ]
-            
-            for channel_name, post_count in channel_stats_list:
-                channel_name = channel_name or "Неизвестный канал"
-                response.append(f"• {channel_name}: <b>{post_count}</b> постов")
-            
-            response.append("\n🔍 <b>Последние 5 постов:</b>")
-            
-            for post in latest_posts_list:
-                post_id, created_at, text, channel_name = post
-                created_date = created_at.strftime('%d.%m.%Y %H:%M') if created_at else "Дата неизвестна"
-                channel_name = channel_name or "Неизвестный канал"
-                truncated_text = text[:50] + "..." if text and len(text) > 50 else "Нет текста"
-                response.append(
-                    f"• {created_date} | {channel_name} | {truncated_text}"
-                )
-            
-            await message.answer("\n".join(response), parse_mode="HTML")
-            await engine.dispose()
+        finally:
+            os.remove(path)
+        return f"✅ Выгрузка {hcode(table)} готова: {count} строк."
+    
+    # One export of a table and format per chat at a time
+    await report_runner.run_job(message, f"export:{message.chat.id}:{table}:{fmt}", work)
+
+def import_usage() -> str:
+    lines = ["Отправьте CSV-файл с подписью /import ТИП (или ответьте этой командой на файл).", "Колонки:"]
+    for kind, required in REQUIRED_COLUMNS.items():
+        optional = "".join(f",[{column}]" for column in OPTIONAL_COLUMNS[kind])
+        lines.append(f"• {kind}: {','.join(required)}{optional}")
+    return "\n".join(lines)
+
+def render_import_summary(summary: ImportSummary, shown_errors: int = 10) -> str:
+    response = [
+        f"📥 <b>Импорт {summary.kind}</b>",
+        f"Строк: {len(summary.results)}",
+        f"Импортировано: {summary.imported}"
+    ]
+    if summary.kind == IMPORT_SUBSCRIPTIONS:
+        response.append(f"Из них продлено: {summary.renewals}")
+    
+    errors = summary.errors
+    response.append(f"Ошибок: {len(errors)}")
+    for result in errors[:shown_errors]:
+        response.append(f"• строка {result.line}: {quote_html(result.error)}")
+    if len(errors) > shown_errors:
+        response.append(f"… и ещё {len(errors) - shown_errors}, см. файл с результатами")
+    return "\n".join(response)
+
+# Bulk import command handler
+async def cmd_import(message: types.Message):
+    """Command /import subscriptions|channels - import the rows of an uploaded CSV"""
+    kind = (message.get_args() or "").strip().lower()
+    document = message.document or (message.reply_to_message and message.reply_to_message.document)
+    if kind not in REQUIRED_COLUMNS or document is None:
+        await message.answer(f"❌ Ошибка в формате команды.\n{import_usage()}")
+        return
+    if document.file_size and document.file_size > MAX_IMPORT_SIZE:
+        await message.answer(f"❌ Файл больше {MAX_IMPORT_SIZE // 2**20} МБ, разбейте его на части.")
+        return
+    
+    async def work(session: AsyncSession, progress: Progress) -> str:
+        async def batch_done(summary: ImportSummary):
+            await progress(f"Обработано строк: {len(summary.results)}, ошибок: {len(summary.errors)}")
         
+        with tempfile.TemporaryFile() as file:
+            await document.download(destination_file=file)
+            file.seek(0)
+            try:
+                summary = await import_csv(session, file, kind, batch_done)
+            except RowError as e:
+                return f"❌ {quote_html(str(e))}\n{import_usage()}"
+        
+        if summary.errors or kind == IMPORT_SUBSCRIPTIONS:
+            await message.answer_document(
+                types.InputFile(io.BytesIO(render_results(summary).encode()), filename=f"import-{kind}-results.csv"),
+                caption="Результат по строкам"
+            )
+        return render_import_summary(summary)
+    
+    await report_runner.run_job(message, f"import:{message.chat.id}:{document.file_unique_id}", work)
+
+# Broadcast command handlers
+async def cmd_broadcast(message: types.Message, session: AsyncSession):
+    """Command /broadcast CHANNEL_ID|all TEXT - message the active subscribers"""
+    args = (message.get_args() or "").split(maxsplit=1)
+    channel = None
+    try:
+        target, broadcast_text = args
+        if target.lower() != "all":
+            channel = catalog.channels_by_chat_id.get(int(target))
+            if channel is None:
+                await message.answer(f"❌ Канал с ID {target} не найден.")
+                return
+    except ValueError:
+        await message.answer(
+            "❌ Ошибка в формате команды.\n"
+            "Формат: /broadcast CHANNEL_ID|all ТЕКСТ"
+        )
+        return
+    
+    try:
+        broadcast = await broadcaster.create(session, message.chat.id, channel.id if channel else None, broadcast_text)
+        status = await message.answer(render_broadcast_progress(broadcast))
+        # Delivery starts once this is committed and keeps this message up to date
+        broadcast.status_message_id = status.message_id
     except Exception as e:
-        logger.error(f"Error in cmd_admin_posts: {e}")
-        await message.answer(f"❌ Произошла ошибка: {e}")
+        logger.error(f"[DEBUG] Error in cmd_broadcast: {e}", exc_info=True)
+        await message.answer("Произошла ошибка при создании рассылки.")
+
+async def cmd_broadcast_cancel(message: types.Message, session: AsyncSession):
+    """Command /broadcast_cancel ID - stop a running broadcast"""
+    try:
+        broadcast_id = int(message.get_args())
+    except ValueError:
+        await message.answer(
+            "❌ Ошибка в формате команды.\n"
+            "Формат: /broadcast_cancel ID"
+        )
+        return
+    
+    if await broadcaster.cancel(session, broadcast_id):
+        await message.answer(f"⛔ Рассылка #{broadcast_id} будет остановлена после текущей пачки.")
+    else:
+        await message.answer(f"❌ Рассылка #{broadcast_id} не найдена или уже завершена.")
+
+async def cmd_broadcasts(message: types.Message, session: AsyncSession):
+    """Command /broadcasts - the latest broadcasts and why messages were not delivered"""
+    broadcasts = (await session.execute(
+        select(Broadcast).order_by(Broadcast.id.desc()).limit(5)
+    )).scalars().all()
+    if not broadcasts:
+        await message.answer("Рассылок ещё не было.")
+        return
+    
+    response = []
+    for broadcast in broadcasts:
+        response.append(render_broadcast_progress(broadcast))
+        errors = (await session.execute(
+            select(BroadcastDeadLetter.error, func.count())
+            .where(BroadcastDeadLetter.broadcast_id == broadcast.id)
+            .group_by(BroadcastDeadLetter.error)
+            .order_by(func.count().desc())
+            .limit(3)
+        )).all()
+        for error, count in errors:
+            response.append(f"   • {error}: {count}")
+        response.append("")
+    await message.answer("\n".join(response))
+
+async def cmd_reload_settings(message: types.Message):
+    """Command /reload_settings - re-read .env and the environment without a restart"""
+    settings = reload_settings(Dispatcher.get_current())
+    logger.info(f"Admin {message.from_user.id} reloaded settings")
+    await message.answer(
+        f"✅ Настройки перечитаны. Администраторов из ADMIN_IDS: {len(settings.admin_ids)}.\n"
+        "Токен бота, база данных и интервалы планировщика меняются только после перезапуска."
+    )
+
+# Non-admin fallback handlers
+async def cmd_admin_denied(message: types.Message):
+    """Reply to admin commands sent by non-admins"""
+    await message.answer("У вас нет прав администратора.")
+
+async def callback_admin_denied(callback_query: types.CallbackQuery):
+    """Reply to admin panel callbacks sent by non-admins"""
+    await callback_query.answer("У вас нет прав администратора.")
+
+ADMIN_COMMANDS = [
+    "admin", "admin_stats", "admin_channels", "admin_subscriptions", "admin_users", "admin_posts",
+    "add_channel", "toggle_channel", "access_mode", "add_tariff", "add_sub", "del_sub",
+    "latency", "revenue", "cohorts", "expiry_forecast", "export", "import",
+    "broadcast", "broadcast_cancel", "broadcasts", "reload_settings"
+]
+
+ADMIN_CALLBACKS = [
+    "admin_stats", "admin_channels", "admin_subs", "back_to_admin", 
+    "add_channel", "toggle_channel", "add_tariff", "add_sub", "del_sub"
+]
 
 # Register admin handlers
-def register_admin_handlers(dp: Dispatcher):
+def register_admin_handlers(dp: Dispatcher, router: CallbackRouter):
     """Register all admin handlers"""
-    dp.register_message_handler(cmd_admin, Command("admin"))
-    dp.register_message_handler(cmd_admin_stats, Command("admin_stats"))
-    dp.register_message_handler(cmd_admin_channels, Command("admin_channels"))
-    dp.register_message_handler(cmd_admin_subscriptions, Command("admin_subscriptions"))
-    dp.register_message_handler(cmd_admin_users, Command("admin_users"))
-    dp.register_message_handler(cmd_admin_posts, Command("admin_posts"))
-    
-    dp.register_message_handler(cmd_add_channel, Command("add_channel"))
-    dp.register_message_handler(cmd_toggle_channel, Command("toggle_channel"))
-    dp.register_message_handler(cmd_add_tariff, Command("add_tariff"))
-    dp.register_message_handler(cmd_add_sub, Command("add_sub"))
-    dp.register_message_handler(cmd_del_sub, Command("del_sub"))
+    # is_admin=True is checked against the in-memory admin set before any session is opened
+    dp.register_message_handler(cmd_admin, Command("admin"), is_admin=True)
+    dp.register_message_handler(cmd_admin_stats, Command("admin_stats"), is_admin=True)
+    dp.register_message_handler(cmd_admin_channels, Command("admin_channels"), is_admin=True)
+    dp.register_message_handler(cmd_admin_subscriptions, Command("admin_subscriptions"), is_admin=True)
+    dp.register_message_handler(cmd_admin_users, Command("admin_users"), is_admin=True)
+    dp.register_message_handler(cmd_admin_posts, Command("admin_posts"), is_admin=True)
+    
+    dp.register_message_handler(cmd_add_channel, Command("add_channel"), is_admin=True)
+    dp.register_message_handler(cmd_toggle_channel, Command("toggle_channel"), is_admin=True)
+    dp.register_message_handler(cmd_access_mode, Command("access_mode"), is_admin=True)
+    dp.register_message_handler(cmd_add_tariff, Command("add_tariff"), is_admin=True)
+    dp.register_message_handler(cmd_add_sub, Command("add_sub"), is_admin=True)
+    dp.register_message_handler(cmd_del_sub, Command("del_sub"), is_admin=True)
+    dp.register_message_handler(cmd_latency, Command("latency"), is_admin=True)
+    dp.register_message_handler(cmd_revenue, Command("revenue"), is_admin=True)
+    dp.register_message_handler(cmd_cohorts, Command("cohorts"), is_admin=True)
+    dp.register_message_handler(cmd_expiry_forecast, Command("expiry_forecast"), is_admin=True)
+    dp.register_message_handler(cmd_export, Command("export"), is_admin=True)
+    dp.register_message_handler(cmd_broadcast, Command("broadcast"), is_admin=True)
+    dp.register_message_handler(cmd_broadcast_cancel, Command("broadcast_cancel"), is_admin=True)
+    dp.register_message_handler(cmd_broadcasts, Command("broadcasts"), is_admin=True)
+    dp.register_message_handler(cmd_reload_settings, Command("reload_settings"), is_admin=True)
+    dp.register_message_handler(
+        cmd_import, Command("import", ignore_caption=False), is_admin=True,
+        content_types=[types.ContentType.TEXT, types.ContentType.DOCUMENT]
+    )
     
     # Регистрируем обработчик callback-запросов
-    dp.register_callback_query_handler(admin_callback_handler, lambda c: c.data in [
-        "admin_stats", "admin_channels", "admin_subs", "back_to_admin", 
-        "add_channel", "toggle_channel", "add_tariff", "add_sub", "del_sub"
-    ]) 
\ No newline at end of file
+    admin_only = AdminFilter(is_admin=True).check
+    for callback_data in ADMIN_CALLBACKS:
+        router.register(callback_data, admin_callback_handler, guard=admin_only, denied=callback_admin_denied)
+    router.register(
+        PAGE_CALLBACK, callback_admin_page,
+        args={"listing": str, "direction": str, "cursor": str},
+        guard=admin_only, denied=callback_admin_denied
+    )
+    
+    # Everything that reaches this was rejected by the admin filter
+    dp.register_message_handler(cmd_admin_denied, Command(ADMIN_COMMANDS))
@@ -4,11 +4,19 @@ from aiogram import Dispatcher, types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.dispatcher.filters import CommandStart, Command
 from aiogram.utils.markdown import hbold
+from sqlalchemy import DateTime, bindparam, text
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.utils.db import get_session
+from app.config import Settings
+from app.utils.db import after_commit
+from app.utils.callback_router import CallbackRouter
+from app.services.auth import admin_registry
+from app.services.render_cache import RenderedScreen, render_cache
 from app.services.user import get_or_create_user
 from app.services.channel import get_active_channels
-from app.services.subscription import get_user_subscriptions
+from app.services.screens import screens
+from app.services.stats import user_created
+from app.services.subscription import get_subscription_summaries
 
 logger = logging.getLogger(__name__)
 
@@ -23,15 +31,9 @@ logger = logging.getLogger(__name__)
 #         logger.info(f"EXITING cmd_start for user {user_id}")
 
 # ПРОСТОЙ ТЕСТОВЫЙ ОБРАБОТЧИК
-async def cmd_start(message: types.Message):
+async def cmd_start(message: types.Message, settings: Settings):
     logger.info(f"SIMPLE cmd_start called for user {message.from_user.id}")
     try:
-        # Create keyboard with a simple button
-        keyboard = InlineKeyboardMarkup()
-        keyboard.add(
-            InlineKeyboardButton(text="ℹ️ Помощь", callback_data="help")
-        )
-        
         # Get the bot instance - check multiple ways
         bot_instance = None
         try:
@@ -56,10 +58,7 @@ async def cmd_start(message: types.Message):
         
         # Send the welcome message
         logger.info(f"[DEBUG] About to send message to user {message.from_user.id}")
-        result = await message.answer(
-            "Добро пожаловать! Я бот для управления подписками на каналы. Чем могу помочь?", 
-            reply_markup=keyboard
-        )
+        result = await screens.send(message, render_cache.static("start", render_start))
         logger.info(f"[DEBUG] Message sent successfully, message_id: {result.message_id}")
         
     except Exception as e:
@@ -70,9 +69,8 @@ async def cmd_start(message: types.Message):
         try:
             # Import at top level to avoid circular imports
             import requests
-            import os
             
-            bot_token = os.getenv("BOT_TOKEN")
+            bot_token = settings.bot_token
             send_url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
             
             payload = {
@@ -85,9 +83,25 @@ async def cmd_start(message: types.Message):
         except Exception as fallback_error:
             logger.error(f"Even fallback failed: {fallback_error}", exc_info=True)
 
+def render_start() -> RenderedScreen:
+    """Build the welcome screen"""
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(
+        InlineKeyboardButton(text="ℹ️ Помощь", callback_data="help")
+    )
+    
+    return RenderedScreen.build(
+        "Добро пожаловать! Я бот для управления подписками на каналы. Чем могу помочь?",
+        keyboard
+    )
+
 # Help command handler
 async def cmd_help(message: types.Message):
     """Handle /help command"""
+    await screens.send(message, render_cache.static("help", render_help))
+
+def render_help() -> RenderedScreen:
+    """Build the help screen"""
     help_text = (
         f"{hbold('Как пользоваться ботом:')}\n\n"
         f"1️⃣ Выберите канал, на который хотите подписаться\n"
@@ -110,108 +124,74 @@ async def cmd_help(message: types.Message):
         )
     )
     
-    await message.answer(
-        help_text,
-        reply_markup=keyboard,
-        parse_mode="HTML"
-    )
+    return RenderedScreen.build(help_text, keyboard)
 
 # My subscriptions command handler
-async def cmd_my_subscriptions(message: types.Message):
+async def cmd_my_subscriptions(message: types.Message, session: AsyncSession):
     """Handle /mysubscriptions command"""
     user_id = message.from_user.id
     logger.info(f"[DEBUG] cmd_my_subscriptions for user {user_id}")
     
     try:
-        # Create a fresh database connection for this event loop
-        import os
-        from dotenv import load_dotenv
-        from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-        from sqlalchemy.orm import sessionmaker
-        
-        # Load environment variables if needed
-        load_dotenv()
-        
-        # Get database URL
-        db_url = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///bot_database.db")
-        logger.info(f"[DEBUG] Creating new DB engine for mysubscriptions with URL: {db_url[:db_url.find(':')]}://...elided...")
-        
-        # Create new engine and session factory for this event loop
-        engine = create_async_engine(db_url, echo=False, pool_timeout=30)
-        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
-        
-        # Use the session factory to get user subscriptions
-        async with get_session(session_factory) as session:
-            # Get user's active subscriptions
-            subscriptions = await get_user_subscriptions(session, user_id)
-            
-            if subscriptions:
-                subs_text = f"{hbold('Ваши активные подписки:')}\n\n"
-                for sub in subscriptions:
-                    end_date = sub.end_date.strftime("%d.%m.%Y %H:%M")
-                    subs_text += f"📌 {sub.channel.name}\n"
-                    subs_text += f"📅 Активна до: {end_date}\n"
-                    subs_text += f"💰 Тариф: {sub.tariff.name}\n\n"
-            else:
-                subs_text = "У вас нет активных подписок."
-            
-            # Create keyboard
-            keyboard = InlineKeyboardMarkup()
-            keyboard.add(
-                InlineKeyboardButton(
-                    text="🔄 Обновить",
-                    callback_data="refresh_subscriptions"
-                )
-            )
-            keyboard.add(
-                InlineKeyboardButton(
-                    text="🔙 Вернуться в главное меню",
-                    callback_data="back_to_start"
-                )
-            )
-            
-            # Send the response
-            await message.answer(
-                subs_text,
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-            
-            # Clean up resources
-            await engine.dispose()
+        screen = await render_my_subscriptions(session, user_id)
+        await screens.send(message, screen)
             
     except Exception as e:
         logger.error(f"[DEBUG] Error in cmd_my_subscriptions: {e}", exc_info=True)
         await message.answer("Произошла ошибка при получении ваших подписок. Пожалуйста, попробуйте позже.")
 
+async def render_my_subscriptions(session: AsyncSession, user_id: int) -> RenderedScreen:
+    """Build the active subscriptions screen of a user"""
+    subscriptions = await get_subscription_summaries(session, user_id)
+    
+    if subscriptions:
+        subs_text = f"{hbold('Ваши активные подписки:')}\n\n"
+        for channel_name, tariff_name, end_date in subscriptions:
+            subs_text += f"📌 {channel_name}\n"
+            subs_text += f"📅 Активна до: {end_date.strftime('%d.%m.%Y %H:%M')}\n"
+            subs_text += f"💰 Тариф: {tariff_name}\n\n"
+    else:
+        subs_text = "У вас нет активных подписок."
+    
+    # Create keyboard
+    keyboard = render_cache.markup("my_subscriptions", build_my_subscriptions_keyboard)
+    
+    return RenderedScreen(text=subs_text, reply_markup=keyboard)
+
+def build_my_subscriptions_keyboard() -> InlineKeyboardMarkup:
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(
+        InlineKeyboardButton(
+            text="🔄 Обновить",
+            callback_data="refresh_subscriptions"
+        )
+    )
+    keyboard.add(
+        InlineKeyboardButton(
+            text="🔙 Вернуться в главное меню",
+            callback_data="back_to_start"
+        )
+    )
+    return keyboard
+
 # Callback handler for back to start button
 async def callback_back_to_start(callback_query: types.CallbackQuery):
     """Handle back to start button"""
     await callback_query.answer()
     
-    # Create a modified message with the correct user_id
-    message = callback_query.message
-    # Make sure the correct user_id is available
-    message.from_user = callback_query.from_user
-    
-    # Call start command handler with the modified message
-    await cmd_start(message)
+    # Redraw the message the button belongs to; no call at all if it already shows the menu
+    await screens.show(callback_query.message, render_cache.static("start", render_start))
 
 # Callback handler for help button
 async def callback_help(callback_query: types.CallbackQuery):
     """Handle help button"""
     await callback_query.answer()
     
-    # Create a modified message with the correct user_id
-    message = callback_query.message
-    # Make sure the correct user_id is available
-    message.from_user = callback_query.from_user
-    
-    # Call help command handler with the modified message
-    await cmd_help(message)
+    # Redraw the message the button belongs to; no call at all if it already shows help
+    await screens.show(callback_query.message, render_cache.static("help", render_help))
 
 # Make admin command handler
-async def cmd_make_admin(message: types.Message):
+async def cmd_make_admin(message: types.Message, session: AsyncSession, settings: Settings):
     """Handle /makeadmin command - make user an admin with password"""
     user_id = message.from_user.id
     logger.info(f"[DEBUG] cmd_make_admin for user {user_id}")
@@ -239,63 +219,40 @@ async def cmd_make_admin(message: types.Message):
             return
         
         # Check password
-        admin_password = "301402503"
-        if password != admin_password:
+        if password != settings.admin_password:
             logger.info(f"[DEBUG] makeadmin: Неверный пароль: {password}")
             await message.answer("❌ Неверный пароль.")
             return
             
-        # Create a fresh database connection for this event loop
-        import os
-        from dotenv import load_dotenv
-        from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-        from sqlalchemy.orm import sessionmaker
-        from sqlalchemy import text
+        # Get user
+        query = text("SELECT id FROM users WHERE user_id = :user_id")
+        logger.info(f"[DEBUG] makeadmin: Выполняем запрос с user_id={user_id}")
+        user_query = await session.execute(query, {"user_id": user_id})
+        user_id_db = user_query.scalar()
+        logger.info(f"[DEBUG] makeadmin: Получен id из базы: {user_id_db}")
         
-        # Load environment variables if needed
-        load_dotenv()
+        if not user_id_db:
+            logger.info(f"[DEBUG] makeadmin: Пользователь не найден в БД")
+            await message.answer("❌ Пользователь не найден в базе данных. Сначала используйте команду /start")
+            return
         
-        # Get database URL
-        db_url = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///bot_database.db")
-        logger.info(f"[DEBUG] Creating new DB engine for makeadmin with URL: {db_url[:db_url.find(':')]}://...elided...")
+        # Update user to admin
+        update_query = text("UPDATE users SET is_admin = true WHERE id = :user_id_db")
+        logger.info(f"[DEBUG] makeadmin: Обновляем пользователя id={user_id_db}")
+        await session.execute(update_query, {"user_id_db": user_id_db})
         
-        # Create new engine and session factory for this event loop
-        engine = create_async_engine(db_url, echo=False, pool_timeout=30)
-        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        # Refresh the in-memory admin set once the change is committed
+        after_commit(session, lambda: admin_registry.add(user_id))
         
-        async with get_session(session_factory) as session:
-            # Get user
-            from app.models import User
-            query = text("SELECT id FROM users WHERE user_id = :user_id")
-            logger.info(f"[DEBUG] makeadmin: Выполняем запрос с user_id={user_id}")
-            user_query = await session.execute(query, {"user_id": user_id})
-            user_id_db = user_query.scalar()
-            logger.info(f"[DEBUG] makeadmin: Получен id из базы: {user_id_db}")
-            
-            if not user_id_db:
-                logger.info(f"[DEBUG] makeadmin: Пользователь не найден в БД")
-                await message.answer("❌ Пользователь не найден в базе данных. Сначала используйте команду /start")
-                await engine.dispose()
-                return
-            
-            # Update user to admin
-            update_query = text("UPDATE users SET is_admin = true WHERE id = :user_id_db")
-            logger.info(f"[DEBUG] makeadmin: Обновляем пользователя id={user_id_db}")
-            await session.execute(update_query, {"user_id_db": user_id_db})
-            await session.commit()
-            logger.info(f"[DEBUG] makeadmin: Транзакция завершена успешно")
-            
-            await message.answer("✅ Вы успешно стали администратором!")
-            logger.info(f"[DEBUG] makeadmin: Сообщение отправлено пользователю")
-            await engine.dispose()
-            logger.info(f"[DEBUG] makeadmin: Соединение с БД закрыто")
+        await message.answer("✅ Вы успешно стали администратором!")
+        logger.info(f"[DEBUG] makeadmin: Сообщение отправлено пользователю")
     
     except Exception as e:
         logger.error(f"[DEBUG] Error in cmd_make_admin: {e}", exc_info=True)
         await message.answer("Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 # Make admin command handler
-async def cmd_create_user(message: types.Message):
+async def cmd_create_user(message: types.Message, session: AsyncSession):
     """Handle /createuser command - create user in database"""
     user_id = message.from_user.id
     username = message.from_user.username or ""
@@ -305,84 +262,64 @@ async def cmd_create_user(message: types.Message):
     logger.info(f"[DEBUG] cmd_create_user for user {user_id}, @{username}")
     
     try:
-        # Create a fresh database connection for this event loop
-        import os
-        from dotenv import load_dotenv
-        from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-        from sqlalchemy.orm import sessionmaker
-        from sqlalchemy import text
+        # Check if user already exists
+        query = text("SELECT id FROM users WHERE user_id = :user_id")
+        logger.info(f"[DEBUG] createuser: Проверяем существование пользователя с user_id={user_id}")
+        user_query = await session.execute(query, {"user_id": user_id})
+        user_id_db = user_query.scalar()
         
-        # Load environment variables if needed
-        load_dotenv()
+        if user_id_db:
+            logger.info(f"[DEBUG] createuser: Пользователь уже существует в БД, id={user_id_db}")
+            await message.answer("✅ Пользователь уже существует в базе данных.")
+            return
         
-        # Get database URL
-        db_url = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///bot_database.db")
-        logger.info(f"[DEBUG] Creating new DB engine for createuser with URL: {db_url[:db_url.find(':')]}://...elided...")
+        # Create user
+        is_admin = user_id in admin_registry.env_admin_ids
         
-        # Create new engine and session factory for this event loop
-        engine = create_async_engine(db_url, echo=False, pool_timeout=30)
-        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        logger.info(f"[DEBUG] createuser: ADMIN_IDS={sorted(admin_registry.env_admin_ids)}, is_admin={is_admin}")
         
-        async with get_session(session_factory) as session:
-            # Check if user already exists
-            from app.models import User
-            query = text("SELECT id FROM users WHERE user_id = :user_id")
-            logger.info(f"[DEBUG] createuser: Проверяем существование пользователя с user_id={user_id}")
-            user_query = await session.execute(query, {"user_id": user_id})
-            user_id_db = user_query.scalar()
-            
-            if user_id_db:
-                logger.info(f"[DEBUG] createuser: Пользователь уже существует в БД, id={user_id_db}")
-                await message.answer("✅ Пользователь уже существует в базе данных.")
-                await engine.dispose()
-                return
-            
-            # Create user
-            admin_ids = os.getenv("ADMIN_IDS", "").split(",")
-            is_admin = str(user_id) in admin_ids
-            
-            logger.info(f"[DEBUG] createuser: ADMIN_IDS={admin_ids}, is_admin={is_admin}")
-            
-            insert_query = text("""
-                INSERT INTO users (user_id, username, first_name, last_name, is_admin, created_at, last_active) 
-                VALUES (:user_id, :username, :first_name, :last_name, :is_admin, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                RETURNING id
-            """)
-            
-            logger.info(f"[DEBUG] createuser: Создаем пользователя user_id={user_id}, is_admin={is_admin}")
-            
-            result = await session.execute(
-                insert_query, 
-                {
-                    "user_id": user_id,
-                    "username": username,
-                    "first_name": first_name,
-                    "last_name": last_name,
-                    "is_admin": is_admin
-                }
-            )
-            new_id = result.scalar()
-            await session.commit()
-            
-            logger.info(f"[DEBUG] createuser: Пользователь создан, id={new_id}")
-            
-            # Force additional admin status
-            logger.info(f"[DEBUG] createuser: Устанавливаем права администратора для пользователя")
-            update_query = text("UPDATE users SET is_admin = true WHERE id = :user_id_db")
-            await session.execute(update_query, {"user_id_db": new_id})
-            await session.commit()
-            
-            logger.info(f"[DEBUG] createuser: Права администратора установлены")
-            
-            await message.answer("✅ Пользователь успешно создан и получил права администратора!")
-            await engine.dispose()
+        # Timestamps go through DateTime so SQLite stores them in the same
+        # format as ORM writes; the user list compares them as page cursors
+        insert_query = text("""
+            INSERT INTO users (user_id, username, first_name, last_name, is_admin, created_at, last_active) 
+            VALUES (:user_id, :username, :first_name, :last_name, :is_admin, :now, :now)
+            RETURNING id
+        """).bindparams(bindparam("now", type_=DateTime))
+        
+        logger.info(f"[DEBUG] createuser: Создаем пользователя user_id={user_id}, is_admin={is_admin}")
+        
+        result = await session.execute(
+            insert_query, 
+            {
+                "user_id": user_id,
+                "username": username,
+                "first_name": first_name,
+                "last_name": last_name,
+                "is_admin": is_admin,
+                "now": datetime.utcnow()
+            }
+        )
+        new_id = result.scalar()
+        await user_created(session)
+        
+        logger.info(f"[DEBUG] createuser: Пользователь создан, id={new_id}")
+        
+        # Force additional admin status
+        logger.info(f"[DEBUG] createuser: Устанавливаем права администратора для пользователя")
+        update_query = text("UPDATE users SET is_admin = true WHERE id = :user_id_db")
+        await session.execute(update_query, {"user_id_db": new_id})
+        after_commit(session, lambda: admin_registry.add(user_id))
+        
+        logger.info(f"[DEBUG] createuser: Права администратора установлены")
+        
+        await message.answer("✅ Пользователь успешно создан и получил права администратора!")
     
     except Exception as e:
         logger.error(f"[DEBUG] Error in cmd_create_user: {e}", exc_info=True)
         await message.answer(f"Произошла ошибка: {str(e)}")
 
 # Register base handlers
-def register_base_handlers(dp: Dispatcher):
+def register_base_handlers(dp: Dispatcher, router: CallbackRouter):
     """Register all base handlers"""
     logger.info("Registering base handlers...")
     dp.register_message_handler(cmd_start, CommandStart())
@@ -396,8 +333,8 @@ def register_base_handlers(dp: Dispatcher):
     dp.register_message_handler(cmd_create_user, Command("createuser"))
     logger.info(f"Registered cmd_create_user for Command('createuser') filter.")
     
-    dp.register_callback_query_handler(callback_back_to_start, lambda c: c.data == "back_to_start")
+    router.register("back_to_start", callback_back_to_start)
     logger.info(f"Registered callback_back_to_start.")
-    dp.register_callback_query_handler(callback_help, lambda c: c.data == "help") 
+    router.register("help", callback_help)
     logger.info(f"Registered callback_help.")
     logger.info("Base handlers registration finished.") 
\ No newline at end of file
@@ -1,92 +1,98 @@
+import asyncio
 import logging
 import json
 from datetime import datetime
 from aiogram import Dispatcher, types
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, LabeledPrice
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.markdown import hbold
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.utils.db import get_session
+from app.config import Settings
+from app.services.catalog import catalog
+from app.services.entitlements import entitlements, get_access_link
 from app.services.user import get_or_create_user
 from app.services.channel import get_channel_tariffs
+from app.services.invoice import ANY_PAYER, invoice_description, invoice_links, invoice_title, offer_payload
+from app.services.notifier import Sale, admin_notifier
+from app.services.render_cache import RenderedScreen, render_cache
+from app.services.screens import screens
 from app.services.subscription import process_successful_payment
+from app.utils.callback_router import CallbackRouter
+from app.utils.db import commit
+from app.utils.payload import InvoicePayload, InvalidPayload
+from app.utils.tracing import correlation_id, tracer
 
 logger = logging.getLogger(__name__)
 
 # Channel selection handler
-async def callback_channel_select(callback_query: types.CallbackQuery):
+async def callback_channel_select(callback_query: types.CallbackQuery, session: AsyncSession, channel_id: int):
     """Handle channel selection"""
     await callback_query.answer()
     
-    # Extract channel_id from callback data
-    _, channel_id = callback_query.data.split(":")
-    channel_id = int(channel_id)
+    # Tariff list is rebuilt only when the catalog changes
+    screen = await render_cache.catalog_screen(
+        "tariffs", channel_id, lambda: render_tariff_list(session, channel_id)
+    )
     
-    session_factory = callback_query.bot.get("session_factory")
+    if screen is None:
+        await callback_query.message.answer(
+            "Извините, для данного канала не настроены тарифы. Выберите другой канал."
+        )
+        return
     
-    async with get_session(session_factory) as session:
-        # Get tariffs for the selected channel
-        tariffs = await get_channel_tariffs(session, channel_id)
-        
-        if not tariffs:
-            await callback_query.message.answer(
-                "Извините, для данного канала не настроены тарифы. Выберите другой канал."
-            )
-            return
-        
-        # Create tariff selection message
-        tariff_text = f"{hbold('Выберите тариф подписки:')}\n\n"
-        
-        # Create inline keyboard with tariffs
-        keyboard = InlineKeyboardMarkup(row_width=1)
-        
-        for tariff in tariffs:
-            keyboard.add(
-                InlineKeyboardButton(
-                    text=f"{tariff.name} - {tariff.price_stars} Stars",
-                    callback_data=f"tariff:{channel_id}:{tariff.id}"
-                )
-            )
-        
-        # Add back button
+    # Send tariff selection message
+    await callback_query.message.answer(**screen.as_kwargs())
+
+async def render_tariff_list(session: AsyncSession, channel_id: int):
+    """Build the tariff selection screen for a channel, None if it has no tariffs"""
+    # Get tariffs for the selected channel
+    tariffs = await get_channel_tariffs(session, channel_id)
+    
+    if not tariffs:
+        return None
+    
+    # Create tariff selection message
+    tariff_text = f"{hbold('Выберите тариф подписки:')}\n\n"
+    
+    # Create inline keyboard with tariffs
+    keyboard = InlineKeyboardMarkup(row_width=1)
+    
+    for tariff in tariffs:
         keyboard.add(
             InlineKeyboardButton(
-                text="🔙 Назад",
-                callback_data="back_to_start"
+                text=f"{tariff.name} - {tariff.price_stars} Stars",
+                callback_data=f"tariff:{channel_id}:{tariff.id}"
             )
         )
-        
-        # Send tariff selection message
-        await callback_query.message.answer(
-            tariff_text,
-            reply_markup=keyboard,
-            parse_mode="HTML"
+    
+    # Add back button
+    keyboard.add(
+        InlineKeyboardButton(
+            text="🔙 Назад",
+            callback_data="back_to_start"
         )
+    )
+    
+    return RenderedScreen.build(tariff_text, keyboard)
 
 # Tariff selection handler
-async def callback_tariff_select(callback_query: types.CallbackQuery):
+async def callback_tariff_select(callback_query: types.CallbackQuery, settings: Settings,
+                                 channel_id: int, tariff_id: int):
     """Handle tariff selection"""
-    await callback_query.answer()
-    
-    # Extract channel_id and tariff_id from callback data
-    _, channel_id, tariff_id = callback_query.data.split(":")
-    channel_id = int(channel_id)
-    tariff_id = int(tariff_id)
-    
-    user_id = callback_query.from_user.id
-    session_factory = callback_query.bot.get("session_factory")
-    payment_provider_token = callback_query.bot.get("payment_provider_token")
-    
-    if not payment_provider_token:
-        logger.error("Payment provider token not set")
-        await callback_query.message.answer(
-            "Извините, платежи временно недоступны. Попробуйте позже."
-        )
-        return
-    
-    async with get_session(session_factory) as session:
-        # Get tariff info
-        tariffs = await get_channel_tariffs(session, channel_id)
-        tariff = next((t for t in tariffs if t.id == tariff_id), None)
+    with tracer.stage("callback_tariff_select") as span:
+        await callback_query.answer()
+        
+        payment_provider_token = settings.payment_provider_token
+        
+        if not payment_provider_token:
+            logger.error("Payment provider token not set")
+            await callback_query.message.answer(
+                "Извините, платежи временно недоступны. Попробуйте позже."
+            )
+            return
+        
+        # Get tariff info from the catalog snapshot
+        tariff = catalog.get_tariff(tariff_id, channel_id)
         
         if not tariff:
             await callback_query.message.answer(
@@ -94,59 +100,109 @@ async def callback_tariff_select(callback_query: types.CallbackQuery):
             )
             return
         
-        # Create payment invoice
-        title = f"Подписка на канал {tariff.channel.name}"
-        description = f"Тариф: {tariff.name} ({tariff.duration_days} дней)"
-        
-        # Create payload with user_id, channel_id and tariff_id
-        payload = f"{user_id}:{channel_id}:{tariff_id}"
+        # The purchase is traced under the payload the user is about to pay
+        span.trace_id = correlation_id(
+            offer_payload(tariff, catalog.version, settings.payload_secret), callback_query.from_user.id
+        )
+        tracer.begin(span.trace_id)
         
-        # Create price
-        prices = [LabeledPrice(label=tariff.name, amount=tariff.price_stars * 100)]  # Amount in cents
+        with tracer.stage("send_invoice", span.trace_id):
+            # Offer with a prebuilt invoice link, rebuilt only when the catalog changes
+            try:
+                screen = await render_cache.catalog_screen(
+                    "tariff_offer", tariff.id,
+                    lambda: render_tariff_offer(callback_query.bot, tariff, settings)
+                )
+            except Exception as e:
+                logger.error(f"Failed to create invoice link for tariff {tariff.id}: {e}", exc_info=True)
+                await callback_query.message.answer(
+                    "Извините, платежи временно недоступны. Попробуйте позже."
+                )
+                return
+            
+            await callback_query.message.answer(**screen.as_kwargs())
+
+async def render_tariff_offer(bot, tariff, settings: Settings) -> RenderedScreen:
+    """Build the tariff offer with a pay button for the tariff's reusable invoice link"""
+    invoice_link = await invoice_links.get(
+        bot, tariff, settings.payment_provider_token, settings.payload_secret
+    )
+    
+    offer_text = (
+        f"{hbold(invoice_title(tariff))}\n"
+        f"{invoice_description(tariff)}\n\n"
+        f"Стоимость: {tariff.price_stars} Stars\n\n"
+        f"После успешной оплаты вы получите пригласительную ссылку."
+    )
+    
+    keyboard = InlineKeyboardMarkup(row_width=1)
+    keyboard.add(
+        InlineKeyboardButton(text=f"💳 Оплатить {tariff.price_stars} Stars", url=invoice_link),
+        InlineKeyboardButton(text="🔙 Назад", callback_data=f"channel:{tariff.channel_id}")
+    )
+    
+    return RenderedScreen.build(offer_text, keyboard)
+
+# Pre-checkout handler
+async def process_pre_checkout_query(pre_checkout_query: types.PreCheckoutQuery, settings: Settings):
+    """Handle pre-checkout query
+
+    Runs inside Telegram's 10 second window, so it only checks the signed
+    payload against the in-memory catalog.
+    """
+    trace_id = correlation_id(pre_checkout_query.invoice_payload, pre_checkout_query.from_user.id)
+    
+    # Timed up to the answer, which must reach Telegram within PRE_CHECKOUT_DEADLINE
+    with tracer.stage("process_pre_checkout_query", trace_id):
+        error_message = None
         
-        # Send invoice
-        await callback_query.bot.send_invoice(
-            chat_id=user_id,
-            title=title,
-            description=description,
-            payload=payload,
-            provider_token=payment_provider_token,
-            currency="STARS",
-            prices=prices,
-            start_parameter="subscribe",
-            need_name=False,
-            need_phone_number=False,
-            need_email=False,
-            need_shipping_address=False,
-            is_flexible=False
-        )
+        try:
+            payload = InvoicePayload.verify(pre_checkout_query.invoice_payload, settings.payload_secret)
+        except InvalidPayload as e:
+            logger.warning(f"Rejected pre-checkout {pre_checkout_query.id}: {e}")
+            error_message = "Счет недействителен. Пожалуйста, выберите тариф заново."
+        else:
+            if payload.user_id not in (ANY_PAYER, pre_checkout_query.from_user.id):
+                logger.warning(f"Rejected pre-checkout {pre_checkout_query.id}: user {pre_checkout_query.from_user.id} != {payload.user_id}")
+                error_message = "Этот счет выставлен другому пользователю."
+            elif pre_checkout_query.total_amount != payload.price_stars * 100:
+                logger.warning(f"Rejected pre-checkout {pre_checkout_query.id}: amount {pre_checkout_query.total_amount} does not match payload")
+                error_message = "Сумма счета не совпадает с ценой тарифа."
+            elif not catalog.is_offer_current(payload.tariff_id, payload.channel_id, payload.price_stars,
+                                              payload.duration_days, payload.catalog_version):
+                logger.info(f"Rejected pre-checkout {pre_checkout_query.id}: stale offer for tariff {payload.tariff_id}")
+                error_message = "Цена или условия тарифа изменились. Пожалуйста, выберите тариф заново."
         
-        # Send additional message about payment
-        await callback_query.message.answer(
-            "Для завершения оформления подписки, оплатите счет выше.\n\n"
-            "После успешной оплаты вы получите пригласительную ссылку."
+        await pre_checkout_query.bot.answer_pre_checkout_query(
+            pre_checkout_query.id, 
+            ok=error_message is None,
+            error_message=error_message
         )
 
-# Pre-checkout handler
-async def process_pre_checkout_query(pre_checkout_query: types.PreCheckoutQuery):
-    """Handle pre-checkout query"""
-    # Always accept pre-checkout queries
-    await pre_checkout_query.bot.answer_pre_checkout_query(
-        pre_checkout_query.id, 
-        ok=True
-    )
+# Join request handler
+async def process_chat_join_request(join_request: types.ChatJoinRequest):
+    """Approve join requests from users with an active subscription"""
+    user_id = join_request.from_user.id
+    chat_id = join_request.chat.id
+    
+    if entitlements.is_entitled(user_id, chat_id):
+        await join_request.approve()
+        logger.info(f"Approved join request from {user_id} to {chat_id}")
+    else:
+        await join_request.decline()
+        logger.info(f"Declined join request from {user_id} to {chat_id}: no active subscription")
 
 # Successful payment handler
-async def process_payment(message: types.Message):
+async def process_payment(message: types.Message, session: AsyncSession, settings: Settings):
     """Handle successful payment"""
     payment = message.successful_payment
     user_id = message.from_user.id
-    session_factory = message.bot.get("session_factory")
+    trace_id = correlation_id(payment.invoice_payload, user_id)
     
-    logger.info(f"Received payment from {user_id}: {payment.total_amount / 100} {payment.currency}")
+    logger.info(f"[{trace_id}] Received payment from {user_id}: {payment.total_amount / 100} {payment.currency}")
     
-    try:
-        async with get_session(session_factory) as session:
+    with tracer.stage("process_payment", trace_id):
+        try:
             # Create user record if not exists
             await get_or_create_user(
                 session, 
@@ -165,83 +221,103 @@ async def process_payment(message: types.Message):
                 "invoice_payload": payment.invoice_payload
             }
             
-            result = await process_successful_payment(
-                message.bot,
-                session,
-                user_id,
-                payment_data
-            )
-            
-            # Extract data from result
-            channel = result["channel"]
-            invite_link = result["invite_link"]
-            end_date = result["end_date"]
-            
-            # Send confirmation and invite link
+            with tracer.stage("process_successful_payment", trace_id):
+                result = await process_successful_payment(
+                    message.bot,
+                    session,
+                    user_id,
+                    payment_data,
+                    settings
+                )
+                
+                # The subscription is durable before anything is sent
+                await commit(session)
+        except Exception as e:
+            logger.error(f"Error processing payment: {e}", exc_info=True)
+            await session.rollback()
             await message.answer(
+                "❌ Произошла ошибка при обработке платежа. "
+                "Пожалуйста, обратитесь к администратору бота."
+            )
+            return
+        
+        # Extract data from result
+        channel = result["channel"]
+        end_date = result["end_date"]
+        
+        # Confirm while the access link is fetched; a retry of the same payment gets the same link
+        confirmation, invite_link = await asyncio.gather(
+            message.answer(
                 f"✅ {hbold('Оплата успешно обработана!')}\n\n"
                 f"Вы успешно оформили подписку на канал {hbold(channel.name)}.\n\n"
-                f"📅 Срок действия: до {end_date.strftime('%d.%m.%Y %H:%M')}\n\n"
+                f"📅 Срок действия: до {end_date.strftime('%d.%m.%Y %H:%M')}",
+                parse_mode="HTML"
+            ),
+            tracer.timed(
+                "generate_invite_link",
+                get_access_link(channel.channel_id, key=payment.telegram_payment_charge_id),
+                trace_id
+            ),
+            return_exceptions=True
+        )
+        
+        if isinstance(invite_link, Exception):
+            logger.error(f"Failed to get access link for payment {payment.telegram_payment_charge_id}: {invite_link}")
+            await message.answer(
+                "⚠️ Подписка оформлена, но не удалось создать ссылку на канал. "
+                "Пожалуйста, обратитесь к администратору бота."
+            )
+        else:
+            # Send the invite link
+            await message.answer(
                 f"👇 Используйте ссылку ниже, чтобы присоединиться к каналу:\n"
                 f"{invite_link}\n\n"
                 f"⚠️ Ссылка действительна в течение ограниченного времени. "
-                f"Перейдите по ней как можно скорее.",
-                parse_mode="HTML"
+                f"Перейдите по ней как можно скорее."
             )
-            
-            # Notify admins about successful payment
-            admin_ids = [int(id.strip()) for id in message.bot.get("admin_ids", "").split(",") if id.strip()]
-            for admin_id in admin_ids:
-                try:
-                    await message.bot.send_message(
-                        admin_id,
-                        f"💰 Новая подписка!\n\n"
-                        f"Пользователь: {message.from_user.full_name} (@{message.from_user.username})\n"
-                        f"Канал: {channel.name}\n"
-                        f"Сумма: {payment.total_amount / 100} {payment.currency}\n"
-                        f"Дата окончания: {end_date.strftime('%d.%m.%Y %H:%M')}"
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to notify admin {admin_id}: {e}")
-    
-    except Exception as e:
-        logger.error(f"Error processing payment: {e}", exc_info=True)
-        await message.answer(
-            "❌ Произошла ошибка при обработке платежа. "
-            "Пожалуйста, обратитесь к администратору бота."
-        )
+            tracer.complete(trace_id)
+        
+        if isinstance(confirmation, Exception):
+            logger.error(f"Failed to confirm payment to {user_id}: {confirmation}")
+        
+        # A redelivered payment was already announced
+        if not result["duplicate"]:
+            admin_notifier.notify_sale(Sale(
+                full_name=message.from_user.full_name,
+                username=message.from_user.username,
+                channel_name=channel.name,
+                amount=payment.total_amount / 100,
+                currency=payment.currency,
+                end_date=end_date
+            ))
 
 # Refresh subscriptions handler
-async def callback_refresh_subscriptions(callback_query: types.CallbackQuery):
+async def callback_refresh_subscriptions(callback_query: types.CallbackQuery, session: AsyncSession):
     """Handle refresh subscriptions button"""
     await callback_query.answer()
     
-    # Create a modified message with the correct user_id
-    message = callback_query.message
-    # Make sure the correct user_id is available
-    message.from_user = callback_query.from_user
+    from app.handlers.base import render_my_subscriptions
+    try:
+        screen = await render_my_subscriptions(session, callback_query.from_user.id)
+    except Exception as e:
+        logger.error(f"Error refreshing subscriptions for {callback_query.from_user.id}: {e}", exc_info=True)
+        await callback_query.message.answer("Произошла ошибка при получении ваших подписок. Пожалуйста, попробуйте позже.")
+        return
     
-    # Emulate /mysubscriptions command with the modified message
-    from app.handlers.base import cmd_my_subscriptions
-    await cmd_my_subscriptions(message)
+    # Edit in place; an unchanged list makes no API call
+    await screens.show(callback_query.message, screen)
 
 # Register subscription handlers
-def register_subscription_handlers(dp: Dispatcher):
+def register_subscription_handlers(dp: Dispatcher, router: CallbackRouter):
     """Register all subscription handlers"""
-    # Register channel and tariff selection handlers
-    dp.register_callback_query_handler(
-        callback_channel_select, 
-        lambda c: c.data.startswith("channel:")
-    )
-    dp.register_callback_query_handler(
-        callback_tariff_select, 
-        lambda c: c.data.startswith("tariff:")
-    )
-    dp.register_callback_query_handler(
-        callback_refresh_subscriptions,
-        lambda c: c.data == "refresh_subscriptions"
-    )
+    # Register channel and tariff selection handlers, "channel:<id>" and "tariff:<channel_id>:<tariff_id>"
+    router.register("channel", callback_channel_select, args={"channel_id": int})
+    router.register("tariff", callback_tariff_select, args={"channel_id": int, "tariff_id": int})
+    router.register("refresh_subscriptions", callback_refresh_subscriptions)
     
     # Register payment handlers
     dp.register_pre_checkout_query_handler(process_pre_checkout_query)
+    
+    # Access to join-request channels
+    dp.register_chat_join_request_handler(process_chat_join_request)
     dp.register_message_handler(process_payment, content_types=types.ContentTypes.SUCCESSFUL_PAYMENT) 
\ No newline at end of file
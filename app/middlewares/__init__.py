@@ -0,0 +1,5 @@
+from app.middlewares.session import DbSessionMiddleware
+from app.middlewares.settings import SettingsMiddleware
+from app.middlewares.throttling import ThrottlingMiddleware
+
+__all__ = ["DbSessionMiddleware", "SettingsMiddleware", "ThrottlingMiddleware"]
@@ -0,0 +1,65 @@
+import inspect
+import logging
+from contextvars import ContextVar
+from functools import lru_cache
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from app.utils.db import UnitOfWork
+
+logger = logging.getLogger(__name__)
+
+# Unit of work of the update currently being processed
+current_uow: ContextVar = ContextVar("current_uow", default=None)
+
+@lru_cache(maxsize=None)
+def wants_session(handler) -> bool:
+    """Whether aiogram passes ``session`` to the handler, by the same rule it uses for any data key"""
+    spec = inspect.getfullargspec(inspect.unwrap(handler))
+    return spec.varkw is not None or "session" in spec.args + spec.kwonlyargs
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Give each update a unit of work and inject its session into handlers that take ``session``
+
+    The session is only opened when a handler asks for it, so updates
+    answered from memory never check a connection out of the pool.
+    """
+
+    def __init__(self, session_factory):
+        super().__init__()
+        self.session_factory = session_factory
+
+    async def on_pre_process_update(self, update, data: dict):
+        current_uow.set(UnitOfWork(self.session_factory))
+
+    async def on_pre_process_error(self, update, error, data: dict):
+        uow = current_uow.get()
+        if uow:
+            uow.failed = True
+
+    async def on_post_process_update(self, update, results, data: dict):
+        uow = current_uow.get()
+        if not uow:
+            return
+        current_uow.set(None)
+        
+        try:
+            await uow.finish()
+        except Exception as e:
+            logger.error(f"Failed to finish unit of work for update {update.update_id}: {e}", exc_info=True)
+
+    def _inject(self, data: dict):
+        uow = current_uow.get()
+        handler = current_handler.get(None)
+        if uow and handler is not None and wants_session(handler):
+            data["session"] = uow.session
+
+    # Inject only after filters have passed, right before the handler runs
+    async def on_process_message(self, message, data: dict):
+        self._inject(data)
+
+    async def on_process_callback_query(self, callback_query, data: dict):
+        self._inject(data)
+
+    async def on_process_pre_checkout_query(self, pre_checkout_query, data: dict):
+        self._inject(data)
@@ -0,0 +1,17 @@
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+class SettingsMiddleware(BaseMiddleware):
+    """Inject the current settings snapshot into handlers as ``settings``"""
+
+    def _inject(self, data: dict):
+        # Read on every update so reload_settings() takes effect immediately
+        data["settings"] = self.manager.dispatcher["settings"]
+
+    async def on_process_message(self, message, data: dict):
+        self._inject(data)
+
+    async def on_process_callback_query(self, callback_query, data: dict):
+        self._inject(data)
+
+    async def on_process_pre_checkout_query(self, pre_checkout_query, data: dict):
+        self._inject(data)
@@ -0,0 +1,54 @@
+import logging
+import time
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from app.services.auth import admin_registry
+from app.utils.token_buckets import TokenBucketTable
+
+logger = logging.getLogger(__name__)
+
+# At most one "too fast" answer per user in this many seconds
+ANSWER_DEBOUNCE = 5
+
+THROTTLED_TEXT = "Слишком много запросов. Подождите несколько секунд."
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Drop messages and callbacks from users who exceed their token bucket
+
+    Runs before filters, so a dropped event never reaches a handler or opens
+    a database session. Payments and admins are never throttled. Dropped
+    callbacks get a short answer at most once per ``ANSWER_DEBOUNCE``
+    seconds; the rest are left unanswered.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        super().__init__()
+        self.buckets = TokenBucketTable(rate, burst)
+
+    def _allowed(self, user: types.User) -> bool:
+        if user is None or admin_registry.is_admin(user.id):
+            return True
+        return self.buckets.consume(user.id, time.monotonic())
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        if message.successful_payment:
+            return
+
+        if not self._allowed(message.from_user):
+            logger.debug(f"Throttled message from {message.from_user.id}")
+            raise CancelHandler()
+
+    async def on_pre_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
+        if self._allowed(callback_query.from_user):
+            return
+
+        user_id = callback_query.from_user.id
+        logger.debug(f"Throttled callback {callback_query.data} from {user_id}")
+        if self.buckets.mark(user_id, time.monotonic(), ANSWER_DEBOUNCE):
+            try:
+                await callback_query.answer(THROTTLED_TEXT)
+            except Exception as e:
+                logger.error(f"Failed to answer throttled callback from {user_id}: {e}")
+        raise CancelHandler()
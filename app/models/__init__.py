@@ -3,5 +3,9 @@ from app.models.user import User
 from app.models.channel import Channel
 from app.models.tariff import Tariff
 from app.models.subscription import Subscription
+from app.models.payment import Payment
+from app.models.stat_counter import StatCounter
+from app.models.daily_rollup import DailyRollup
+from app.models.broadcast import Broadcast, BroadcastDeadLetter
 
-__all__ = ["Base", "User", "Channel", "Tariff", "Subscription"] 
\ No newline at end of file
+__all__ = ["Base", "User", "Channel", "Tariff", "Subscription", "Payment", "StatCounter", "DailyRollup", "Broadcast", "BroadcastDeadLetter"] 
\ No newline at end of file
@@ -0,0 +1,49 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, ForeignKey
+
+from app.models.base import Base
+
+# Broadcast statuses
+BROADCAST_RUNNING = "running"
+BROADCAST_DONE = "done"
+BROADCAST_CANCELLED = "cancelled"
+# Gave up after repeated errors
+BROADCAST_FAILED = "failed"
+
+class Broadcast(Base):
+    """A message to the active subscribers of a channel (or of all channels)
+
+    ``cursor`` is the database id of the last user handled; delivery goes
+    on from there after a restart.
+    """
+    __tablename__ = "broadcasts"
+    
+    id = Column(Integer, primary_key=True)
+    channel_id = Column(Integer, ForeignKey("channels.id"), nullable=True)
+    text = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default=BROADCAST_RUNNING)
+    cursor = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=False, default=0)
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    admin_chat_id = Column(BigInteger, nullable=False)
+    status_message_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f"<Broadcast(id={self.id}, status={self.status}, sent={self.sent}/{self.total})>"
+
+class BroadcastDeadLetter(Base):
+    """A recipient a broadcast could not be delivered to, and why"""
+    __tablename__ = "broadcast_dead_letters"
+    
+    id = Column(Integer, primary_key=True)
+    broadcast_id = Column(Integer, ForeignKey("broadcasts.id"), nullable=False, index=True)
+    user_id = Column(BigInteger, nullable=False)
+    error = Column(String, nullable=False)
+    attempts = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<BroadcastDeadLetter(broadcast_id={self.broadcast_id}, user_id={self.user_id}, error={self.error})>"
@@ -2,6 +2,11 @@ from sqlalchemy import Column, Integer, String, Boolean, Text, BigInteger
 
 from app.models.base import Base
 
+# How paying users get into a channel
+ACCESS_INVITE_LINK = "invite_link"  # a single-use invite link per payment
+ACCESS_JOIN_REQUEST = "join_request"  # one shared join-request link, approved by the bot
+ACCESS_MODES = (ACCESS_INVITE_LINK, ACCESS_JOIN_REQUEST)
+
 class Channel(Base):
     __tablename__ = "channels"
     
@@ -10,6 +15,8 @@ class Channel(Base):
     name = Column(String, nullable=False)
     description = Column(Text, nullable=True)
     is_active = Column(Boolean, default=True)
+    access_mode = Column(String, nullable=False, default=ACCESS_INVITE_LINK, server_default=ACCESS_INVITE_LINK)
+    join_link = Column(String, nullable=True)
     
     def __repr__(self):
         return f"<Channel(id={self.id}, channel_id={self.channel_id}, name={self.name})>" 
\ No newline at end of file
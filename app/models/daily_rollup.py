@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Date, ForeignKey, Integer
+
+from app.models.base import Base
+
+class DailyRollup(Base):
+    """Subscription activity and revenue per day, channel and tariff
+
+    Rows are only ever added to: each event increments the row of its day,
+    so a date range is read straight off the primary key.
+    """
+    __tablename__ = "daily_rollups"
+    
+    day = Column(Date, primary_key=True)
+    channel_id = Column(Integer, ForeignKey("channels.id"), primary_key=True)
+    tariff_id = Column(Integer, ForeignKey("tariffs.id"), primary_key=True)
+    new_subscriptions = Column(Integer, nullable=False, default=0)
+    renewals = Column(Integer, nullable=False, default=0)
+    expirations = Column(Integer, nullable=False, default=0)
+    stars = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<DailyRollup(day={self.day}, channel_id={self.channel_id}, tariff_id={self.tariff_id}, stars={self.stars})>"
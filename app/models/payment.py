@@ -0,0 +1,28 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, DateTime, ForeignKey, String
+from sqlalchemy.orm import relationship
+
+from app.models.base import Base
+
+class Payment(Base):
+    """Ledger of successful payments, one row per Telegram charge"""
+    __tablename__ = "payments"
+    
+    id = Column(Integer, primary_key=True)
+    telegram_payment_charge_id = Column(String, nullable=False, unique=True)
+    provider_payment_charge_id = Column(String, nullable=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    channel_id = Column(Integer, ForeignKey("channels.id"), nullable=False)
+    tariff_id = Column(Integer, ForeignKey("tariffs.id"), nullable=False)
+    subscription_id = Column(Integer, ForeignKey("subscriptions.id"), nullable=True)
+    total_amount = Column(Integer, nullable=False)
+    currency = Column(String, nullable=False)
+    invoice_payload = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    user = relationship("User")
+    subscription = relationship("Subscription")
+    
+    def __repr__(self):
+        return f"<Payment(id={self.id}, charge={self.telegram_payment_charge_id}, amount={self.total_amount} {self.currency})>"
@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String
+
+from app.models.base import Base
+
+# channel_id of counters that cover the whole bot
+GLOBAL_SCOPE = 0
+
+class StatCounter(Base):
+    """Running totals for the admin dashboards, kept in step with the write paths"""
+    __tablename__ = "stat_counters"
+    
+    name = Column(String, primary_key=True)
+    channel_id = Column(Integer, primary_key=True, default=GLOBAL_SCOPE)
+    value = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<StatCounter(name={self.name}, channel_id={self.channel_id}, value={self.value})>"
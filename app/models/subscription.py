@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, DateTime, ForeignKey, Boolean, String
+from sqlalchemy import Column, Integer, DateTime, ForeignKey, Boolean, String, Index
 from sqlalchemy.orm import relationship
 
 from app.models.base import Base
@@ -15,11 +15,41 @@ class Subscription(Base):
     start_date = Column(DateTime, default=datetime.utcnow)
     end_date = Column(DateTime, nullable=False)
     is_active = Column(Boolean, default=True)
+    # Pre-expiry reminders already sent for the current end date (see app.services.reminders)
+    reminder_stage = Column(Integer, nullable=False, default=0, server_default="0")
+    # When the expiry job claimed the row to kick the user out; cleared once that is done (see app.services.scheduler)
+    revoking_since = Column(DateTime, nullable=True)
     
     # Relationships
     user = relationship("User", backref="subscriptions")
     channel = relationship("Channel")
     tariff = relationship("Tariff")
     
+    __table_args__ = (
+        # At most one active subscription per user and channel, so concurrent
+        # payments extend the same row instead of racing to create two
+        Index(
+            "uq_subscriptions_active_user_channel",
+            "user_id", "channel_id",
+            unique=True,
+            postgresql_where=(is_active == True),
+            sqlite_where=(is_active == True)
+        ),
+        # Expiry job, forecast and reminders read active rows by end date
+        Index(
+            "ix_subscriptions_active_end_date",
+            "end_date",
+            postgresql_where=(is_active == True),
+            sqlite_where=(is_active == True)
+        ),
+        # Expiry job retries revocations interrupted before they finished
+        Index(
+            "ix_subscriptions_revoking_since",
+            "revoking_since",
+            postgresql_where=(revoking_since != None),
+            sqlite_where=(revoking_since != None)
+        ),
+    )
+    
     def __repr__(self):
         return f"<Subscription(id={self.id}, user_id={self.user_id}, channel_id={self.channel_id}, active until={self.end_date})>" 
\ No newline at end of file
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, BigInteger
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, BigInteger, Index
 
 from app.models.base import Base
 
@@ -11,9 +11,15 @@ class User(Base):
     username = Column(String, nullable=True)
     first_name = Column(String, nullable=True)
     last_name = Column(String, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    # Never NULL: it is the key of the admin user list's page cursors
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     last_active = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_admin = Column(Boolean, default=False)
     
+    __table_args__ = (
+        # Keyset pagination of the admin user list, newest first
+        Index("ix_users_created_at_id", "created_at", "id"),
+    )
+    
     def __repr__(self):
         return f"<User(id={self.id}, user_id={self.user_id}, username={self.username})>" 
\ No newline at end of file
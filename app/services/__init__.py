@@ -1,11 +1,29 @@
+from app.services.auth import admin_registry
+from app.services.catalog import catalog, mark_catalog_changed
+from app.services.render_cache import RenderedScreen, render_cache
+from app.services.screens import screens
+from app.services.invoice import invoice_links
+from app.services.invite_pool import invite_pool
+from app.services.entitlements import entitlements, get_access_link
+from app.services.notifier import Sale, admin_notifier
 from app.services.user import get_or_create_user, is_admin
 from app.services.channel import get_active_channels, get_channel_by_id, get_channel_tariffs, generate_invite_link
-from app.services.subscription import get_user_subscriptions, is_subscribed, create_subscription, process_successful_payment
+from app.services.subscription import get_user_subscriptions, get_subscription_summaries, is_subscribed, create_subscription, process_successful_payment
+from app.services.stats import get_counters, get_channel_counters, reconcile_counters
+from app.services.revenue import get_rollups, get_revenue_report
 from app.services.scheduler import setup_scheduler, check_expired_subscriptions
 
 __all__ = [
+    "admin_registry",
+    "catalog", "mark_catalog_changed",
+    "RenderedScreen", "render_cache", "screens",
+    "invoice_links", "invite_pool",
+    "entitlements", "get_access_link",
+    "Sale", "admin_notifier",
     "get_or_create_user", "is_admin",
     "get_active_channels", "get_channel_by_id", "get_channel_tariffs", "generate_invite_link",
-    "get_user_subscriptions", "is_subscribed", "create_subscription", "process_successful_payment",
+    "get_user_subscriptions", "get_subscription_summaries", "is_subscribed", "create_subscription", "process_successful_payment",
+    "get_counters", "get_channel_counters", "reconcile_counters",
+    "get_rollups", "get_revenue_report",
     "setup_scheduler", "check_expired_subscriptions"
 ] 
\ No newline at end of file
@@ -0,0 +1,282 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.models import Payment, Subscription
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched and converted per round trip
+CHUNK_SIZE = 50_000
+
+# Months after the first one shown in the retention matrix
+DEFAULT_HORIZON = 12
+
+# A subscription started this soon after the previous one ended counts as a renewal
+RENEWAL_GRACE = np.timedelta64(7, "D")
+
+@dataclass
+class SubscriptionHistory:
+    """Columns of ``subscriptions``: database user and channel ids, start and end dates
+
+    ``payments`` is how many ledger payments went into each row; every one
+    after the first extended the row in place instead of starting a new one.
+    """
+
+    user_id: np.ndarray
+    channel_id: np.ndarray
+    start: np.ndarray
+    end: np.ndarray
+    payments: np.ndarray
+
+    def __len__(self):
+        return len(self.user_id)
+
+    @classmethod
+    def from_rows(cls, rows) -> "SubscriptionHistory":
+        """Convert ``(user_id, channel_id, start_date, end_date, payments)`` rows"""
+        if not rows:
+            return cls.empty()
+        user_id, channel_id, start, end, payments = zip(*rows)
+        return cls(
+            user_id=np.array(user_id, dtype=np.int64),
+            channel_id=np.array(channel_id, dtype=np.int64),
+            start=np.array(start, dtype="datetime64[s]"),
+            end=np.array(end, dtype="datetime64[s]"),
+            payments=np.array(payments, dtype=np.int64)
+        )
+
+    @classmethod
+    def empty(cls) -> "SubscriptionHistory":
+        return cls(
+            user_id=np.empty(0, dtype=np.int64),
+            channel_id=np.empty(0, dtype=np.int64),
+            start=np.empty(0, dtype="datetime64[s]"),
+            end=np.empty(0, dtype="datetime64[s]"),
+            payments=np.empty(0, dtype=np.int64)
+        )
+
+    def take(self, indices: np.ndarray) -> "SubscriptionHistory":
+        return SubscriptionHistory(
+            self.user_id[indices], self.channel_id[indices], self.start[indices], self.end[indices],
+            self.payments[indices]
+        )
+
+    def customer_keys(self) -> np.ndarray:
+        """One key per (user, channel) pair"""
+        return (self.user_id << 32) | self.channel_id
+
+def month_index(dates: np.ndarray) -> np.ndarray:
+    """Months since 1970-01"""
+    return dates.astype("datetime64[M]").astype(np.int64)
+
+def month_label(index: int) -> str:
+    return str(np.datetime64(int(index), "M"))
+
+@dataclass
+class CohortReport:
+    """Retention by cohort, monthly churn and the renewal rate of a subscription history
+
+    A customer is a (user, channel) pair; its cohort is the month of its
+    first subscription. ``retention[c, k]`` is the share of cohort ``c``
+    with access ``k`` months later, NaN where that month has not happened
+    yet. ``churn[m]`` is the share of customers with access in month ``m``
+    who had none in month ``m + 1``. ``renewal_rate`` is the share of
+    terms that came due and were renewed, either by a payment extending the
+    active subscription or by a new one within ``RENEWAL_GRACE`` of the end.
+    """
+
+    first_month: int
+    cohort_sizes: np.ndarray
+    retention: np.ndarray
+    churn: np.ndarray
+    renewal_rate: float
+    subscriptions: int
+    customers: int
+
+    @property
+    def cohort_labels(self) -> List[str]:
+        return [month_label(self.first_month + i) for i in range(len(self.cohort_sizes))]
+
+    @classmethod
+    def empty(cls, horizon: int = DEFAULT_HORIZON) -> "CohortReport":
+        return cls(0, np.zeros(0, dtype=np.int64), np.zeros((0, horizon + 1)), np.zeros(0), 0.0, 0, 0)
+
+class CohortAccumulator:
+    """Cohort histograms summed over chunks of a subscription history
+
+    Each chunk must hold every subscription of the customers in it. Only
+    that chunk's customer x month access grid exists at any time; what is
+    kept between chunks is sized by months, not by customers or rows.
+    """
+
+    def __init__(self, first_month: int, now: Optional[datetime] = None, horizon: int = DEFAULT_HORIZON):
+        self.first_month = first_month
+        self.now = np.datetime64(now or datetime.utcnow(), "s")
+        self.horizon = horizon
+        self.months = int(month_index(self.now)) - first_month + 1
+        self.sizes = np.zeros(self.months, dtype=np.int64)
+        self.counts = np.zeros((self.months, horizon + 1), dtype=np.int64)
+        self.had = np.zeros(self.months - 1, dtype=np.int64)
+        self.lost = np.zeros(self.months - 1, dtype=np.int64)
+        self.renewals = 0
+        self.ended = 0
+        self.subscriptions = 0
+        self.customers = 0
+
+    def add(self, chunk: SubscriptionHistory) -> None:
+        """Add the subscriptions of some customers, with array operations only"""
+        if not len(chunk):
+            return
+        months, now = self.months, self.now
+
+        # Customers of this chunk: one id per (user, channel) pair
+        _, customer = np.unique(chunk.customer_keys(), return_inverse=True)
+        customers = int(customer.max()) + 1
+
+        # Months with access, relative to the first month in the history; the future is unknown
+        start_month = month_index(chunk.start) - self.first_month
+        end_month = np.maximum(month_index(np.minimum(chunk.end, now)) - self.first_month, start_month)
+        end_month = np.minimum(end_month, months - 1)
+
+        # Customer x month access grid
+        lengths = end_month - start_month + 1
+        rows = np.repeat(customer, lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        active = np.zeros((customers, months), dtype=bool)
+        active[rows, np.repeat(start_month, lengths) + offsets] = True
+
+        # Cohort of each customer, then how many of each cohort had access k months later
+        cohort = np.full(customers, months, dtype=np.int64)
+        np.minimum.at(cohort, customer, start_month)
+        self.sizes += np.bincount(cohort, minlength=months)
+        everyone = np.arange(customers)
+        for k in range(self.horizon + 1):
+            column = cohort + k
+            seen = column < months
+            seen[seen] = active[everyone[seen], column[seen]]
+            self.counts[:, k] += np.bincount(cohort[seen], minlength=months)
+
+        # Month over month churn
+        self.had += active[:, :-1].sum(axis=0)
+        self.lost += (active[:, :-1] & ~active[:, 1:]).sum(axis=0)
+
+        # Renewals: the same customer's next subscription starts within the grace period of the last end
+        by_customer = np.lexsort((chunk.start, customer))
+        ordered_customer, starts, ends = customer[by_customer], chunk.start[by_customer], chunk.end[by_customer]
+        ended = ends < now
+        renewed = np.zeros(len(chunk), dtype=bool)
+        renewed[:-1] = (ordered_customer[1:] == ordered_customer[:-1]) & (starts[1:] - ends[:-1] <= RENEWAL_GRACE)
+        # ... or a payment extended the active one, which renews a term without a new row
+        extensions = int(np.maximum(chunk.payments - 1, 0).sum())
+        self.renewals += int((renewed & ended).sum()) + extensions
+        self.ended += int(ended.sum()) + extensions
+
+        self.subscriptions += len(chunk)
+        self.customers += customers
+
+    def report(self) -> CohortReport:
+        months, horizon = self.months, self.horizon
+        with np.errstate(invalid="ignore", divide="ignore"):
+            retention = self.counts / self.sizes[:, None]
+        retention[np.arange(months)[:, None] + np.arange(horizon + 1) >= months] = np.nan
+
+        return CohortReport(
+            first_month=self.first_month,
+            cohort_sizes=self.sizes,
+            retention=retention,
+            churn=np.divide(self.lost, self.had, out=np.zeros(len(self.had)), where=self.had > 0),
+            renewal_rate=self.renewals / self.ended if self.ended else 0.0,
+            subscriptions=self.subscriptions,
+            customers=self.customers
+        )
+
+def analyze(history: SubscriptionHistory, now: Optional[datetime] = None,
+            horizon: int = DEFAULT_HORIZON, chunk_size: int = CHUNK_SIZE) -> CohortReport:
+    """Compute a ``CohortReport`` of a history already in memory, ``chunk_size`` rows at a time"""
+    if not len(history):
+        return CohortReport.empty(horizon)
+
+    cohorts = CohortAccumulator(int(month_index(history.start).min()), now, horizon)
+    keys = history.customer_keys()
+    by_customer = np.argsort(keys, kind="stable")
+    keys = keys[by_customer]
+    lo = 0
+    while lo < len(keys):
+        # Extend the chunk to the end of its last customer
+        hi = int(np.searchsorted(keys, keys[min(lo + chunk_size, len(keys)) - 1], side="right"))
+        cohorts.add(history.take(by_customer[lo:hi]))
+        lo = hi
+    return cohorts.report()
+
+async def build_report(session: AsyncSession, channel_id: Optional[int] = None, now: Optional[datetime] = None,
+                       horizon: int = DEFAULT_HORIZON, chunk_size: int = CHUNK_SIZE) -> CohortReport:
+    """Stream the subscription history into a ``CohortReport``, ``chunk_size`` rows at a time
+
+    Rows arrive ordered by customer and each chunk is cut between two
+    customers, so it can be added to the histograms and dropped before the
+    next is fetched. The arrays are crunched in a worker thread.
+    """
+    first_start = select(func.min(Subscription.start_date))
+    payments = (
+        select(Payment.subscription_id, func.count().label("payments"))
+        .group_by(Payment.subscription_id)
+        .subquery()
+    )
+    query = select(
+        Subscription.user_id, Subscription.channel_id, Subscription.start_date, Subscription.end_date,
+        func.coalesce(payments.c.payments, 0)
+    ).outerjoin(payments, payments.c.subscription_id == Subscription.id)
+    if channel_id is not None:
+        first_start = first_start.where(Subscription.channel_id == channel_id)
+        query = query.where(Subscription.channel_id == channel_id)
+
+    first = await session.scalar(first_start)
+    if first is None:
+        return CohortReport.empty(horizon)
+
+    cohorts = CohortAccumulator(int(month_index(np.datetime64(first, "s"))), now, horizon)
+    loop = asyncio.get_running_loop()
+    carried = []
+    result = await session.stream(
+        query.order_by(Subscription.user_id, Subscription.channel_id).execution_options(yield_per=chunk_size)
+    )
+    async for partition in result.partitions(chunk_size):
+        rows = carried + list(partition)
+        # The last customer may go on in the next partition
+        cut = len(rows)
+        while cut and tuple(rows[cut - 1][:2]) == tuple(rows[-1][:2]):
+            cut -= 1
+        rows, carried = rows[:cut], rows[cut:]
+        await loop.run_in_executor(None, cohorts.add, SubscriptionHistory.from_rows(rows))
+    await loop.run_in_executor(None, cohorts.add, SubscriptionHistory.from_rows(carried))
+    return cohorts.report()
+
+def render_report(report: CohortReport, cohorts: int = DEFAULT_HORIZON, columns: int = 6) -> str:
+    """Plain-text table of the latest ``cohorts`` cohorts and the first ``columns`` months"""
+    lines = [
+        f"Подписок: {report.subscriptions}, клиентов (пользователь + канал): {report.customers}",
+        f"Продлевают после окончания: {report.renewal_rate:.1%}",
+    ]
+    if report.churn.size:
+        lines.append(f"Отток за последний месяц: {report.churn[-1]:.1%}, в среднем: {report.churn.mean():.1%}")
+
+    lines.append("")
+    lines.append("когорта  разм " + " ".join(f"{f'M{k}':>5}" for k in range(columns)))
+    labels = report.cohort_labels
+    for c in range(len(labels))[-cohorts:]:
+        if not report.cohort_sizes[c]:
+            continue
+        cells = " ".join(
+            f"{'':>5}" if np.isnan(value) else f"{value:>5.0%}"
+            for value in report.retention[c, :columns]
+        )
+        lines.append(f"{labels[c]} {report.cohort_sizes[c]:>5} {cells}")
+    return "\n".join(lines)
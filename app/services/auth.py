@@ -0,0 +1,42 @@
+import logging
+from typing import Iterable
+from sqlalchemy.future import select
+
+from app.config import on_settings_reload
+from app.models import User
+from app.utils.db import get_session
+
+logger = logging.getLogger(__name__)
+
+class AdminRegistry:
+    """Admin Telegram IDs from ADMIN_IDS plus users.is_admin, checked in memory"""
+
+    def __init__(self, env_admin_ids: Iterable[int] = ()):
+        self.env_admin_ids = frozenset(env_admin_ids)
+        self.db_admin_ids = frozenset()
+        self.admin_ids = self.env_admin_ids
+
+    def configure(self, env_admin_ids: Iterable[int]):
+        """Replace the admin IDs coming from the environment"""
+        self.env_admin_ids = frozenset(env_admin_ids)
+        self.admin_ids = self.env_admin_ids | self.db_admin_ids
+
+    async def refresh(self, session_factory):
+        """Rebuild the admin set from the environment and the database"""
+        async with get_session(session_factory) as session:
+            result = await session.execute(select(User.user_id).filter_by(is_admin=True))
+            self.db_admin_ids = frozenset(result.scalars().all())
+        
+        self.admin_ids = self.env_admin_ids | self.db_admin_ids
+        logger.info(f"Loaded {len(self.admin_ids)} admins")
+
+    def add(self, user_id: int):
+        """Grant admin rights in memory after they were stored in the database"""
+        self.db_admin_ids = self.db_admin_ids | {user_id}
+        self.admin_ids = self.env_admin_ids | self.db_admin_ids
+
+    def is_admin(self, user_id: int) -> bool:
+        return user_id in self.admin_ids
+
+admin_registry = AdminRegistry()
+on_settings_reload(lambda settings: admin_registry.configure(settings.admin_ids))
@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.utils.exceptions import TelegramAPIError
+from sqlalchemy import distinct, func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.config import Settings
+from app.models import Broadcast, BroadcastDeadLetter, Subscription, User
+from app.models.broadcast import BROADCAST_CANCELLED, BROADCAST_DONE, BROADCAST_FAILED, BROADCAST_RUNNING
+from app.services.sender import message_sender
+from app.utils.db import after_commit, get_session
+
+logger = logging.getLogger(__name__)
+
+# Recipients fetched and sent to per page; the cursor is saved after each one
+PAGE_SIZE = 100
+
+# Progress edits of the admin's status message at most this often, in seconds
+PROGRESS_INTERVAL = 5
+
+# Retries of a page that failed with an unexpected error (a database outage,
+# say), the first after this many seconds and each one twice as late
+PAGE_RETRIES = 5
+PAGE_RETRY_DELAY = 5
+
+def recipients_query(channel_id: Optional[int]):
+    """Users with an active subscription (to ``channel_id`` if given), by database id
+
+    Walks the partial unique index on active (user_id, channel_id), so
+    each page is a range read after the cursor.
+    """
+    query = (
+        select(Subscription.user_id, User.user_id)
+        .join(User, Subscription.user_id == User.id)
+        .where(Subscription.is_active == True)
+    )
+    if channel_id is not None:
+        query = query.where(Subscription.channel_id == channel_id)
+    return query.group_by(Subscription.user_id, User.user_id).order_by(Subscription.user_id)
+
+async def count_recipients(session: AsyncSession, channel_id: Optional[int]) -> int:
+    query = select(func.count(distinct(Subscription.user_id))).where(Subscription.is_active == True)
+    if channel_id is not None:
+        query = query.where(Subscription.channel_id == channel_id)
+    return await session.scalar(query)
+
+async def fetch_recipients(session: AsyncSession, broadcast: Broadcast, size: int = PAGE_SIZE) -> List[Tuple[int, int]]:
+    """``(user id, Telegram id)`` of the next page after the broadcast's cursor"""
+    result = await session.execute(
+        recipients_query(broadcast.channel_id).where(Subscription.user_id > broadcast.cursor).limit(size)
+    )
+    return result.all()
+
+def render_progress(broadcast: Broadcast) -> str:
+    status = {
+        BROADCAST_RUNNING: "⏳ идёт",
+        BROADCAST_DONE: "✅ завершена",
+        BROADCAST_CANCELLED: "⛔ отменена",
+        BROADCAST_FAILED: "❌ прервана из-за ошибок",
+    }.get(broadcast.status, broadcast.status)
+    remaining = max(broadcast.total - broadcast.sent - broadcast.failed, 0)
+    text = (
+        f"📣 Рассылка #{broadcast.id}: {status}\n"
+        f"Отправлено: {broadcast.sent}, не доставлено: {broadcast.failed}, осталось: ~{remaining}"
+    )
+    if broadcast.status == BROADCAST_RUNNING:
+        text += f"\nОтменить: /broadcast_cancel {broadcast.id}"
+    return text
+
+class Broadcaster:
+    """Background delivery of broadcast jobs
+
+    Each running job pages through its recipients by keyset, sends a page
+    through the rate-limited message sender and then saves the cursor, counters and
+    dead letters in one transaction. Jobs still running at startup carry on
+    from their cursor; a page interrupted by a restart is sent again.
+    """
+
+    def __init__(self):
+        self.bot: Optional[Bot] = None
+        self.session_factory = None
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._last_progress: Dict[int, float] = {}
+
+    async def start(self, bot: Bot, session_factory, settings: Settings):
+        """Resume the broadcasts that were running"""
+        self.bot = bot
+        self.session_factory = session_factory
+        message_sender.configure(bot, settings.broadcast_rate)
+
+        async with get_session(session_factory) as session:
+            running = (await session.execute(
+                select(Broadcast.id).where(Broadcast.status == BROADCAST_RUNNING)
+            )).scalars().all()
+        for broadcast_id in running:
+            self.launch(broadcast_id)
+        logger.info(f"Broadcaster started: {settings.broadcast_rate} messages per second, {len(running)} broadcasts resumed")
+
+    async def stop(self):
+        """Stop delivering; running broadcasts resume from their cursor next time"""
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+
+    async def create(self, session: AsyncSession, admin_chat_id: int, channel_id: Optional[int], text: str) -> Broadcast:
+        """Add a broadcast in the caller's transaction; delivery starts once it is committed"""
+        broadcast = Broadcast(
+            channel_id=channel_id,
+            text=text,
+            status=BROADCAST_RUNNING,
+            cursor=0,
+            total=await count_recipients(session, channel_id),
+            sent=0,
+            failed=0,
+            admin_chat_id=admin_chat_id
+        )
+        session.add(broadcast)
+        await session.flush()
+        after_commit(session, lambda: self.launch(broadcast.id))
+        return broadcast
+
+    async def cancel(self, session: AsyncSession, broadcast_id: int) -> bool:
+        """Stop a running broadcast after its current page; False if it isn't running"""
+        result = await session.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id, Broadcast.status == BROADCAST_RUNNING)
+            .values(status=BROADCAST_CANCELLED, finished_at=datetime.utcnow())
+        )
+        return result.rowcount > 0
+
+    def launch(self, broadcast_id: int):
+        if self.session_factory is None:
+            logger.warning(f"Broadcaster is not running, broadcast {broadcast_id} will start on the next startup")
+            return
+        if broadcast_id in self._tasks:
+            return
+
+        task = asyncio.ensure_future(self._run(broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def _run(self, broadcast_id: int):
+        """Send page after page; a failing page is retried with backoff, then the broadcast fails"""
+        failures = 0
+        while True:
+            try:
+                if not await self._send_page(broadcast_id):
+                    return
+                failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                if failures > PAGE_RETRIES:
+                    logger.error(f"Broadcast {broadcast_id} stopped after {PAGE_RETRIES} retries: {e}", exc_info=True)
+                    await self._fail(broadcast_id, e)
+                    return
+                delay = PAGE_RETRY_DELAY * 2 ** (failures - 1)
+                logger.warning(f"Broadcast {broadcast_id} page failed, retrying in {delay} s: {e}")
+                await asyncio.sleep(delay)
+
+    async def _fail(self, broadcast_id: int, error: Exception):
+        """Mark a broadcast failed and tell its admin; if even that fails it resumes on the next startup"""
+        try:
+            async with get_session(self.session_factory) as session:
+                await session.execute(
+                    update(Broadcast)
+                    .where(Broadcast.id == broadcast_id, Broadcast.status == BROADCAST_RUNNING)
+                    .values(status=BROADCAST_FAILED, finished_at=datetime.utcnow())
+                )
+                broadcast = await session.get(Broadcast, broadcast_id, populate_existing=True)
+                await self._report(broadcast, force=True)
+            await self.bot.send_message(
+                broadcast.admin_chat_id,
+                f"❌ Рассылка #{broadcast_id} прервана: {error.__class__.__name__}: {error}"
+            )
+        except Exception as e:
+            logger.error(f"Can't mark broadcast {broadcast_id} as failed: {e}")
+
+    async def _send_page(self, broadcast_id: int) -> bool:
+        """Deliver the next page of recipients; False once the broadcast is over"""
+        async with get_session(self.session_factory) as session:
+            broadcast = await session.get(Broadcast, broadcast_id)
+            if broadcast is None or broadcast.status != BROADCAST_RUNNING:
+                if broadcast is not None:
+                    await self._report(broadcast, force=True)
+                return False
+
+            recipients = await fetch_recipients(session, broadcast)
+            if not recipients:
+                broadcast.status = BROADCAST_DONE
+                broadcast.finished_at = datetime.utcnow()
+                logger.info(f"Broadcast {broadcast_id} done: {broadcast.sent} sent, {broadcast.failed} failed")
+                await self._report(broadcast, force=True)
+                return False
+            text = broadcast.text
+
+        results = await asyncio.gather(*(message_sender.send(chat_id, text) for _, chat_id in recipients))
+
+        dead = [
+            BroadcastDeadLetter(broadcast_id=broadcast_id, user_id=chat_id, error=result[0], attempts=result[1])
+            for (_, chat_id), result in zip(recipients, results) if result is not None
+        ]
+        async with get_session(self.session_factory) as session:
+            session.add_all(dead)
+            await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id)
+                .values(
+                    cursor=recipients[-1][0],
+                    sent=Broadcast.sent + len(recipients) - len(dead),
+                    failed=Broadcast.failed + len(dead)
+                )
+            )
+            broadcast = await session.get(Broadcast, broadcast_id, populate_existing=True)
+            await self._report(broadcast)
+        return True
+
+    async def _report(self, broadcast: Broadcast, force: bool = False):
+        """Edit the admin's status message, at most every ``PROGRESS_INTERVAL`` seconds"""
+        if broadcast.status_message_id is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_progress.get(broadcast.id, 0.0) < PROGRESS_INTERVAL:
+            return
+        self._last_progress[broadcast.id] = now
+        if force:
+            self._last_progress.pop(broadcast.id, None)
+
+        try:
+            await self.bot.edit_message_text(
+                render_progress(broadcast), chat_id=broadcast.admin_chat_id, message_id=broadcast.status_message_id
+            )
+        except TelegramAPIError as e:
+            logger.debug(f"Can't update progress of broadcast {broadcast.id}: {e}")
+
+broadcaster = Broadcaster()
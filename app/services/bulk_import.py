@@ -0,0 +1,228 @@
+import csv
+import io
+import logging
+import math
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, IO, Iterator, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Channel
+from app.models.channel import ACCESS_INVITE_LINK
+from app.services.catalog import catalog, mark_catalog_changed
+from app.services.entitlements import get_access_link
+from app.services.stats import channel_added
+from app.services.subscription import create_subscription, is_subscribed
+from app.services.user import get_or_create_user
+from app.utils.db import commit, insert_ignore
+from app.utils.token_buckets import RatePacer
+
+logger = logging.getLogger(__name__)
+
+IMPORT_SUBSCRIPTIONS = "subscriptions"
+IMPORT_CHANNELS = "channels"
+
+# Header columns each import needs; the rest of its columns are optional
+REQUIRED_COLUMNS = {
+    IMPORT_SUBSCRIPTIONS: ("user_id", "channel_id", "tariff_id"),
+    IMPORT_CHANNELS: ("channel_id", "name"),
+}
+OPTIONAL_COLUMNS = {
+    IMPORT_SUBSCRIPTIONS: ("end_date", "username"),
+    IMPORT_CHANNELS: ("description",),
+}
+
+# Rows inserted per transaction
+BATCH_SIZE = 200
+
+# Single-use invite links minted per second while importing subscriptions
+INVITE_LINKS_PER_SECOND = 5
+
+# Largest file a bot may download
+MAX_IMPORT_SIZE = 20 * 1024 * 1024
+
+class RowError(ValueError):
+    """A row that can't be imported; the message is shown to the admin"""
+
+@dataclass
+class RowResult:
+    """Outcome of one data row, numbered by its line in the file"""
+
+    line: int
+    error: Optional[str] = None
+    renewal: bool = False
+    end_date: Optional[datetime] = None
+    link: Optional[str] = None
+
+@dataclass
+class ImportSummary:
+    """Counts and per-row results of one import"""
+
+    kind: str
+    results: List[RowResult] = field(default_factory=list)
+
+    @property
+    def imported(self) -> int:
+        return sum(result.error is None for result in self.results)
+
+    @property
+    def renewals(self) -> int:
+        return sum(result.error is None and result.renewal for result in self.results)
+
+    @property
+    def errors(self) -> List[RowResult]:
+        return [result for result in self.results if result.error is not None]
+
+def read_rows(file: IO[bytes], kind: str) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """``(line, row)`` pairs of an uploaded CSV, read lazily; RowError if the header is wrong"""
+    reader = csv.DictReader(io.TextIOWrapper(file, encoding="utf-8-sig", newline=""))
+    header = [name.strip().lower() for name in reader.fieldnames or []]
+    missing = [name for name in REQUIRED_COLUMNS[kind] if name not in header]
+    if missing:
+        raise RowError(f"В заголовке нет колонок: {', '.join(missing)}")
+    reader.fieldnames = header
+
+    for row in reader:
+        yield reader.line_num, {name: (value or "").strip() for name, value in row.items() if name}
+
+def batches(rows: Iterator[Tuple[int, Dict[str, str]]], size: int) -> Iterator[List[Tuple[int, Dict[str, str]]]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def parse_int(row: Dict[str, str], column: str) -> int:
+    try:
+        return int(row[column])
+    except ValueError:
+        raise RowError(f"{column}: ожидается число, получено {row[column]!r}")
+
+def parse_subscription(row: Dict[str, str], now: datetime) -> Tuple[int, int, int, int]:
+    """Validate a subscription row against the catalog
+
+    Returns the Telegram user id, the channel's database id, the tariff id
+    and the days to grant: until ``end_date`` if given, else the tariff's
+    duration.
+    """
+    user_id = parse_int(row, "user_id")
+    chat_id = parse_int(row, "channel_id")
+    tariff_id = parse_int(row, "tariff_id")
+
+    channel = catalog.channels_by_chat_id.get(chat_id)
+    if channel is None:
+        raise RowError(f"Канал {chat_id} не найден")
+    if not channel.is_active:
+        raise RowError(f"Канал {chat_id} неактивен")
+    # Same rule as for purchases: only active tariffs of the channel
+    tariff = catalog.get_tariff(tariff_id, channel.id)
+    if tariff is None:
+        raise RowError(f"Тариф {tariff_id} неактивен или не относится к каналу {chat_id}")
+
+    if not row.get("end_date"):
+        return user_id, channel.id, tariff_id, tariff.duration_days
+    try:
+        end_date = datetime.fromisoformat(row["end_date"])
+    except ValueError:
+        raise RowError(f"end_date: ожидается дата ГГГГ-ММ-ДД, получено {row['end_date']!r}")
+    if end_date <= now:
+        raise RowError(f"Подписка уже закончилась {end_date.strftime('%d.%m.%Y')}")
+    return user_id, channel.id, tariff_id, math.ceil((end_date - now).total_seconds() / 86400)
+
+async def import_subscription(session: AsyncSession, line: int, row: Dict[str, str], now: datetime) -> RowResult:
+    user_id, channel_id, tariff_id, duration_days = parse_subscription(row, now)
+    await get_or_create_user(session, user_id, username=row.get("username") or None)
+    renewal = await is_subscribed(session, user_id, channel_id)
+    _, end_date = await create_subscription(session, user_id, channel_id, tariff_id, duration_days=duration_days)
+    return RowResult(line=line, renewal=renewal, end_date=end_date)
+
+async def import_channel(session: AsyncSession, line: int, row: Dict[str, str], now: datetime) -> RowResult:
+    chat_id = parse_int(row, "channel_id")
+    if not row["name"]:
+        raise RowError("Пустое имя канала")
+
+    inserted = await insert_ignore(
+        session, Channel, ["channel_id"],
+        channel_id=chat_id, name=row["name"], description=row.get("description") or None,
+        is_active=True, access_mode=ACCESS_INVITE_LINK
+    )
+    if not inserted:
+        raise RowError(f"Канал {chat_id} уже существует")
+    await channel_added(session, is_active=True)
+    mark_catalog_changed(session)
+    return RowResult(line=line)
+
+IMPORTERS: Dict[str, Callable[[AsyncSession, int, Dict[str, str], datetime], Awaitable[RowResult]]] = {
+    IMPORT_SUBSCRIPTIONS: import_subscription,
+    IMPORT_CHANNELS: import_channel,
+}
+
+async def issue_links(results: List[RowResult], rows: Dict[int, Dict[str, str]], pacer: RatePacer) -> None:
+    """Access links for the subscriptions of a committed batch, minted no faster than the pacer allows"""
+    for result in results:
+        if result.error is not None:
+            continue
+        chat_id = int(rows[result.line]["channel_id"])
+        channel = catalog.channels_by_chat_id.get(chat_id)
+        if channel is not None and channel.access_mode == ACCESS_INVITE_LINK:
+            await pacer.wait()
+        try:
+            result.link = await get_access_link(chat_id, key=f"import:{chat_id}:{rows[result.line]['user_id']}")
+        except Exception as e:
+            logger.error(f"Failed to create an invite link for imported row {result.line}: {e}")
+
+async def import_csv(session: AsyncSession, file: IO[bytes], kind: str,
+                     progress: Optional[Callable[[ImportSummary], Awaitable[None]]] = None,
+                     batch_size: int = BATCH_SIZE) -> ImportSummary:
+    """Import an uploaded CSV one batch per transaction
+
+    Each row runs in its own savepoint, so a bad row is reported without
+    losing the rest of its batch. Imported subscriptions get their access
+    links once their batch is committed.
+    """
+    importer = IMPORTERS[kind]
+    summary = ImportSummary(kind=kind)
+    pacer = RatePacer(INVITE_LINKS_PER_SECOND)
+
+    for batch in batches(read_rows(file, kind), batch_size):
+        now = datetime.utcnow()
+        first = len(summary.results)
+        for line, row in batch:
+            try:
+                async with session.begin_nested():
+                    summary.results.append(await importer(session, line, row, now))
+            except RowError as e:
+                summary.results.append(RowResult(line=line, error=str(e)))
+            except Exception as e:
+                logger.error(f"Failed to import {kind} row {line}: {e}", exc_info=True)
+                summary.results.append(RowResult(line=line, error=f"Ошибка базы данных: {e.__class__.__name__}"))
+
+        await commit(session)
+        # Nothing from this batch is needed again; keep the session small
+        session.expunge_all()
+
+        if kind == IMPORT_SUBSCRIPTIONS:
+            await issue_links(summary.results[first:], dict(batch), pacer)
+        if progress:
+            await progress(summary)
+
+    return summary
+
+def render_results(summary: ImportSummary) -> str:
+    """CSV of every row's outcome, with the access links handed out"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["line", "status", "end_date", "link", "error"])
+    for result in summary.results:
+        writer.writerow([
+            result.line,
+            "error" if result.error else "renewed" if result.renewal else "ok",
+            result.end_date.strftime("%Y-%m-%d %H:%M") if result.end_date else "",
+            result.link or "",
+            result.error or ""
+        ])
+    return buffer.getvalue()
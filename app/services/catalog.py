@@ -0,0 +1,151 @@
+import logging
+import zlib
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.models import Channel, Tariff
+from app.models.channel import ACCESS_INVITE_LINK
+from app.utils.db import after_commit, get_session
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class ChannelSnapshot:
+    """Channel row as seen by the catalog"""
+
+    id: int
+    channel_id: int
+    name: str
+    is_active: bool
+    access_mode: str = ACCESS_INVITE_LINK
+    join_link: Optional[str] = None
+
+@dataclass(frozen=True)
+class TariffSnapshot:
+    """What a user is offered for a tariff at one catalog version"""
+
+    id: int
+    channel_id: int
+    channel_name: str
+    name: str
+    price_stars: int
+    duration_days: int
+    is_active: bool
+
+class Catalog:
+    """In-memory snapshot of the channel/tariff catalog
+
+    ``version`` is a fingerprint of the catalog contents, so it is the same
+    across restarts for the same data and changes whenever a price, duration
+    or active flag does.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.channels: Dict[int, ChannelSnapshot] = {}
+        self.channels_by_chat_id: Dict[int, ChannelSnapshot] = {}
+        self.tariffs: Dict[int, TariffSnapshot] = {}
+        self._session_factory = None
+        self._listeners: List[Callable[[int], None]] = []
+
+    def on_change(self, callback: Callable[[int], None]):
+        """Call ``callback(version)`` whenever the catalog changes"""
+        self._listeners.append(callback)
+
+    async def load(self, session_factory):
+        """Load the snapshot at startup; ``reload`` reuses the same session factory"""
+        self._session_factory = session_factory
+        await self.reload()
+
+    async def reload(self):
+        """Re-read channels and tariffs and notify listeners if anything changed"""
+        if self._session_factory is None:
+            logger.warning("Catalog reload requested before load()")
+            return
+
+        async with get_session(self._session_factory) as session:
+            channels = (await session.execute(
+                select(
+                    Channel.id, Channel.channel_id, Channel.name, Channel.is_active,
+                    Channel.access_mode, Channel.join_link
+                ).order_by(Channel.id)
+            )).all()
+            tariffs = (await session.execute(
+                select(Tariff).order_by(Tariff.id)
+            )).scalars().all()
+
+        channel_snapshot = {
+            id: ChannelSnapshot(
+                id=id, channel_id=channel_id, name=name, is_active=bool(is_active),
+                access_mode=access_mode or ACCESS_INVITE_LINK, join_link=join_link
+            )
+            for id, channel_id, name, is_active, access_mode, join_link in channels
+        }
+        channel_names = {id: channel.name for id, channel in channel_snapshot.items()}
+        snapshot = {
+            tariff.id: TariffSnapshot(
+                id=tariff.id,
+                channel_id=tariff.channel_id,
+                channel_name=channel_names.get(tariff.channel_id, ""),
+                name=tariff.name,
+                price_stars=tariff.price_stars,
+                duration_days=tariff.duration_days,
+                is_active=bool(tariff.is_active)
+            )
+            for tariff in tariffs
+        }
+        version = zlib.crc32(repr((sorted(channel_snapshot.items()), sorted(snapshot.items()))).encode())
+
+        self.channels = channel_snapshot
+        self.channels_by_chat_id = {channel.channel_id: channel for channel in channel_snapshot.values()}
+        self.tariffs = snapshot
+        if version == self.version:
+            return
+
+        self.version = version
+        logger.info(f"Catalog version is now {self.version} ({len(snapshot)} tariffs)")
+
+        for callback in self._listeners:
+            try:
+                callback(self.version)
+            except Exception as e:
+                logger.error(f"Catalog listener {callback} failed: {e}", exc_info=True)
+
+    def active_channel_chat_ids(self, access_mode: Optional[str] = None) -> List[int]:
+        """Telegram chat IDs of all active channels, optionally with the given access mode"""
+        return [
+            channel.channel_id for channel in self.channels.values()
+            if channel.is_active and (access_mode is None or channel.access_mode == access_mode)
+        ]
+
+    def get_tariff(self, tariff_id: int, channel_id: Optional[int] = None) -> Optional[TariffSnapshot]:
+        """Active tariff from the snapshot, optionally checked against its channel"""
+        tariff = self.tariffs.get(tariff_id)
+        if tariff is None or not tariff.is_active:
+            return None
+        if channel_id is not None and tariff.channel_id != channel_id:
+            return None
+        return tariff
+
+    def is_offer_current(self, tariff_id: int, channel_id: int, price_stars: int,
+                         duration_days: int, version: int) -> bool:
+        """Whether an offer made at ``version`` still matches the catalog"""
+        if version == self.version:
+            return self.get_tariff(tariff_id, channel_id) is not None
+
+        # The catalog changed since the offer was made; only this tariff matters
+        tariff = self.get_tariff(tariff_id, channel_id)
+        return (
+            tariff is not None
+            and tariff.price_stars == price_stars
+            and tariff.duration_days == duration_days
+        )
+
+catalog = Catalog()
+
+def mark_catalog_changed(session: AsyncSession):
+    """Reload the catalog once the session's changes to channels/tariffs are committed"""
+    after_commit(session, catalog.reload)
@@ -1,5 +1,4 @@
 import logging
-import os
 from datetime import datetime, timedelta
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List, Tuple
@@ -25,10 +24,8 @@ async def get_channel_tariffs(session: AsyncSession, channel_id: int) -> List[Ta
     
     return await get_all(session, Tariff, channel_id=channel.id, is_active=True)
 
-async def generate_invite_link(bot, chat_id: int) -> str:
+async def generate_invite_link(bot, chat_id: int, expire_time: int = 3600) -> str:
     """Generate a temporary invite link for a channel/group"""
-    expire_time = int(os.getenv("INVITE_LINK_EXPIRE_TIME", 3600))  # Default: 1 hour
-    
     try:
         # Create an invite link that expires after specified time
         invite_link = await bot.create_chat_invite_link(
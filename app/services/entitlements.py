@@ -0,0 +1,79 @@
+import logging
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.models import Channel, Subscription, User
+from app.models.channel import ACCESS_JOIN_REQUEST
+from app.services.catalog import catalog
+from app.services.invite_pool import invite_pool
+from app.utils.db import after_commit, get_session
+
+logger = logging.getLogger(__name__)
+
+class EntitlementIndex:
+    """Who may be in which channel, keyed by ``(tg_user_id, channel_tg_id)``
+
+    Built from active subscriptions at startup and kept current by
+    subscription writes and the expiry job, so join requests are answered
+    with a dict lookup.
+    """
+
+    def __init__(self):
+        self._until: Dict[Tuple[int, int], datetime] = {}
+
+    async def load(self, session_factory):
+        """Build the index from all active subscriptions"""
+        async with get_session(session_factory) as session:
+            result = await session.execute(
+                select(User.user_id, Channel.channel_id, Subscription.end_date)
+                .join(User, Subscription.user_id == User.id)
+                .join(Channel, Subscription.channel_id == Channel.id)
+                .where(Subscription.is_active == True)
+            )
+            rows = result.all()
+
+        self._until = {}
+        for user_id, channel_id, end_date in rows:
+            self.grant(user_id, channel_id, end_date)
+        logger.info(f"Loaded {len(self._until)} entitlements")
+
+    def grant(self, user_id: int, channel_id: int, end_date: datetime):
+        """Allow ``user_id`` into ``channel_id`` until ``end_date``"""
+        key = (user_id, channel_id)
+        current = self._until.get(key)
+        if current is None or end_date > current:
+            self._until[key] = end_date
+
+    def revoke(self, user_id: int, channel_id: int, end_date: Optional[datetime] = None):
+        """Forbid ``user_id`` from ``channel_id``; with ``end_date``, only if no later grant replaced it"""
+        key = (user_id, channel_id)
+        if end_date is None or self._until.get(key, end_date) <= end_date:
+            self._until.pop(key, None)
+
+    def is_entitled(self, user_id: int, channel_id: int, now: Optional[datetime] = None) -> bool:
+        end_date = self._until.get((user_id, channel_id))
+        return end_date is not None and end_date > (now or datetime.utcnow())
+
+    def __len__(self):
+        return len(self._until)
+
+entitlements = EntitlementIndex()
+
+def grant_after_commit(session: AsyncSession, user_id: int, channel_id: int, end_date: datetime):
+    """Update the index once the subscription is committed"""
+    after_commit(session, lambda: entitlements.grant(user_id, channel_id, end_date))
+
+def revoke_after_commit(session: AsyncSession, user_id: int, channel_id: int):
+    """Remove from the index once the deactivation is committed"""
+    after_commit(session, lambda: entitlements.revoke(user_id, channel_id))
+
+async def get_access_link(channel_id: int, key: Optional[str] = None) -> str:
+    """Link a paying user should follow: the channel's join-request link or a single-use invite link"""
+    channel = catalog.channels_by_chat_id.get(channel_id)
+    if channel is not None and channel.access_mode == ACCESS_JOIN_REQUEST and channel.join_link:
+        return channel.join_link
+
+    return await invite_pool.acquire(channel_id, key=key)
@@ -0,0 +1,120 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import tempfile
+from datetime import date, datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.sql import Select
+
+from app.models import Channel, Payment, Subscription, User
+
+logger = logging.getLogger(__name__)
+
+FORMAT_CSV = "csv"
+FORMAT_JSONL = "jsonl"
+EXPORT_FORMATS = (FORMAT_CSV, FORMAT_JSONL)
+
+# Rows fetched, serialized and compressed per round trip
+CHUNK_SIZE = 5_000
+
+# Largest document a bot may send
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+# Tables offered by /export, in primary key order so exports are stable
+EXPORTS: Dict[str, Select] = {
+    "subscriptions": select(
+        Subscription.id, Subscription.user_id, User.user_id.label("telegram_user_id"),
+        Subscription.channel_id, Subscription.tariff_id, Subscription.telegram_payment_id,
+        Subscription.start_date, Subscription.end_date, Subscription.is_active
+    ).join(User, Subscription.user_id == User.id).order_by(Subscription.id),
+    "users": select(
+        User.id, User.user_id, User.username, User.first_name, User.last_name,
+        User.created_at, User.last_active, User.is_admin
+    ).order_by(User.id),
+    "channels": select(
+        Channel.id, Channel.channel_id, Channel.name, Channel.description,
+        Channel.is_active, Channel.access_mode, Channel.join_link
+    ).order_by(Channel.id),
+    "payments": select(
+        Payment.id, Payment.telegram_payment_charge_id, Payment.provider_payment_charge_id,
+        Payment.user_id, Payment.channel_id, Payment.tariff_id, Payment.subscription_id,
+        Payment.total_amount, Payment.currency, Payment.created_at
+    ).order_by(Payment.id),
+}
+
+def export_value(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def serialize(rows: Iterable[Sequence[Any]], columns: Sequence[str], fmt: str) -> Iterator[str]:
+    """Lines of ``rows`` in ``fmt``, one row at a time"""
+    if fmt == FORMAT_JSONL:
+        for row in rows:
+            yield json.dumps(dict(zip(columns, map(export_value, row))), ensure_ascii=False) + "\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["" if value is None else export_value(value) for value in row])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+class ExportFile:
+    """A gzip-compressed CSV or JSONL file written one chunk of rows at a time"""
+
+    def __init__(self, path: str, columns: Sequence[str], fmt: str):
+        self.columns = list(columns)
+        self.fmt = fmt
+        self.file = gzip.open(path, "wt", encoding="utf-8", newline="")
+        if fmt == FORMAT_CSV:
+            csv.writer(self.file).writerow(self.columns)
+
+    def write(self, rows: List[Sequence[Any]]) -> None:
+        self.file.writelines(serialize(rows, self.columns, self.fmt))
+
+    def close(self) -> None:
+        self.file.close()
+
+async def export_table(session: AsyncSession, table: str, fmt: str, path: str,
+                       progress: Optional[Callable[[int], Awaitable[None]]] = None,
+                       chunk_size: int = CHUNK_SIZE) -> int:
+    """Stream ``table`` into a compressed file at ``path`` and return the number of rows
+
+    Rows come from a server-side cursor ``chunk_size`` at a time, and each
+    chunk is serialized and compressed in a worker thread, so memory stays
+    flat and the event loop keeps serving updates during a long export.
+    """
+    query = EXPORTS[table]
+    loop = asyncio.get_running_loop()
+    export = await loop.run_in_executor(None, ExportFile, path, [column.name for column in query.selected_columns], fmt)
+
+    count = 0
+    try:
+        result = await session.stream(query.execution_options(yield_per=chunk_size))
+        async for partition in result.partitions(chunk_size):
+            await loop.run_in_executor(None, export.write, [tuple(row) for row in partition])
+            count += len(partition)
+            if progress:
+                await progress(count)
+    finally:
+        await loop.run_in_executor(None, export.close)
+    return count
+
+def export_path(table: str, fmt: str) -> str:
+    """A new temporary file for an export; the caller removes it"""
+    descriptor, path = tempfile.mkstemp(prefix=f"{table}-", suffix=f".{fmt}.gz")
+    os.close(descriptor)
+    return path
+
+def export_filename(table: str, fmt: str, moment: Optional[datetime] = None) -> str:
+    return f"{table}-{(moment or datetime.utcnow()).strftime('%Y%m%d-%H%M%S')}.{fmt}.gz"
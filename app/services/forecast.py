@@ -0,0 +1,132 @@
+import logging
+import math
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.models import Subscription
+from app.utils.db import get_session
+
+logger = logging.getLogger(__name__)
+
+# How far ahead expirations are forecast
+HORIZON = timedelta(days=7)
+HORIZON_MINUTES = int(HORIZON.total_seconds()) // 60
+
+# Rows fetched and binned per round trip
+CHUNK_SIZE = 50_000
+
+# Revocations (ban, unban, notice) one worker gets through per second
+REVOCATION_RATE = 1.0
+
+# A burst of expirations should be revoked within this many seconds
+DRAIN_TARGET = 60
+
+@dataclass
+class ExpiryForecast:
+    """Active subscriptions ending in each minute of the next 7 days, per channel
+
+    ``per_minute[i, m]`` counts subscriptions of ``channel_ids[i]`` (database
+    id) ending in minute ``m`` after ``start``.
+    """
+
+    start: datetime
+    channel_ids: np.ndarray
+    per_minute: np.ndarray
+
+    @property
+    def per_hour(self) -> np.ndarray:
+        return self.per_minute.reshape(len(self.channel_ids), -1, 60).sum(axis=2)
+
+    @property
+    def total(self) -> int:
+        return int(self.per_minute.sum())
+
+    def _minute(self, moment: datetime) -> int:
+        return min(max(int((moment - self.start).total_seconds() // 60), 0), HORIZON_MINUTES)
+
+    def expected(self, until: datetime, since: Optional[datetime] = None) -> int:
+        """Expirations forecast between ``since`` (the start by default) and ``until``"""
+        lo = self._minute(since) if since else 0
+        return int(self.per_minute[:, lo:self._minute(until)].sum())
+
+    def busiest_hours(self, count: int) -> List[Tuple[datetime, int]]:
+        """Start and expected expirations of the ``count`` heaviest hours, heaviest first"""
+        hourly = self.per_hour.sum(axis=0)
+        top = np.argsort(hourly, kind="stable")[::-1][:count]
+        return [(self.start + timedelta(hours=int(hour)), int(hourly[hour])) for hour in top if hourly[hour]]
+
+    def per_day(self) -> np.ndarray:
+        return self.per_minute.sum(axis=0).reshape(-1, 24 * 60).sum(axis=1)
+
+    def per_channel(self) -> Dict[int, int]:
+        return dict(zip(self.channel_ids.tolist(), self.per_minute.sum(axis=1).tolist()))
+
+def revocation_concurrency(expected: int, max_concurrency: int) -> int:
+    """Workers needed to revoke ``expected`` subscriptions within ``DRAIN_TARGET``"""
+    needed = math.ceil(expected / (REVOCATION_RATE * DRAIN_TARGET))
+    return min(max(needed, 1), max_concurrency)
+
+async def build_forecast(session: AsyncSession, now: Optional[datetime] = None, chunk_size: int = CHUNK_SIZE) -> ExpiryForecast:
+    """Bin the end dates of active subscriptions expiring within ``HORIZON``, a chunk at a time"""
+    start = (now or datetime.utcnow()).replace(second=0, microsecond=0)
+    result = await session.stream(
+        select(Subscription.channel_id, Subscription.end_date)
+        .where(
+            Subscription.is_active == True,
+            Subscription.end_date >= start,
+            Subscription.end_date < start + HORIZON
+        )
+        .execution_options(yield_per=chunk_size)
+    )
+
+    rows: Dict[int, int] = {}
+    per_minute = np.zeros((0, HORIZON_MINUTES), dtype=np.int64)
+    origin = np.datetime64(start, "m")
+    async for partition in result.partitions(chunk_size):
+        channel_id, end_date = zip(*partition)
+        channels, channel = np.unique(np.array(channel_id, dtype=np.int64), return_inverse=True)
+        minutes = (np.array(end_date, dtype="datetime64[m]") - origin).astype(np.int64)
+
+        # Give channels seen for the first time their own row
+        for new in channels.tolist():
+            rows.setdefault(new, len(rows))
+        if len(rows) > len(per_minute):
+            per_minute = np.vstack([per_minute, np.zeros((len(rows) - len(per_minute), HORIZON_MINUTES), dtype=np.int64)])
+
+        row = np.array([rows[c] for c in channels.tolist()], dtype=np.int64)[channel]
+        per_minute += np.bincount(
+            row * HORIZON_MINUTES + minutes, minlength=per_minute.size
+        ).reshape(per_minute.shape)
+
+    return ExpiryForecast(start=start, channel_ids=np.array(list(rows), dtype=np.int64), per_minute=per_minute)
+
+class ExpiryForecaster:
+    """Latest forecast, rebuilt after every expiry run to size the next one"""
+
+    def __init__(self):
+        self.forecast: Optional[ExpiryForecast] = None
+
+    async def refresh(self, session_factory, now: Optional[datetime] = None) -> ExpiryForecast:
+        async with get_session(session_factory) as session:
+            self.forecast = await build_forecast(session, now)
+        logger.info(f"Forecast {self.forecast.total} expirations in the next {HORIZON.days} days")
+        return self.forecast
+
+    def concurrency(self, until: datetime, backlog: int, max_concurrency: int) -> int:
+        """Revocation workers for a run at ``until``
+
+        Sized from what the last forecast expected to expire since it was
+        made, so a promo wave gets its workers before the rows are read.
+        The forecast doesn't count rows that had already expired when it
+        was made (after downtime, say), so the backlog actually read is a
+        lower bound.
+        """
+        expected = max(self.forecast.expected(until), backlog) if self.forecast else backlog
+        return revocation_concurrency(expected, max_concurrency)
+
+expiry_forecaster = ExpiryForecaster()
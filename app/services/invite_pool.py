@@ -0,0 +1,198 @@
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Deque, Dict, List, Optional
+
+from aiogram import Bot
+
+from app.config import Settings, on_settings_reload
+from app.models.channel import ACCESS_INVITE_LINK
+from app.services.catalog import catalog
+
+logger = logging.getLogger(__name__)
+
+# Links revoked per batch and the pause between batches
+REVOKE_BATCH_SIZE = 20
+REVOKE_BATCH_DELAY = 1
+
+@dataclass(frozen=True)
+class PooledLink:
+    """Single-use invite link minted ahead of time"""
+
+    chat_id: int
+    invite_link: str
+    expire_date: datetime
+
+class InviteLinkPool:
+    """Per-channel pools of pre-generated single-use invite links
+
+    A background task keeps every active channel topped up, so payment
+    confirmation pops a ready link instead of calling the Bot API. Links
+    handed out for a payment are remembered by its key so retries of the
+    same payment get the same link. Links that expire unused are revoked
+    in batches.
+    """
+
+    def __init__(self):
+        self.bot: Optional[Bot] = None
+        self.size = 5
+        self.expire_time = 3600
+        self.refill_interval = 60
+        self._pools: Dict[int, Deque[PooledLink]] = {}
+        self._issued: Dict[str, PooledLink] = {}
+        self._expired: List[PooledLink] = []
+        self._wakeup: Optional[asyncio.Future] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def shelf_life(self) -> timedelta:
+        # A pooled link keeps a full expire_time window for the user for this long
+        return timedelta(seconds=max(self.refill_interval * 10, self.expire_time))
+
+    def configure(self, settings: Settings):
+        """Take pool size, link lifetime and refill interval from ``settings``"""
+        self.size = settings.invite_pool_size
+        self.expire_time = settings.invite_link_expire_time
+        self.refill_interval = settings.invite_pool_refill_interval
+
+    def start(self, bot: Bot, settings: Settings):
+        """Start the background refill task"""
+        self.bot = bot
+        self.configure(settings)
+
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+            logger.info(f"Invite link pool started: {self.size} links per channel")
+
+    async def stop(self):
+        """Stop the refill task and revoke links that were never handed out"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        for pool in self._pools.values():
+            self._expired.extend(pool)
+            pool.clear()
+        await self.revoke_expired()
+
+    async def acquire(self, chat_id: int, key: Optional[str] = None) -> str:
+        """Single-use invite link for ``chat_id``; the same ``key`` gets the same link while it is valid"""
+        now = datetime.now()
+
+        if key is not None:
+            issued = self._issued.get(key)
+            if issued is not None and issued.chat_id == chat_id and issued.expire_date > now:
+                return issued.invite_link
+
+        link = self._pop(chat_id, now)
+        if link is None:
+            # Pool is empty, mint one on the spot
+            link = await self._mint(chat_id, timedelta(seconds=self.expire_time))
+
+        if key is not None:
+            self._issued[key] = link
+
+        self._wake()
+        return link.invite_link
+
+    def _pop(self, chat_id: int, now: datetime) -> Optional[PooledLink]:
+        pool = self._pools.setdefault(chat_id, deque())
+        min_expire_date = now + timedelta(seconds=self.expire_time)
+
+        while pool:
+            link = pool.popleft()
+            if link.expire_date >= min_expire_date:
+                return link
+            # Too close to expiry to hand out
+            self._expired.append(link)
+
+        return None
+
+    async def _mint(self, chat_id: int, lifetime: timedelta) -> PooledLink:
+        expire_date = datetime.now() + lifetime
+        bot = self.bot or Bot.get_current()
+        invite_link = await bot.create_chat_invite_link(
+            chat_id=chat_id,
+            expire_date=expire_date,
+            member_limit=1  # One-time use link
+        )
+        return PooledLink(chat_id=chat_id, invite_link=invite_link.invite_link, expire_date=expire_date)
+
+    async def refill(self):
+        """Top up the pool of every active channel that uses single-use links"""
+        lifetime = self.shelf_life + timedelta(seconds=self.expire_time)
+
+        for chat_id in catalog.active_channel_chat_ids(ACCESS_INVITE_LINK):
+            pool = self._pools.setdefault(chat_id, deque())
+
+            while len(pool) < self.size:
+                try:
+                    pool.append(await self._mint(chat_id, lifetime))
+                except Exception as e:
+                    logger.error(f"Failed to pre-generate invite link for chat {chat_id}: {e}")
+                    break
+
+    def _collect_expired(self):
+        now = datetime.now()
+        min_expire_date = now + timedelta(seconds=self.expire_time)
+
+        for pool in self._pools.values():
+            while pool and pool[0].expire_date < min_expire_date:
+                self._expired.append(pool.popleft())
+
+        for key, link in list(self._issued.items()):
+            if link.expire_date <= now:
+                del self._issued[key]
+                self._expired.append(link)
+
+    async def revoke_expired(self):
+        """Revoke stale and expired links in batches"""
+        if self.bot is None:
+            return
+
+        expired, self._expired = self._expired, []
+
+        for start in range(0, len(expired), REVOKE_BATCH_SIZE):
+            batch = expired[start:start + REVOKE_BATCH_SIZE]
+            results = await asyncio.gather(
+                *[self.bot.revoke_chat_invite_link(link.chat_id, link.invite_link) for link in batch],
+                return_exceptions=True
+            )
+            failed = sum(isinstance(result, Exception) for result in results)
+            logger.info(f"Revoked {len(batch) - failed}/{len(batch)} expired invite links")
+
+            if start + REVOKE_BATCH_SIZE < len(expired):
+                await asyncio.sleep(REVOKE_BATCH_DELAY)
+
+    def _wake(self):
+        # Run maintenance early when a link was taken
+        if self._wakeup is not None and not self._wakeup.done():
+            self._wakeup.set_result(None)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            # Created before the pass so a link taken meanwhile triggers another one
+            self._wakeup = loop.create_future()
+            try:
+                self._collect_expired()
+                await self.refill()
+                await self.revoke_expired()
+            except Exception as e:
+                logger.error(f"Invite link pool maintenance failed: {e}", exc_info=True)
+
+            timer = loop.call_later(self.refill_interval, self._wake)
+            try:
+                await self._wakeup
+            finally:
+                timer.cancel()
+
+invite_pool = InviteLinkPool()
+on_settings_reload(invite_pool.configure)
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+from typing import Dict, Tuple
+
+from aiogram.types import LabeledPrice
+
+from app.services.catalog import TariffSnapshot, catalog
+from app.utils.payload import InvoicePayload
+
+logger = logging.getLogger(__name__)
+
+# Reusable links are paid by whoever opens them
+ANY_PAYER = 0
+
+def invoice_title(tariff: TariffSnapshot) -> str:
+    return f"Подписка на канал {tariff.channel_name}"
+
+def invoice_description(tariff: TariffSnapshot) -> str:
+    return f"Тариф: {tariff.name} ({tariff.duration_days} дней)"
+
+def offer_payload(tariff: TariffSnapshot, version: int, payload_secret: bytes) -> str:
+    """Signed payload of the reusable invoice link for ``tariff`` at ``version``"""
+    return InvoicePayload(
+        user_id=ANY_PAYER,
+        channel_id=tariff.channel_id,
+        tariff_id=tariff.id,
+        price_stars=tariff.price_stars,
+        duration_days=tariff.duration_days,
+        catalog_version=version
+    ).sign(payload_secret)
+
+class InvoiceLinkCache:
+    """Reusable invoice links per tariff and catalog version, created on first use"""
+
+    def __init__(self):
+        self._links: Dict[Tuple[int, int], asyncio.Future] = {}
+
+    async def get(self, bot, tariff: TariffSnapshot, provider_token: str, payload_secret: bytes) -> str:
+        """Invoice link for ``tariff`` at the current catalog version"""
+        version = catalog.version
+        key = (tariff.id, version)
+
+        # Concurrent clicks on a new tariff share one createInvoiceLink call
+        future = self._links.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._create(bot, tariff, version, provider_token, payload_secret))
+            self._links[key] = future
+
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            # Let the next click retry
+            if self._links.get(key) is future:
+                del self._links[key]
+            raise
+
+    async def _create(self, bot, tariff: TariffSnapshot, version: int, provider_token: str,
+                      payload_secret: bytes) -> str:
+        link = await bot.create_invoice_link(
+            title=invoice_title(tariff),
+            description=invoice_description(tariff),
+            payload=offer_payload(tariff, version, payload_secret),
+            provider_token=provider_token,
+            currency="STARS",
+            prices=[LabeledPrice(label=tariff.name, amount=tariff.price_stars * 100)],  # Amount in cents
+            need_name=False,
+            need_phone_number=False,
+            need_email=False,
+            need_shipping_address=False,
+            is_flexible=False
+        )
+        logger.info(f"Created invoice link for tariff {tariff.id} at catalog version {version}")
+        return link
+
+    def invalidate(self, version: int = None):
+        """Forget all links; they are recreated lazily for the new catalog version"""
+        self._links.clear()
+
+invoice_links = InvoiceLinkCache()
+catalog.on_change(invoice_links.invalidate)
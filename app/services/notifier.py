@@ -0,0 +1,146 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional
+
+from aiogram import Bot
+
+from app.config import Settings
+from app.services.auth import admin_registry
+
+logger = logging.getLogger(__name__)
+
+# Sales rolled into a single digest at most
+MAX_DIGEST_SIZE = 20
+
+@dataclass(frozen=True)
+class Sale:
+    """What admins are told about a successful payment"""
+
+    full_name: str
+    username: Optional[str]
+    channel_name: str
+    amount: float
+    currency: str
+    end_date: datetime
+
+    def render(self) -> str:
+        return (
+            f"💰 Новая подписка!\n\n"
+            f"Пользователь: {self.full_name} (@{self.username})\n"
+            f"Канал: {self.channel_name}\n"
+            f"Сумма: {self.amount} {self.currency}\n"
+            f"Дата окончания: {self.end_date.strftime('%d.%m.%Y %H:%M')}"
+        )
+
+def render_digest(sales: List[Sale]) -> str:
+    """One message for a batch of sales; a single sale keeps the usual format"""
+    if len(sales) == 1:
+        return sales[0].render()
+
+    lines = [f"💰 Новые подписки: {len(sales)}\n"]
+    for sale in sales:
+        lines.append(f"• {sale.full_name} (@{sale.username}) — {sale.channel_name}, {sale.amount} {sale.currency}")
+
+    totals = {}
+    for sale in sales:
+        totals[sale.currency] = totals.get(sale.currency, 0) + sale.amount
+    lines.append("\nИтого: " + ", ".join(f"{amount} {currency}" for currency, amount in totals.items()))
+    return "\n".join(lines)
+
+class AdminNotifier:
+    """Background fan-out of sale notifications to admins
+
+    Handlers only enqueue a ``Sale``. The worker waits ``digest_interval``
+    after the first sale of a batch, so a burst of payments reaches each
+    admin as one digest instead of one message per sale. ``stop`` lets the
+    worker finish the digest in flight and send what is still queued.
+    """
+
+    def __init__(self):
+        self.bot: Optional[Bot] = None
+        self.digest_interval = 5
+        self._queue: Optional[asyncio.Queue] = None
+        self._stopping: Optional[asyncio.Event] = None
+        # Waiting for the first sale of a batch, with nothing taken off the queue
+        self._idle = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, bot: Bot, settings: Settings):
+        """Start the background fan-out task"""
+        self.bot = bot
+        self.digest_interval = settings.admin_digest_interval
+
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._stopping = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+            logger.info(f"Admin notifier started: digests every {self.digest_interval} seconds")
+
+    async def stop(self):
+        """Stop the task and send whatever is still queued"""
+        if self._task is None:
+            return
+
+        self._stopping.set()
+        # An idle worker holds no sales, so it can be cancelled; otherwise it
+        # sends its batch and the rest of the queue before returning
+        if self._idle:
+            self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        # Sales queued after the worker was cancelled
+        pending = self._drain(self._queue.qsize())
+        for start in range(0, len(pending), MAX_DIGEST_SIZE):
+            await self._send(pending[start:start + MAX_DIGEST_SIZE])
+
+    def notify_sale(self, sale: Sale):
+        """Queue a sale for the next digest"""
+        if self._queue is None:
+            logger.warning("Admin notifier is not running, sale notification dropped")
+            return
+        self._queue.put_nowait(sale)
+
+    def _drain(self, limit: int) -> List[Sale]:
+        sales = []
+        while self._queue is not None and len(sales) < limit:
+            try:
+                sales.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return sales
+
+    async def _send(self, sales: List[Sale]):
+        text = render_digest(sales)
+        admin_ids = list(admin_registry.admin_ids)
+        results = await asyncio.gather(
+            *[self.bot.send_message(admin_id, text) for admin_id in admin_ids],
+            return_exceptions=True
+        )
+        for admin_id, result in zip(admin_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to notify admin {admin_id}: {result}")
+
+    async def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            self._idle = True
+            sales = [await self._queue.get()]
+            self._idle = False
+            # Let the rest of a burst arrive before sending; stop() cuts the wait short
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.digest_interval)
+            except asyncio.TimeoutError:
+                pass
+            sales.extend(self._drain(MAX_DIGEST_SIZE - 1))
+
+            try:
+                await self._send(sales)
+            except Exception as e:
+                logger.error(f"Failed to send sale digest: {e}", exc_info=True)
+
+admin_notifier = AdminNotifier()
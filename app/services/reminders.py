@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, tzinfo
+from typing import List, Optional
+
+import pytz
+from aiogram import Bot
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.config import Settings
+from app.models import Subscription, User
+from app.services.catalog import TariffSnapshot, catalog
+from app.services.invoice import invoice_links
+from app.services.sender import message_sender
+from app.utils.db import get_session
+
+logger = logging.getLogger(__name__)
+
+# Days before the end date at which reminders go out, earliest first;
+# ``reminder_stage`` is the number of them already sent
+REMINDER_DAYS = (3, 1)
+
+# Subscriptions claimed and reminded per transaction
+CLAIM_BATCH_SIZE = 500
+
+def reminder_window(stage: int, now: datetime):
+    """End dates due for reminder ``stage`` (1-based): after the next threshold, up to this one"""
+    days = REMINDER_DAYS[stage - 1]
+    next_days = REMINDER_DAYS[stage] if stage < len(REMINDER_DAYS) else 0
+    return now + timedelta(days=next_days), now + timedelta(days=days)
+
+async def claim_reminders(session: AsyncSession, stage: int, now: datetime, limit: int = CLAIM_BATCH_SIZE) -> List[int]:
+    """Mark up to ``limit`` subscriptions due for ``stage`` as reminded and return their ids
+
+    The candidates are one range read of the partial index on active end
+    dates. Rows another worker has locked are skipped, and the stage
+    condition is checked again by the UPDATE itself, so a subscription is
+    claimed for a stage exactly once; the claim is committed before
+    anything is sent.
+    """
+    since, until = reminder_window(stage, now)
+    due = (
+        select(Subscription.id)
+        .where(
+            Subscription.is_active == True,
+            Subscription.end_date > since,
+            Subscription.end_date <= until,
+            Subscription.reminder_stage < stage
+        )
+        .order_by(Subscription.end_date)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    result = await session.execute(
+        update(Subscription)
+        .where(Subscription.id.in_(due.scalar_subquery()), Subscription.reminder_stage < stage)
+        .values(reminder_stage=stage)
+        .returning(Subscription.id)
+        .execution_options(synchronize_session=False)
+    )
+    return result.scalars().all()
+
+def renewal_tariff(channel_id: int, tariff_id: int) -> Optional[TariffSnapshot]:
+    """The subscription's own tariff if it is still offered, else the channel's cheapest one"""
+    tariff = catalog.get_tariff(tariff_id, channel_id)
+    if tariff is not None:
+        return tariff
+    offered = [tariff for tariff in catalog.tariffs.values() if tariff.is_active and tariff.channel_id == channel_id]
+    return min(offered, key=lambda tariff: tariff.price_stars, default=None)
+
+def render_reminder(channel_name: str, end_date: datetime, now: datetime, timezone: tzinfo) -> str:
+    remaining = end_date - now
+    left = f"через {round(remaining / timedelta(days=1))} дн." if remaining >= timedelta(days=1) else "менее чем через сутки"
+    local_end = pytz.utc.localize(end_date).astimezone(timezone)
+    return (
+        f"⏰ Подписка на канал {channel_name} закончится {left}, "
+        f"{local_end.strftime('%d.%m.%Y %H:%M')}.\n"
+        f"Продлите её заранее, чтобы не потерять доступ."
+    )
+
+async def renewal_keyboard(bot: Bot, tariff: Optional[TariffSnapshot], settings: Settings) -> Optional[InlineKeyboardMarkup]:
+    if tariff is None:
+        return None
+    try:
+        invoice_link = await invoice_links.get(bot, tariff, settings.payment_provider_token, settings.payload_secret)
+    except Exception as e:
+        logger.error(f"Failed to create renewal invoice link for tariff {tariff.id}: {e}")
+        return None
+    keyboard = InlineKeyboardMarkup(row_width=1)
+    keyboard.add(InlineKeyboardButton(text=f"🔄 Продлить за {tariff.price_stars} Stars", url=invoice_link))
+    return keyboard
+
+async def send_reminders(bot: Bot, session: AsyncSession, ids: List[int], now: datetime, settings: Settings) -> int:
+    """Remind the owners of claimed subscriptions; returns how many were delivered"""
+    rows = (await session.execute(
+        select(User.user_id, Subscription.channel_id, Subscription.tariff_id, Subscription.end_date)
+        .join(User, Subscription.user_id == User.id)
+        .where(Subscription.id.in_(ids))
+    )).all()
+
+    async def remind(chat_id: int, channel_id: int, tariff_id: int, end_date: datetime):
+        channel = catalog.channels.get(channel_id)
+        text = render_reminder(channel.name if channel else f"#{channel_id}", end_date, now, settings.timezone)
+        keyboard = await renewal_keyboard(bot, renewal_tariff(channel_id, tariff_id), settings)
+        failure = await message_sender.send(chat_id, text, reply_markup=keyboard)
+        if failure is not None:
+            logger.warning(f"Reminder to user {chat_id} not delivered: {failure[0]}")
+        return failure is None
+
+    delivered = await asyncio.gather(*(remind(*row) for row in rows))
+    return sum(delivered)
+
+async def send_expiry_reminders(bot: Bot, session_factory, settings: Settings):
+    """Send the T-3d and T-1d reminders that are due, a claimed batch at a time
+
+    A batch is marked as reminded and committed before it is sent, so a
+    crash or a second worker can lose a reminder but never send it twice.
+    """
+    now = datetime.utcnow()
+    for stage in range(1, len(REMINDER_DAYS) + 1):
+        claimed = delivered = 0
+        while True:
+            async with get_session(session_factory) as session:
+                ids = await claim_reminders(session, stage, now)
+            if not ids:
+                break
+            claimed += len(ids)
+            async with get_session(session_factory) as session:
+                delivered += await send_reminders(bot, session, ids, now, settings)
+
+        if claimed:
+            logger.info(f"T-{REMINDER_DAYS[stage - 1]}d reminders: {delivered}/{claimed} delivered")
@@ -0,0 +1,83 @@
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from aiogram import types
+from aiogram.utils import json
+
+from app.services.catalog import catalog
+
+logger = logging.getLogger(__name__)
+
+def serialize_markup(markup: Optional[types.base.TelegramObject]) -> Optional[str]:
+    """Serialize reply markup once; aiogram sends strings as is"""
+    if markup is None:
+        return None
+    return json.dumps(markup.to_python())
+
+@dataclass(frozen=True)
+class RenderedScreen:
+    """Ready-to-send message text with serialized markup"""
+
+    text: str
+    reply_markup: Optional[str] = None
+    parse_mode: Optional[str] = "HTML"
+
+    @classmethod
+    def build(cls, text: str, markup: Optional[types.base.TelegramObject] = None,
+              parse_mode: Optional[str] = "HTML") -> "RenderedScreen":
+        return cls(text=text, reply_markup=serialize_markup(markup), parse_mode=parse_mode)
+
+    def as_kwargs(self) -> Dict[str, Any]:
+        """Keyword arguments for ``message.answer`` / ``message.edit_text``"""
+        return {"text": self.text, "reply_markup": self.reply_markup, "parse_mode": self.parse_mode}
+
+class RenderCache:
+    """Rendered screens keyed by screen name, key and catalog version
+
+    Static screens never change while the process runs. Catalog-driven
+    screens are stored under the catalog version they were built from and
+    are dropped when the catalog changes.
+    """
+
+    def __init__(self):
+        self._static: Dict[Tuple[str, Hashable], Any] = {}
+        self._catalog: Dict[Tuple[str, Hashable, int], RenderedScreen] = {}
+
+    def markup(self, screen: str, build: Callable[[], types.base.TelegramObject]) -> str:
+        """Serialized keyboard that does not depend on any data"""
+        key = (screen, "markup")
+        if key not in self._static:
+            self._static[key] = serialize_markup(build())
+        return self._static[key]
+
+    def static(self, screen: str, build: Callable[[], RenderedScreen]) -> RenderedScreen:
+        """Screen that does not depend on any data"""
+        key = (screen, None)
+        if key not in self._static:
+            self._static[key] = build()
+        return self._static[key]
+
+    async def catalog_screen(self, screen: str, key: Hashable,
+                             build: Callable[[], Awaitable[Optional[RenderedScreen]]]) -> Optional[RenderedScreen]:
+        """Screen built from channel/tariff data; ``None`` results are not cached"""
+        # Capture the version first so a render racing with a catalog change is never served
+        version = catalog.version
+        cache_key = (screen, key, version)
+
+        rendered = self._catalog.get(cache_key)
+        if rendered is None:
+            rendered = await build()
+            if rendered is not None and version == catalog.version:
+                self._catalog[cache_key] = rendered
+
+        return rendered
+
+    def invalidate_catalog(self, version: Optional[int] = None):
+        """Drop all catalog-driven screens"""
+        dropped = len(self._catalog)
+        self._catalog.clear()
+        logger.info(f"Dropped {dropped} cached catalog screens")
+
+render_cache = RenderCache()
+catalog.on_change(render_cache.invalidate_catalog)
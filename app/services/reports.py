@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from aiogram import types
+from aiogram.utils.exceptions import BadRequest, MessageNotModified
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import Settings
+from app.utils.db import get_session
+
+logger = logging.getLogger(__name__)
+
+BUILDING_TEXT = "⏳ Формирую отчёт…"
+QUEUED_TEXT = "⏳ Отчёт в очереди, скоро начну…"
+FAILED_TEXT = "❌ Не удалось сформировать отчёт."
+
+# Progress edits of one report message at most this often, in seconds
+PROGRESS_INTERVAL = 2.0
+
+# Called by a report with a short status line, e.g. "каналы (2/3)"
+Progress = Callable[[str], Awaitable[None]]
+
+# Builds the report text in its own session, reporting progress as it goes
+ReportBuilder = Callable[[AsyncSession, Progress], Awaitable[str]]
+
+# A job that delivers its own result (e.g. a document) and returns the final status text
+JobWorker = Callable[[AsyncSession, Progress], Awaitable[str]]
+
+@dataclass
+class ReportJob:
+    """A report being built and the status messages waiting for it"""
+
+    key: str
+    cache: bool = True
+    messages: List[types.Message] = field(default_factory=list)
+    last_edit: float = 0.0
+
+async def edit_message(message: types.Message, text: str) -> None:
+    try:
+        await message.edit_text(text, parse_mode="HTML")
+    except MessageNotModified:
+        pass
+    except BadRequest as e:
+        logger.debug(f"Can't edit report message {message.message_id} in {message.chat.id}: {e}")
+
+class ReportRunner:
+    """Heavy admin reports, built in the background instead of in the update handler
+
+    The admin gets a status message at once; the report is built in a task
+    holding one of ``max_concurrency`` slots with its own session, edits the
+    status message with throttled progress and finally with the result.
+    Results are cached for ``cache_ttl`` seconds, and a request for a report
+    that is already being built waits for that job instead of starting
+    another one.
+    """
+
+    def __init__(self):
+        self.session_factory = None
+        self.cache_ttl = 60
+        self.progress_interval = PROGRESS_INTERVAL
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._cache: Dict[str, Tuple[float, str]] = {}
+        self._jobs: Dict[str, ReportJob] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def start(self, session_factory, settings: Settings):
+        self.session_factory = session_factory
+        self.cache_ttl = settings.report_cache_ttl
+        self._semaphore = asyncio.Semaphore(settings.report_max_concurrency)
+        logger.info(f"Report runner started: {settings.report_max_concurrency} at a time, cached for {self.cache_ttl} seconds")
+
+    async def stop(self):
+        """Cancel the reports still being built"""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._jobs.clear()
+
+    def cached(self, key: str) -> Optional[str]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires, text = entry
+        if expires <= time.monotonic():
+            del self._cache[key]
+            return None
+        return text
+
+    def invalidate(self, key: str) -> None:
+        self._cache.pop(key, None)
+
+    async def run(self, message: types.Message, key: str, build: ReportBuilder) -> None:
+        """Answer ``message`` with report ``key``: from the cache, or built in the background"""
+        text = self.cached(key)
+        if text is not None:
+            await message.answer(text, parse_mode="HTML")
+            return
+
+        await self._submit(message, ReportJob(key=key), build)
+
+    async def run_job(self, message: types.Message, key: str, work: JobWorker) -> None:
+        """Run ``work`` in the background like a report, without caching
+
+        The status message ends up showing the text ``work`` returns;
+        requests for ``key`` while it runs join it instead of running it again.
+        """
+        await self._submit(message, ReportJob(key=key, cache=False), work)
+
+    async def _submit(self, message: types.Message, job: ReportJob, build: ReportBuilder) -> None:
+        if self._semaphore is None:
+            # Not started (e.g. a script): build inline
+            async with get_session(self.session_factory) as session:
+                await message.answer(await build(session, self._ignore_progress), parse_mode="HTML")
+            return
+
+        status = await message.answer(BUILDING_TEXT)
+        running = self._jobs.get(job.key)
+        if running is not None:
+            running.messages.append(status)
+            return
+
+        job.messages.append(status)
+        self._jobs[job.key] = job
+        task = asyncio.ensure_future(self._build(job, build))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _ignore_progress(status: str) -> None:
+        pass
+
+    async def _edit_all(self, job: ReportJob, text: str) -> None:
+        await asyncio.gather(*(edit_message(message, text) for message in job.messages))
+
+    def _progress(self, job: ReportJob) -> Progress:
+        async def progress(status: str) -> None:
+            now = time.monotonic()
+            if now - job.last_edit < self.progress_interval:
+                return
+            job.last_edit = now
+            await self._edit_all(job, f"{BUILDING_TEXT}\n{status}")
+        return progress
+
+    async def _build(self, job: ReportJob, build: ReportBuilder) -> None:
+        try:
+            if self._semaphore.locked():
+                await self._edit_all(job, QUEUED_TEXT)
+
+            async with self._semaphore:
+                started = time.monotonic()
+                job.last_edit = started
+                async with get_session(self.session_factory) as session:
+                    text = await build(session, self._progress(job))
+                logger.info(f"Report {job.key} built in {time.monotonic() - started:.2f}s")
+
+            if job.cache:
+                self._cache[job.key] = (time.monotonic() + self.cache_ttl, text)
+            # Waiters that arrive from here on are served from the cache
+            del self._jobs[job.key]
+            await self._edit_all(job, text)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to build report {job.key}: {e}", exc_info=True)
+            self._jobs.pop(job.key, None)
+            await self._edit_all(job, FAILED_TEXT)
+
+report_runner = ReportRunner()
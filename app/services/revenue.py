@@ -0,0 +1,107 @@
+import logging
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.models import DailyRollup
+from app.utils.db import after_commit, increment
+
+logger = logging.getLogger(__name__)
+
+# Periods offered by /revenue
+REPORT_PERIODS = (7, 30, 90)
+
+# Like the stat counters, rollup deltas are collected per transaction and
+# applied once it has committed, so concurrent payments of one channel and
+# tariff never queue on today's rollup row and a rolled back payment is never
+# counted.
+
+# ``session.info`` key of the deltas waiting for the commit
+PENDING_KEY = "daily_rollup_deltas"
+
+@dataclass
+class Totals:
+    """Subscription activity and stars over some set of rollup rows"""
+
+    new_subscriptions: int = 0
+    renewals: int = 0
+    expirations: int = 0
+    stars: int = 0
+
+    def add(self, row) -> None:
+        self.new_subscriptions += row.new_subscriptions
+        self.renewals += row.renewals
+        self.expirations += row.expirations
+        self.stars += row.stars
+
+@dataclass
+class RevenueReport:
+    """Rollups of ``days`` days up to ``until``, summed overall, per day and per channel"""
+
+    since: date
+    until: date
+    total: Totals = field(default_factory=Totals)
+    by_day: Dict[date, Totals] = field(default_factory=dict)
+    by_channel: Dict[int, Totals] = field(default_factory=dict)
+
+    def add(self, row) -> None:
+        self.total.add(row)
+        self.by_day.setdefault(row.day, Totals()).add(row)
+        self.by_channel.setdefault(row.channel_id, Totals()).add(row)
+
+def today() -> date:
+    # Subscription dates are naive UTC, so are the rollup days
+    return datetime.utcnow().date()
+
+async def record(session: AsyncSession, channel_id: int, tariff_id: int, **deltas) -> None:
+    """Add ``deltas`` to today's rollup of a channel and tariff once the caller's transaction commits"""
+    pending = session.info.get(PENDING_KEY)
+    if pending is None:
+        pending = session.info[PENDING_KEY] = {}
+        after_commit(session, lambda: apply_pending(session))
+    columns = pending.setdefault((today(), channel_id, tariff_id), {})
+    for column, delta in deltas.items():
+        columns[column] = columns.get(column, 0) + delta
+
+async def apply_pending(session: AsyncSession) -> None:
+    """Apply the rollup deltas of the transaction that just committed on ``session``"""
+    pending = session.info.pop(PENDING_KEY, {})
+    try:
+        # Always in the same order, so two sessions applying deltas can't deadlock
+        for (day, channel_id, tariff_id), deltas in sorted(pending.items()):
+            deltas = {column: delta for column, delta in deltas.items() if delta}
+            if deltas:
+                await increment(session, DailyRollup, deltas, day=day, channel_id=channel_id, tariff_id=tariff_id)
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        logger.error(f"Failed to apply rollup deltas {pending}: {e}")
+
+async def record_subscription(session: AsyncSession, channel_id: int, tariff_id: int, renewal: bool, stars: int = 0) -> None:
+    """A subscription was bought or granted; ``renewal`` when it extended an active one"""
+    if renewal:
+        await record(session, channel_id, tariff_id, renewals=1, stars=stars)
+    else:
+        await record(session, channel_id, tariff_id, new_subscriptions=1, stars=stars)
+
+async def record_expiration(session: AsyncSession, channel_id: int, tariff_id: int) -> None:
+    await record(session, channel_id, tariff_id, expirations=1)
+
+async def get_rollups(session: AsyncSession, since: date, until: date, channel_id: Optional[int] = None) -> List[DailyRollup]:
+    """Rollup rows of days ``since`` to ``until`` inclusive, read as one primary key range"""
+    query = select(DailyRollup).where(DailyRollup.day >= since, DailyRollup.day <= until)
+    if channel_id is not None:
+        query = query.where(DailyRollup.channel_id == channel_id)
+    result = await session.execute(query.order_by(DailyRollup.day))
+    return result.scalars().all()
+
+async def get_revenue_report(session: AsyncSession, days: int, until: Optional[date] = None) -> RevenueReport:
+    """Totals of the last ``days`` days, today included"""
+    until = until or today()
+    report = RevenueReport(since=until - timedelta(days=days - 1), until=until)
+    for row in await get_rollups(session, report.since, report.until):
+        report.add(row)
+    return report
@@ -1,88 +1,207 @@
+import asyncio
 import logging
-import os
 import pytz
-from datetime import datetime
+from datetime import datetime, timedelta, tzinfo
+from typing import List
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from aiogram import Bot
+from sqlalchemy import and_, exists, or_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import aliased, selectinload
 
-from app.utils.db import get_session, get_all
+from app.utils.db import commit, get_session
 from app.models import Subscription, User, Channel
+from app.config import Settings
+from app.services.entitlements import entitlements
+from app.services.forecast import expiry_forecaster
+from app.services.reminders import send_expiry_reminders
+from app.services.revenue import record_expiration
+from app.services.stats import reconcile_counters, subscription_ended
 
 logger = logging.getLogger(__name__)
 
-async def check_expired_subscriptions(bot: Bot, session_factory):
-    """Check for expired subscriptions and revoke access"""
+# Revocations still marked after this long were interrupted (the bot
+# stopped between the claim and its end) and are claimed again
+REVOKE_TIMEOUT = timedelta(hours=1)
+
+async def claim_expired(session: AsyncSession, now: datetime) -> List[Subscription]:
+    """Deactivate the active subscriptions that ended before ``now``, mark them as revoking and return them
+
+    The UPDATE checks ``end_date`` again on every row it takes and skips
+    rows another transaction holds, so a renewal committed in the meantime
+    is never overwritten. The caller commits the claim before kicking
+    anyone, so no row stays locked during the Telegram calls; a payment
+    arriving meanwhile starts a new subscription.
+
+    Rows left revoking for longer than ``REVOKE_TIMEOUT`` are claimed again,
+    unless their user has subscribed to the channel since.
+    """
+    renewed = aliased(Subscription)
+    claimable = or_(
+        and_(Subscription.is_active == True, Subscription.end_date < now),
+        and_(
+            Subscription.revoking_since < now - REVOKE_TIMEOUT,
+            ~exists().where(
+                renewed.user_id == Subscription.user_id,
+                renewed.channel_id == Subscription.channel_id,
+                renewed.is_active == True
+            )
+        )
+    )
+    expired = (
+        select(Subscription.id)
+        .where(claimable)
+        .with_for_update(skip_locked=True)
+    )
+    result = await session.execute(
+        update(Subscription)
+        .where(Subscription.id.in_(expired.scalar_subquery()), claimable)
+        .values(is_active=False, revoking_since=now)
+        .returning(Subscription.id)
+        .execution_options(synchronize_session=False)
+    )
+    ids = result.scalars().all()
+    if not ids:
+        return []
+    
+    # Load the claimed rows with user and channel up front
+    result = await session.execute(
+        select(Subscription)
+        .options(selectinload(Subscription.user), selectinload(Subscription.channel))
+        .where(Subscription.id.in_(ids))
+        .execution_options(populate_existing=True)
+    )
+    return result.scalars().all()
+
+async def check_expired_subscriptions(bot: Bot, session_factory, timezone: tzinfo = pytz.utc, max_concurrency: int = 10):
+    """Check for expired subscriptions and revoke access, then forecast the next run"""
     logger.info("Checking for expired subscriptions...")
     
-    timezone = pytz.timezone(os.getenv("TIMEZONE", "UTC"))
     current_time = datetime.now(timezone).replace(tzinfo=None)
     
     async with get_session(session_factory) as session:
-        # Get all active subscriptions that have expired
-        expired_subscriptions = await get_all(
-            session, 
-            Subscription, 
-            is_active=True
-        )
+        expired_subscriptions = await claim_expired(session, current_time)
+        await commit(session)
         
-        expired_subscriptions = [s for s in expired_subscriptions if s.end_date < current_time]
-        
-        if not expired_subscriptions:
+        if expired_subscriptions:
+            await revoke_subscriptions(bot, session, expired_subscriptions, max_concurrency)
+        else:
             logger.info("No expired subscriptions found")
-            return
-        
-        logger.info(f"Found {len(expired_subscriptions)} expired subscriptions")
-        
-        for subscription in expired_subscriptions:
-            # Load related objects
-            user = subscription.user
-            channel = subscription.channel
-            
-            # Only process if we have the necessary data
-            if not user or not channel:
-                logger.warning(f"Missing user or channel data for subscription {subscription.id}")
-                continue
+    
+    # Size the next run from what is about to expire
+    await expiry_forecaster.refresh(session_factory)
+
+async def finish_revocations(session: AsyncSession, revoked: List[Subscription], failed: List[Subscription]):
+    """Clear the revoking mark of claimed subscriptions and make the failed ones active again
+
+    A failed one stays inactive if its user has subscribed to the channel
+    since the claim; that newer subscription already grants the access.
+    """
+    for subscription in revoked:
+        await subscription_ended(session, subscription.user_id, subscription.channel_id)
+        await record_expiration(session, subscription.channel_id, subscription.tariff_id)
+    
+    if failed:
+        renewed = aliased(Subscription)
+        await session.execute(
+            update(Subscription)
+            .where(
+                Subscription.id.in_([subscription.id for subscription in failed]),
+                ~exists().where(
+                    renewed.user_id == Subscription.user_id,
+                    renewed.channel_id == Subscription.channel_id,
+                    renewed.is_active == True
+                )
+            )
+            .values(is_active=True)
+            .execution_options(synchronize_session=False)
+        )
+    
+    await session.execute(
+        update(Subscription)
+        .where(Subscription.id.in_([subscription.id for subscription in revoked + failed]))
+        .values(revoking_since=None)
+        .execution_options(synchronize_session=False)
+    )
+    await commit(session)
+
+async def revoke_subscriptions(bot: Bot, session: AsyncSession, expired_subscriptions: List[Subscription], max_concurrency: int):
+    """Kick the users out of claimed subscriptions, finish the claim and tell the users
+
+    The claim must already be committed: the Telegram calls run outside
+    any transaction, then one short transaction records the outcome.
+    Subscriptions whose users could not be kicked are made active again,
+    so the next run retries them.
+    """
+    # Workers were sized by the forecast made after the previous run
+    concurrency = expiry_forecaster.concurrency(datetime.utcnow(), len(expired_subscriptions), max_concurrency)
+    logger.info(f"Found {len(expired_subscriptions)} expired subscriptions, revoking with {concurrency} workers")
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    # Only process if we have the necessary data
+    candidates = []
+    failed = []
+    for subscription in expired_subscriptions:
+        if not subscription.user or not subscription.channel:
+            logger.warning(f"Missing user or channel data for subscription {subscription.id}")
+            failed.append(subscription)
+            continue
+        candidates.append(subscription)
+    
+    async def kick(subscription):
+        async with semaphore:
+            # Use ban method to ensure they can't rejoin with old invite links
+            await bot.ban_chat_member(
+                chat_id=subscription.channel.channel_id,
+                user_id=subscription.user.user_id
+            )
             
-            # Try to kick user from channel
+            # Immediately unban so user can re-subscribe later
+            await bot.unban_chat_member(
+                chat_id=subscription.channel.channel_id,
+                user_id=subscription.user.user_id,
+                only_if_banned=True
+            )
+    
+    # Telegram calls run concurrently, with no transaction open
+    results = await asyncio.gather(*(kick(subscription) for subscription in candidates), return_exceptions=True)
+    
+    revoked = []
+    for subscription, error in zip(candidates, results):
+        if isinstance(error, Exception):
+            logger.error(f"Failed to revoke access for user {subscription.user.user_id} to channel {subscription.channel.channel_id}: {error}")
+            failed.append(subscription)
+            continue
+        revoked.append(subscription)
+    
+    await finish_revocations(session, revoked, failed)
+    
+    async def notify(subscription):
+        user, channel = subscription.user, subscription.channel
+        # A renewal committed since the claim keeps its entitlement
+        entitlements.revoke(user.user_id, channel.channel_id, subscription.end_date)
+        
+        # Notify user about subscription expiration
+        async with semaphore:
             try:
-                # Use ban method to ensure they can't rejoin with old invite links
-                await bot.ban_chat_member(
-                    chat_id=channel.channel_id,
-                    user_id=user.user_id
-                )
-                
-                # Immediately unban so user can re-subscribe later
-                await bot.unban_chat_member(
-                    chat_id=channel.channel_id,
-                    user_id=user.user_id,
-                    only_if_banned=True
+                await bot.send_message(
+                    chat_id=user.user_id,
+                    text=f"Your subscription to {channel.name} has expired. "
+                         f"You can renew your subscription using the /start command."
                 )
-                
-                # Mark subscription as inactive
-                subscription.is_active = False
-                await session.commit()
-                
-                # Notify user about subscription expiration
-                try:
-                    await bot.send_message(
-                        chat_id=user.user_id,
-                        text=f"Your subscription to {channel.name} has expired. "
-                             f"You can renew your subscription using the /start command."
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to notify user {user.user_id} about subscription expiration: {e}")
-                
-                logger.info(f"Successfully revoked access for user {user.user_id} to channel {channel.name}")
-                
             except Exception as e:
-                logger.error(f"Failed to revoke access for user {user.user_id} to channel {channel.channel_id}: {e}")
+                logger.error(f"Failed to notify user {user.user_id} about subscription expiration: {e}")
+        
+        logger.info(f"Successfully revoked access for user {user.user_id} to channel {channel.name}")
+    
+    await asyncio.gather(*(notify(subscription) for subscription in revoked))
 
-def setup_scheduler(bot: Bot, session_factory):
+def setup_scheduler(bot: Bot, session_factory, settings: Settings):
     """Set up scheduler for periodic tasks"""
-    scheduler = AsyncIOScheduler()
+    scheduler = AsyncIOScheduler(timezone=settings.timezone)
     
-    # Convert interval from env to seconds
-    interval_seconds = int(os.getenv("CHECK_SUBSCRIPTION_INTERVAL", 3600))
+    interval_seconds = settings.check_subscription_interval
     
     # Schedule subscription checker job
     scheduler.add_job(
@@ -91,10 +210,31 @@ def setup_scheduler(bot: Bot, session_factory):
         seconds=interval_seconds,
         kwargs={
             'bot': bot,
-            'session_factory': session_factory
+            'session_factory': session_factory,
+            'timezone': settings.timezone,
+            'max_concurrency': settings.expiry_max_concurrency
         }
     )
     
+    # Remind users before their subscriptions end
+    scheduler.add_job(
+        send_expiry_reminders,
+        'interval',
+        seconds=settings.reminder_interval,
+        kwargs={'bot': bot, 'session_factory': session_factory, 'settings': settings}
+    )
+    
+    # Forecast right away so the first run is sized too
+    scheduler.add_job(expiry_forecaster.refresh, 'date', kwargs={'session_factory': session_factory})
+    
+    # Correct any drift of the dashboard counters
+    scheduler.add_job(
+        reconcile_counters,
+        'interval',
+        seconds=settings.stats_reconcile_interval,
+        kwargs={'session_factory': session_factory}
+    )
+    
     # Start scheduler
     scheduler.start()
     
@@ -0,0 +1,63 @@
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Tuple
+
+from aiogram import types
+from aiogram.utils.exceptions import BadRequest, MessageNotModified
+
+from app.services.render_cache import RenderedScreen
+
+logger = logging.getLogger(__name__)
+
+def screen_digest(screen: RenderedScreen) -> bytes:
+    """Hash of everything that is visible in a rendered screen"""
+    content = f"{screen.parse_mode}\0{screen.text}\0{screen.reply_markup or ''}"
+    return hashlib.blake2b(content.encode(), digest_size=8).digest()
+
+class ScreenTracker:
+    """Digest of the screen last shown in each (chat, message)
+
+    Navigation callbacks edit their message in place, and an edit that would
+    show exactly what is already there is skipped without an API call.
+    Only the most recent ``max_messages`` messages are remembered.
+    """
+
+    def __init__(self, max_messages: int = 10000):
+        self.max_messages = max_messages
+        self._digests: "OrderedDict[Tuple[int, int], bytes]" = OrderedDict()
+
+    def remember(self, message: types.Message, screen: RenderedScreen):
+        """Record the screen a message now shows"""
+        key = (message.chat.id, message.message_id)
+        self._digests[key] = screen_digest(screen)
+        self._digests.move_to_end(key)
+        while len(self._digests) > self.max_messages:
+            self._digests.popitem(last=False)
+
+    def is_shown(self, message: types.Message, screen: RenderedScreen) -> bool:
+        return self._digests.get((message.chat.id, message.message_id)) == screen_digest(screen)
+
+    async def show(self, message: types.Message, screen: RenderedScreen):
+        """Edit ``message`` to show ``screen``; send a new message if it can't be edited"""
+        if self.is_shown(message, screen):
+            return
+
+        try:
+            await message.edit_text(**screen.as_kwargs())
+        except MessageNotModified:
+            pass
+        except BadRequest as e:
+            # Too old, not a text message, or gone: fall back to a new message
+            logger.debug(f"Can't edit message {message.message_id} in {message.chat.id}: {e}")
+            message = await message.answer(**screen.as_kwargs())
+
+        self.remember(message, screen)
+
+    async def send(self, message: types.Message, screen: RenderedScreen) -> types.Message:
+        """Answer ``message`` with ``screen`` and remember what the new message shows"""
+        sent = await message.answer(**screen.as_kwargs())
+        self.remember(sent, screen)
+        return sent
+
+screens = ScreenTracker()
@@ -0,0 +1,52 @@
+import asyncio
+import logging
+from typing import Optional, Tuple
+
+from aiogram import Bot
+from aiogram.utils.exceptions import BadRequest, RetryAfter, TelegramAPIError, Unauthorized
+
+from app.utils.token_buckets import RatePacer
+
+logger = logging.getLogger(__name__)
+
+# Sends of one message before giving up; 429s don't count
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 1
+
+class MessageSender:
+    """Rate-limited ``send_message`` for bulk messages, with retries
+
+    Broadcasts and reminders share one pacer, so together they stay under
+    the bot's global message rate.
+    """
+
+    def __init__(self):
+        self.bot: Optional[Bot] = None
+        self.pacer = RatePacer(20)
+
+    def configure(self, bot: Bot, rate: float):
+        self.bot = bot
+        self.pacer = RatePacer(rate)
+
+    async def send(self, chat_id: int, text: str, **kwargs) -> Optional[Tuple[str, int]]:
+        """Send one message; ``(error, attempts)`` if it could not be delivered"""
+        bot = self.bot or Bot.get_current()
+        attempts = 0
+        while True:
+            await self.pacer.wait()
+            try:
+                await bot.send_message(chat_id, text, **kwargs)
+                return None
+            except RetryAfter as e:
+                # Flood control: everyone waits, and this one is sent again
+                self.pacer.hold(e.timeout)
+            except (Unauthorized, BadRequest) as e:
+                # Blocked, deactivated or unknown chat: retrying won't help
+                return e.__class__.__name__, attempts + 1
+            except (TelegramAPIError, asyncio.TimeoutError, OSError) as e:
+                attempts += 1
+                if attempts >= MAX_ATTEMPTS:
+                    return f"{e.__class__.__name__}: {e}", attempts
+                await asyncio.sleep(RETRY_DELAY * 2 ** (attempts - 1))
+
+message_sender = MessageSender()
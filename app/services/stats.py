@@ -0,0 +1,167 @@
+import logging
+from typing import Dict, List, Tuple
+
+from sqlalchemy import case, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.models import Channel, Subscription, User, StatCounter
+from app.models.stat_counter import GLOBAL_SCOPE
+from app.utils.db import after_commit, get_session, increment
+
+logger = logging.getLogger(__name__)
+
+USERS_TOTAL = "users_total"
+USERS_ACTIVE = "users_active"
+CHANNELS_TOTAL = "channels_total"
+CHANNELS_ACTIVE = "channels_active"
+SUBSCRIPTIONS_TOTAL = "subscriptions_total"
+SUBSCRIPTIONS_ACTIVE = "subscriptions_active"
+
+GLOBAL_COUNTERS = (USERS_TOTAL, USERS_ACTIVE, CHANNELS_TOTAL, CHANNELS_ACTIVE, SUBSCRIPTIONS_TOTAL, SUBSCRIPTIONS_ACTIVE)
+
+# Counter deltas are collected per transaction and applied once it has
+# committed, in a short transaction of their own, so payments never queue on
+# the global counter rows and a rolled back write never shows up in the
+# dashboards. A crash between the two commits, a savepoint rolled back after
+# a bump or concurrent first subscriptions of one user can still skew the
+# counters; reconcile_counters recomputes everything from the base tables
+# and fixes that.
+
+# ``session.info`` key of the deltas waiting for the commit
+PENDING_KEY = "stat_counter_deltas"
+
+async def bump(session: AsyncSession, name: str, delta: int = 1, channel_id: int = GLOBAL_SCOPE):
+    pending = session.info.get(PENDING_KEY)
+    if pending is None:
+        pending = session.info[PENDING_KEY] = {}
+        after_commit(session, lambda: apply_pending(session))
+    key = (name, channel_id)
+    pending[key] = pending.get(key, 0) + delta
+
+async def apply_pending(session: AsyncSession):
+    """Apply the deltas of the transaction that just committed on ``session``"""
+    pending = session.info.pop(PENDING_KEY, {})
+    try:
+        # Always in the same order, so two sessions applying deltas can't deadlock
+        for (name, channel_id), delta in sorted(pending.items()):
+            if delta:
+                await increment(session, StatCounter, {"value": delta}, name=name, channel_id=channel_id)
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        logger.error(f"Failed to apply counter deltas {pending}: {e}")
+
+async def user_created(session: AsyncSession):
+    await bump(session, USERS_TOTAL)
+
+async def channel_added(session: AsyncSession, is_active: bool):
+    await bump(session, CHANNELS_TOTAL)
+    if is_active:
+        await bump(session, CHANNELS_ACTIVE)
+
+async def channel_toggled(session: AsyncSession, is_active: bool):
+    await bump(session, CHANNELS_ACTIVE, 1 if is_active else -1)
+
+async def _active_subscription_count(session: AsyncSession, user_id: int) -> int:
+    await session.flush()
+    return await session.scalar(
+        select(func.count(Subscription.id))
+        .where(Subscription.user_id == user_id, Subscription.is_active == True)
+    )
+
+async def subscription_started(session: AsyncSession, user_id: int, channel_id: int):
+    """Count a new active subscription row; ``user_id`` and ``channel_id`` are database ids"""
+    for scope in (GLOBAL_SCOPE, channel_id):
+        await bump(session, SUBSCRIPTIONS_TOTAL, channel_id=scope)
+        await bump(session, SUBSCRIPTIONS_ACTIVE, channel_id=scope)
+    if await _active_subscription_count(session, user_id) == 1:
+        await bump(session, USERS_ACTIVE)
+
+async def subscription_ended(session: AsyncSession, user_id: int, channel_id: int):
+    """Count an active subscription that was just deactivated"""
+    for scope in (GLOBAL_SCOPE, channel_id):
+        await bump(session, SUBSCRIPTIONS_ACTIVE, -1, channel_id=scope)
+    if await _active_subscription_count(session, user_id) == 0:
+        await bump(session, USERS_ACTIVE, -1)
+
+async def get_counters(session: AsyncSession, channel_id: int = GLOBAL_SCOPE) -> Dict[str, int]:
+    """All counters of one scope, missing ones as zero"""
+    result = await session.execute(
+        select(StatCounter.name, StatCounter.value).where(StatCounter.channel_id == channel_id)
+    )
+    counters = dict.fromkeys(GLOBAL_COUNTERS, 0)
+    counters.update(result.all())
+    return counters
+
+async def get_channel_counters(session: AsyncSession, limit: int) -> List[Tuple[int, int, str, bool, int, int]]:
+    """Channels with the most active subscriptions: id, channel_id, name, is_active, total, active"""
+    total = select(StatCounter).where(StatCounter.name == SUBSCRIPTIONS_TOTAL).subquery()
+    active = select(StatCounter).where(StatCounter.name == SUBSCRIPTIONS_ACTIVE).subquery()
+    active_value = func.coalesce(active.c.value, 0)
+    result = await session.execute(
+        select(
+            Channel.id, Channel.channel_id, Channel.name, Channel.is_active,
+            func.coalesce(total.c.value, 0), active_value
+        )
+        .outerjoin(total, total.c.channel_id == Channel.id)
+        .outerjoin(active, active.c.channel_id == Channel.id)
+        .order_by(active_value.desc(), Channel.id)
+        .limit(limit)
+    )
+    return result.all()
+
+async def count_from_tables(session: AsyncSession) -> Dict[Tuple[str, int], int]:
+    """Every counter recomputed from the base tables"""
+    counts = {
+        (USERS_TOTAL, GLOBAL_SCOPE): await session.scalar(select(func.count(User.id))),
+        (USERS_ACTIVE, GLOBAL_SCOPE): await session.scalar(
+            select(func.count(func.distinct(Subscription.user_id))).where(Subscription.is_active == True)
+        ),
+    }
+    
+    channels_total, channels_active = (await session.execute(
+        select(func.count(Channel.id), func.sum(case((Channel.is_active == True, 1), else_=0)))
+    )).one()
+    counts[(CHANNELS_TOTAL, GLOBAL_SCOPE)] = channels_total
+    counts[(CHANNELS_ACTIVE, GLOBAL_SCOPE)] = channels_active or 0
+    
+    counts[(SUBSCRIPTIONS_TOTAL, GLOBAL_SCOPE)] = counts[(SUBSCRIPTIONS_ACTIVE, GLOBAL_SCOPE)] = 0
+    result = await session.execute(
+        select(
+            Subscription.channel_id,
+            func.count(Subscription.id),
+            func.sum(case((Subscription.is_active == True, 1), else_=0))
+        ).group_by(Subscription.channel_id)
+    )
+    for channel_id, total, active in result.all():
+        counts[(SUBSCRIPTIONS_TOTAL, channel_id)] = total
+        counts[(SUBSCRIPTIONS_ACTIVE, channel_id)] = active or 0
+        counts[(SUBSCRIPTIONS_TOTAL, GLOBAL_SCOPE)] += total
+        counts[(SUBSCRIPTIONS_ACTIVE, GLOBAL_SCOPE)] += active or 0
+    return counts
+
+async def reconcile_counters(session_factory) -> Dict[Tuple[str, int], Tuple[int, int]]:
+    """Overwrite counters that drifted from the base tables; returns ``{key: (stored, actual)}``"""
+    async with get_session(session_factory) as session:
+        actual = await count_from_tables(session)
+        stored = {
+            (counter.name, counter.channel_id): counter
+            for counter in (await session.execute(select(StatCounter))).scalars()
+        }
+        
+        drift = {}
+        for key in actual.keys() | stored.keys():
+            value = actual.get(key, 0)
+            counter = stored.get(key)
+            if counter is None:
+                if value:
+                    session.add(StatCounter(name=key[0], channel_id=key[1], value=value))
+                    drift[key] = (0, value)
+            elif counter.value != value:
+                drift[key] = (counter.value, value)
+                counter.value = value
+    
+    if drift:
+        logger.warning(f"Corrected {len(drift)} drifted counters: {drift}")
+    return drift
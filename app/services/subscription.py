@@ -1,11 +1,20 @@
 import logging
 from datetime import datetime, timedelta
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
 from typing import Optional, List, Dict, Any, Tuple
 
-from app.models import User, Channel, Tariff, Subscription
-from app.utils.db import get_by_filters, get_all, create_object, update_object
-from app.services.channel import generate_invite_link
+from app.config import Settings
+from app.models import User, Channel, Tariff, Subscription, Payment
+from app.utils.db import get_by_filters, get_all, insert_ignore
+from app.utils.payload import InvoicePayload
+from app.services.catalog import catalog
+from app.services.entitlements import grant_after_commit
+from app.services.invoice import ANY_PAYER
+from app.services.revenue import record_subscription
+from app.services.stats import subscription_started
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +26,18 @@ async def get_user_subscriptions(session: AsyncSession, user_id: int) -> List[Su
     
     return await get_all(session, Subscription, user_id=user.id, is_active=True)
 
+async def get_subscription_summaries(session: AsyncSession, user_id: int) -> List[Tuple[str, str, datetime]]:
+    """Channel name, tariff name and end date of each active subscription of a user"""
+    result = await session.execute(
+        select(Channel.name, Tariff.name, Subscription.end_date)
+        .join(User, Subscription.user_id == User.id)
+        .join(Channel, Subscription.channel_id == Channel.id)
+        .join(Tariff, Subscription.tariff_id == Tariff.id)
+        .where(User.user_id == user_id, Subscription.is_active == True)
+        .order_by(Subscription.end_date)
+    )
+    return result.all()
+
 async def is_subscribed(session: AsyncSession, user_id: int, channel_id: int) -> bool:
     """Check if user is subscribed to a channel"""
     user = await get_by_filters(session, User, user_id=user_id)
@@ -35,103 +56,193 @@ async def is_subscribed(session: AsyncSession, user_id: int, channel_id: int) ->
     
     return subscription is not None
 
+async def _lock_active_subscription(session: AsyncSession, user_id: int, channel_id: int) -> Optional[Subscription]:
+    """Active subscription row, locked until the end of the transaction"""
+    result = await session.execute(
+        select(Subscription)
+        .where(
+            Subscription.user_id == user_id,
+            Subscription.channel_id == channel_id,
+            Subscription.is_active == True
+        )
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    )
+    return result.scalar_one_or_none()
+
 async def create_subscription(
     session: AsyncSession, 
     user_id: int, 
     channel_id: int, 
     tariff_id: int,
-    telegram_payment_id: str = None
+    telegram_payment_id: str = None,
+    duration_days: Optional[int] = None,
+    stars: int = 0
 ) -> Tuple[Subscription, datetime]:
-    """Create a new subscription"""
+    """Create a new subscription or extend the active one
+
+    When ``duration_days`` comes from a verified invoice payload the tariff
+    is not looked up again. The active row is locked while it is extended,
+    and the partial unique index on active subscriptions turns a concurrent
+    first purchase into an extension of the row that won. The day's rollup
+    counts a new subscription or a renewal and the ``stars`` paid.
+    """
     user = await get_by_filters(session, User, user_id=user_id)
-    tariff = await get_by_filters(session, Tariff, id=tariff_id)
+    if duration_days is None:
+        tariff = await get_by_filters(session, Tariff, id=tariff_id)
+        if tariff:
+            channel_id, duration_days = tariff.channel_id, tariff.duration_days
     
-    if not user or not tariff:
+    if not user or duration_days is None:
         logger.error(f"Failed to create subscription: User {user_id} or Tariff {tariff_id} not found")
         raise ValueError("User or Tariff not found")
     
-    # Calculate end date based on tariff duration
-    start_date = datetime.utcnow()
-    end_date = start_date + timedelta(days=tariff.duration_days)
-    
-    # Check if user already has an active subscription for this channel
-    existing_sub = await get_by_filters(
-        session, 
-        Subscription, 
-        user_id=user.id, 
-        channel_id=tariff.channel_id,
-        is_active=True
-    )
-    
-    if existing_sub:
-        # Extend existing subscription
-        new_end_date = max(existing_sub.end_date, datetime.utcnow()) + timedelta(days=tariff.duration_days)
-        subscription = await update_object(
-            session,
-            existing_sub,
-            end_date=new_end_date,
-            tariff_id=tariff.id,
-            telegram_payment_id=telegram_payment_id
+    duration = timedelta(days=duration_days)
+    subscription = await _lock_active_subscription(session, user.id, channel_id)
+    renewal = subscription is not None and await _extend(session, subscription, duration, tariff_id, telegram_payment_id)
+    
+    if not renewal:
+        start_date = datetime.utcnow()
+        try:
+            async with session.begin_nested():
+                subscription = Subscription(
+                    user_id=user.id,
+                    channel_id=channel_id,
+                    tariff_id=tariff_id,
+                    start_date=start_date,
+                    end_date=start_date + duration,
+                    telegram_payment_id=telegram_payment_id,
+                    is_active=True
+                )
+                session.add(subscription)
+        except IntegrityError:
+            # Another payment created the active row first; extend that one
+            subscription = await _lock_active_subscription(session, user.id, channel_id)
+            if subscription is None or not await _extend(session, subscription, duration, tariff_id, telegram_payment_id):
+                raise
+            renewal = True
+        else:
+            await subscription_started(session, user.id, channel_id)
+    
+    await session.flush()
+    await record_subscription(session, channel_id, tariff_id, renewal, stars)
+    
+    # Let join requests through as soon as the subscription is committed
+    channel = catalog.channels.get(channel_id) or await get_by_filters(session, Channel, id=channel_id)
+    if channel:
+        grant_after_commit(session, user_id, channel.channel_id, subscription.end_date)
+    
+    return subscription, subscription.end_date
+
+async def _extend(session: AsyncSession, subscription: Subscription, duration: timedelta,
+                  tariff_id: int, telegram_payment_id: Optional[str]) -> bool:
+    """Push back the end date of a locked active subscription; False if it was deactivated meanwhile
+
+    The UPDATE only applies while the row is still active with the end date
+    that was read. With row locks that always holds; on SQLite, which has
+    none, it keeps a renewal from reviving a row the expiry job has claimed.
+    """
+    result = await session.execute(
+        update(Subscription)
+        .where(
+            Subscription.id == subscription.id,
+            Subscription.is_active == True,
+            Subscription.end_date == subscription.end_date
         )
-    else:
-        # Create new subscription
-        subscription = await create_object(
-            session,
-            Subscription,
-            user_id=user.id,
-            channel_id=tariff.channel_id,
-            tariff_id=tariff.id,
-            start_date=start_date,
-            end_date=end_date,
+        .values(
+            end_date=max(subscription.end_date, datetime.utcnow()) + duration,
+            tariff_id=tariff_id,
             telegram_payment_id=telegram_payment_id,
-            is_active=True
+            # The new end date gets its own reminders
+            reminder_stage=0
         )
-    
-    return subscription, end_date
+        .returning(Subscription)
+        .execution_options(populate_existing=True, synchronize_session="fetch")
+    )
+    return result.scalar_one_or_none() is not None
 
 async def process_successful_payment(
     bot,
     session: AsyncSession,
     user_id: int,
-    payment_data: Dict[str, Any]
+    payment_data: Dict[str, Any],
+    settings: Settings
 ) -> Dict[str, Any]:
-    """Process a successful payment and create subscription"""
-    # Extract channel and tariff IDs from payment payload
-    payload = payment_data.get("invoice_payload", "")
-    parts = payload.split(":")
-    
-    if len(parts) != 3:
-        logger.error(f"Invalid payment payload format: {payload}")
-        raise ValueError("Invalid payment payload")
+    """Process a successful payment and create subscription
+
+    The payment is first recorded in the ledger, keyed by its Telegram
+    charge id, so a redelivered or retried update finds the row already
+    there and gets the original result back, with ``duplicate`` set, instead
+    of extending the subscription again. Only database work happens here;
+    the caller commits and then fetches the access link with
+    ``get_access_link``.
+    """
+    # Channel, tariff and duration come from the signed payload; InvalidPayload is a ValueError
+    payload = InvoicePayload.verify(payment_data.get("invoice_payload", ""), settings.payload_secret)
+    
+    # Verify user ID matches, unless the invoice came from a reusable link
+    if payload.user_id not in (ANY_PAYER, user_id):
+        logger.error(f"User ID mismatch: {user_id} != {payload.user_id}")
+        raise ValueError("User ID mismatch")
     
-    user_id_from_payload, channel_id, tariff_id = int(parts[0]), int(parts[1]), int(parts[2])
+    charge_id = payment_data.get("telegram_payment_charge_id")
+    if not charge_id:
+        raise ValueError("Missing telegram_payment_charge_id")
     
-    # Verify user ID matches
-    if user_id != user_id_from_payload:
-        logger.error(f"User ID mismatch: {user_id} != {user_id_from_payload}")
-        raise ValueError("User ID mismatch")
+    user = await get_by_filters(session, User, user_id=user_id)
+    if not user:
+        logger.error(f"User not found: {user_id}")
+        raise ValueError("User not found")
     
     # Get channel info
-    channel = await get_by_filters(session, Channel, id=channel_id)
+    channel = await get_by_filters(session, Channel, id=payload.channel_id)
     if not channel:
-        logger.error(f"Channel not found: {channel_id}")
+        logger.error(f"Channel not found: {payload.channel_id}")
         raise ValueError("Channel not found")
     
-    # Create or extend subscription
-    subscription, end_date = await create_subscription(
+    # Claim the charge id before touching the subscription
+    recorded = await insert_ignore(
         session,
-        user_id,
-        channel_id,
-        tariff_id,
-        payment_data.get("telegram_payment_charge_id")
+        Payment,
+        ["telegram_payment_charge_id"],
+        telegram_payment_charge_id=charge_id,
+        provider_payment_charge_id=payment_data.get("provider_payment_charge_id"),
+        user_id=user.id,
+        channel_id=payload.channel_id,
+        tariff_id=payload.tariff_id,
+        total_amount=payment_data.get("total_amount", payload.price_stars * 100),
+        currency=payment_data.get("currency", "STARS"),
+        invoice_payload=payment_data.get("invoice_payload"),
+        created_at=datetime.utcnow()
     )
     
-    # Generate invite link
-    invite_link = await generate_invite_link(bot, channel.channel_id)
+    if recorded:
+        # Create or extend subscription
+        subscription, end_date = await create_subscription(
+            session,
+            user_id,
+            payload.channel_id,
+            payload.tariff_id,
+            charge_id,
+            duration_days=payload.duration_days,
+            stars=payload.price_stars
+        )
+        await session.execute(
+            update(Payment)
+            .where(Payment.telegram_payment_charge_id == charge_id)
+            .values(subscription_id=subscription.id)
+        )
+    else:
+        logger.info(f"Payment {charge_id} was already processed")
+        payment = await get_by_filters(session, Payment, telegram_payment_charge_id=charge_id)
+        subscription = await get_by_filters(session, Subscription, id=payment.subscription_id)
+        if subscription is None:
+            raise ValueError("Payment is recorded without a subscription")
+        end_date = subscription.end_date
     
     return {
         "subscription": subscription,
         "channel": channel,
-        "invite_link": invite_link,
-        "end_date": end_date
-    } 
\ No newline at end of file
+        "end_date": end_date,
+        "duplicate": not recorded
+    }
@@ -1,10 +1,11 @@
 import logging
-import os
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List
 
 from app.models import User
 from app.utils.db import get_by_filters, create_object, update_object
+from app.services.auth import admin_registry
+from app.services.stats import user_created
 
 logger = logging.getLogger(__name__)
 
@@ -42,8 +43,7 @@ async def get_or_create_user(
     
     # Create new user
     # Check if user is an admin
-    admin_ids = [int(id.strip()) for id in os.getenv("ADMIN_IDS", "").split(",") if id.strip()]
-    is_admin = user_id in admin_ids
+    is_admin = user_id in admin_registry.env_admin_ids
     
     user = await create_object(
         session,
@@ -54,15 +54,11 @@ async def get_or_create_user(
         last_name=last_name,
         is_admin=is_admin
     )
+    await user_created(session)
     
     logger.info(f"Created new user: {user}")
     return user
 
-async def is_admin(session: AsyncSession, user_id: int) -> bool:
-    """Check if user is an admin"""
-    user = await get_by_filters(session, User, user_id=user_id)
-    
-    if not user:
-        return False
-        
-    return user.is_admin 
\ No newline at end of file
+def is_admin(user_id: int) -> bool:
+    """Check if user is an admin (served from the in-memory admin registry)"""
+    return admin_registry.is_admin(user_id) 
\ No newline at end of file
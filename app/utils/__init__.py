@@ -1,11 +1,21 @@
 from app.utils.logging import setup_logging
 from app.utils.db import (
     get_session, get_by_id, get_by_filters, 
-    get_all, create_object, update_object, delete_object
+    get_all, create_object, update_object, delete_object,
+    insert_ignore, increment, UnitOfWork, after_commit, commit
 )
+from app.utils.callback_router import CallbackRouter
+from app.utils.payload import InvoicePayload, InvalidPayload
+from app.utils.tracing import FunnelTracer, correlation_id, tracer
+from app.utils.update_lanes import UpdateLanes, update_lanes
 
 __all__ = [
     "setup_logging",
     "get_session", "get_by_id", "get_by_filters", 
-    "get_all", "create_object", "update_object", "delete_object"
-] 
\ No newline at end of file
+    "get_all", "create_object", "update_object", "delete_object",
+    "insert_ignore", "increment", "UnitOfWork", "after_commit", "commit",
+    "CallbackRouter",
+    "InvoicePayload", "InvalidPayload",
+    "FunnelTracer", "correlation_id", "tracer",
+    "UpdateLanes", "update_lanes"
+]
@@ -0,0 +1,106 @@
+import inspect
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher.handler import _check_spec, _get_spec
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = ":"
+
+@dataclass(frozen=True)
+class CallbackRoute:
+    """A handler bound to one callback_data prefix"""
+
+    prefix: str
+    handler: Callable[..., Awaitable[Any]]
+    spec: inspect.FullArgSpec
+    args: Tuple[Tuple[str, Callable[[str], Any]], ...] = ()
+    guard: Optional[Callable[[types.CallbackQuery], Awaitable[bool]]] = None
+    denied: Optional[Callable[..., Awaitable[Any]]] = None
+    denied_spec: Optional[inspect.FullArgSpec] = None
+
+class CallbackRouter:
+    """Route callback queries by the ``prefix`` in ``prefix:arg1:arg2`` with one dict lookup
+
+    Arguments are converted once, according to the route, and passed to the
+    handler as keyword arguments together with the middleware data
+    (``session``, ``settings``, ...).
+    """
+
+    def __init__(self):
+        self.routes: Dict[str, CallbackRoute] = {}
+
+    def register(
+        self,
+        prefix: str,
+        handler: Callable[..., Awaitable[Any]],
+        args: Optional[Dict[str, Callable[[str], Any]]] = None,
+        guard: Optional[Callable[[types.CallbackQuery], Awaitable[bool]]] = None,
+        denied: Optional[Callable[..., Awaitable[Any]]] = None
+    ):
+        """Register ``handler`` for ``prefix``; ``args`` maps argument names to converters"""
+        if SEPARATOR in prefix:
+            raise ValueError(f"Callback prefix must not contain '{SEPARATOR}': {prefix}")
+        if prefix in self.routes:
+            raise ValueError(f"Callback prefix already registered: {prefix}")
+
+        self.routes[prefix] = CallbackRoute(
+            prefix=prefix,
+            handler=handler,
+            spec=_get_spec(handler),
+            args=tuple((args or {}).items()),
+            guard=guard,
+            denied=denied,
+            denied_spec=_get_spec(denied) if denied else None
+        )
+
+    def resolve(self, data: Optional[str]) -> Optional[Tuple[CallbackRoute, Dict[str, Any]]]:
+        """Find the route for ``data`` and parse its arguments"""
+        if not data:
+            return None
+
+        prefix, _, rest = data.partition(SEPARATOR)
+        route = self.routes.get(prefix)
+        if route is None:
+            return None
+
+        values = rest.split(SEPARATOR) if rest else []
+        if len(values) != len(route.args):
+            logger.warning(f"Malformed callback data for '{prefix}': {data}")
+            return None
+
+        try:
+            parsed = {name: convert(value) for (name, convert), value in zip(route.args, values)}
+        except ValueError:
+            logger.warning(f"Invalid callback arguments for '{prefix}': {data}")
+            return None
+
+        return route, parsed
+
+    async def filter(self, callback_query: types.CallbackQuery):
+        """aiogram filter: passes the resolved route on to ``dispatch``"""
+        resolved = self.resolve(callback_query.data)
+        if resolved is None:
+            return False
+
+        route, parsed = resolved
+        return {"callback_route": route, "callback_args": parsed}
+
+    async def dispatch(self, callback_query: types.CallbackQuery, callback_route: CallbackRoute,
+                       callback_args: Dict[str, Any], **data):
+        """Call the routed handler with its parsed arguments"""
+        data = {**data, **callback_args}
+
+        if callback_route.guard and not await callback_route.guard(callback_query):
+            if callback_route.denied:
+                return await callback_route.denied(callback_query, **_check_spec(callback_route.denied_spec, data))
+            return None
+
+        return await callback_route.handler(callback_query, **_check_spec(callback_route.spec, data))
+
+    def setup(self, dp: Dispatcher):
+        """Register the router as a single callback query handler"""
+        dp.register_callback_query_handler(self.dispatch, self.filter)
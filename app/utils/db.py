@@ -1,12 +1,33 @@
+import inspect
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from contextlib import asynccontextmanager
-from typing import TypeVar, Type, Optional, List, Callable, Any
+from typing import TypeVar, Type, Optional, List, Dict, Callable, Any
 
 from app.models.base import Base
 
 T = TypeVar('T', bound=Base)
 
+# Keys used in ``session.info``
+IDENTITY_MAP_KEY = "identity_map"
+AFTER_COMMIT_KEY = "after_commit"
+
+def after_commit(session: AsyncSession, callback: Callable[[], Any]) -> None:
+    """Run callback once the session's transaction has been committed; coroutine functions are awaited"""
+    session.info.setdefault(AFTER_COMMIT_KEY, []).append(callback)
+
+async def _run_after_commit(session: AsyncSession) -> None:
+    for callback in session.info.pop(AFTER_COMMIT_KEY, []):
+        result = callback()
+        if inspect.isawaitable(result):
+            await result
+
+async def commit(session: AsyncSession) -> None:
+    """Commit now and run the after-commit callbacks, ahead of the end of the unit of work"""
+    await session.commit()
+    await _run_after_commit(session)
+
 @asynccontextmanager
 async def get_session(session_factory):
     """Context manager to handle database sessions"""
@@ -14,21 +35,85 @@ async def get_session(session_factory):
     try:
         yield session
         await session.commit()
+        await _run_after_commit(session)
     except Exception:
         await session.rollback()
         raise
     finally:
+        session.info.pop(AFTER_COMMIT_KEY, None)
         await session.close()
 
+class UnitOfWork:
+    """One session per update with an identity map, finished exactly once"""
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self.failed = False
+        self._session = None
+
+    @property
+    def session(self) -> AsyncSession:
+        # Created lazily so updates rejected early never touch the pool
+        if self._session is None:
+            self._session = self.session_factory()
+            self._session.info[IDENTITY_MAP_KEY] = {}
+        return self._session
+
+    async def finish(self):
+        """Commit the session, or roll it back if the update failed"""
+        session = self._session
+        if session is None:
+            return
+        
+        try:
+            if self.failed:
+                await session.rollback()
+            else:
+                await session.commit()
+                await _run_after_commit(session)
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            session.info.pop(IDENTITY_MAP_KEY, None)
+            session.info.pop(AFTER_COMMIT_KEY, None)
+            await session.close()
+
+def _remember(session: AsyncSession, obj) -> None:
+    """Register a row in the identity map under each of its unique columns"""
+    identity_map = session.info.get(IDENTITY_MAP_KEY)
+    if identity_map is None:
+        return
+    
+    for column in obj.__table__.columns:
+        if column.primary_key or column.unique:
+            value = getattr(obj, column.key)
+            if value is not None:
+                identity_map[(type(obj), ((column.key, value),))] = obj
+
 async def get_by_id(session: AsyncSession, model: Type[T], id: int) -> Optional[T]:
     """Get model instance by ID"""
-    result = await session.execute(select(model).filter_by(id=id))
-    return result.scalar_one_or_none()
+    # session.get() consults the session identity map before querying
+    return await session.get(model, id)
 
 async def get_by_filters(session: AsyncSession, model: Type[T], **filters) -> Optional[T]:
     """Get model instance by filters"""
+    identity_map = session.info.get(IDENTITY_MAP_KEY)
+    key = (model, tuple(sorted(filters.items())))
+    
+    if identity_map is not None:
+        obj = identity_map.get(key)
+        # The cached row may have been modified since, so re-check the filters
+        if obj is not None and all(getattr(obj, k) == v for k, v in filters.items()):
+            return obj
+    
     result = await session.execute(select(model).filter_by(**filters))
-    return result.scalar_one_or_none()
+    obj = result.scalar_one_or_none()
+    
+    if identity_map is not None and obj is not None:
+        identity_map[key] = obj
+        _remember(session, obj)
+    return obj
 
 async def get_all(session: AsyncSession, model: Type[T], **filters) -> List[T]:
     """Get all model instances by filters"""
@@ -41,6 +126,7 @@ async def create_object(session: AsyncSession, model: Type[T], **kwargs) -> T:
     session.add(obj)
     await session.flush()
     await session.refresh(obj)
+    _remember(session, obj)
     return obj
 
 async def update_object(session: AsyncSession, obj: T, **kwargs) -> T:
@@ -51,6 +137,34 @@ async def update_object(session: AsyncSession, obj: T, **kwargs) -> T:
     await session.refresh(obj)
     return obj
 
+def _upsert_insert(session: AsyncSession):
+    # INSERT construct that supports ON CONFLICT for the session's database
+    dialect = session.bind.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert
+    if dialect == "sqlite":
+        return sqlite.insert
+    raise NotImplementedError(f"ON CONFLICT is not supported for {dialect}")
+
+async def insert_ignore(session: AsyncSession, model: Type[T], conflict_columns: List[str], **values) -> bool:
+    """Insert a row unless one with the same ``conflict_columns`` exists; True if it was inserted
+
+    The conflict is resolved by the database (``ON CONFLICT DO NOTHING``), so
+    concurrent inserts of the same key never fail or block each other.
+    """
+    stmt = _upsert_insert(session)(model).values(**values).on_conflict_do_nothing(index_elements=conflict_columns)
+    result = await session.execute(stmt)
+    return result.rowcount > 0
+
+async def increment(session: AsyncSession, model: Type[T], deltas: Dict[str, int], **key) -> None:
+    """Add ``deltas`` to the columns of the row identified by ``key``, creating it if needed, in one statement"""
+    insert = _upsert_insert(session)(model).values(**key, **deltas)
+    stmt = insert.on_conflict_do_update(
+        index_elements=list(key),
+        set_={column: getattr(model, column) + insert.excluded[column] for column in deltas}
+    )
+    await session.execute(stmt)
+
 async def delete_object(session: AsyncSession, obj: T) -> None:
     """Delete model instance"""
     await session.delete(obj)
@@ -0,0 +1,106 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import ColumnElement, Select
+
+PAGE_SIZE = 10
+
+# Page directions in callback data
+FORWARD = "n"
+BACKWARD = "p"
+
+# Cursor of the first page
+START = "-"
+
+KEY_SEPARATOR = "_"
+
+EPOCH = datetime(1970, 1, 1)
+
+@dataclass(frozen=True)
+class KeyCodec:
+    """How one key column is written into and read back from a cursor"""
+
+    encode: Callable[[Any], str]
+    decode: Callable[[str], Any]
+
+INTEGER = KeyCodec(encode=str, decode=int)
+
+# Microseconds since the epoch, so equal-second rows are never skipped
+TIMESTAMP = KeyCodec(
+    encode=lambda value: str((value - EPOCH) // timedelta(microseconds=1)),
+    decode=lambda value: EPOCH + timedelta(microseconds=int(value))
+)
+
+@dataclass
+class Page:
+    """Rows of one page (key columns stripped) and the cursors around it"""
+
+    rows: List[tuple]
+    has_prev: bool
+    has_next: bool
+    first_cursor: Optional[str] = None
+    last_cursor: Optional[str] = None
+
+class KeysetPaginator:
+    """Pages of ``query`` ordered by ``keys``, without OFFSET
+
+    Each page is one indexed range read of ``size + 1`` rows starting after
+    (or before) the cursor, so every page costs the same however far it is
+    from the first one. The key columns must be unique together and
+    indexed in this order.
+    """
+
+    def __init__(self, query: Select, keys: Sequence[Tuple[ColumnElement, KeyCodec]],
+                 descending: bool = True, size: int = PAGE_SIZE):
+        self.query = query
+        self.columns = [column for column, _ in keys]
+        self.codecs = [codec for _, codec in keys]
+        self.descending = descending
+        self.size = size
+
+    def encode(self, values: Sequence[Any]) -> str:
+        return KEY_SEPARATOR.join(codec.encode(value) for codec, value in zip(self.codecs, values))
+
+    def decode(self, cursor: str) -> List[Any]:
+        """Key values of ``cursor``; ValueError if it is malformed"""
+        parts = cursor.split(KEY_SEPARATOR)
+        if len(parts) != len(self.codecs):
+            raise ValueError(f"Malformed cursor: {cursor}")
+        return [codec.decode(part) for codec, part in zip(self.codecs, parts)]
+
+    def _after(self, values: List[Any], forward: bool):
+        key = self.columns[0] if len(self.columns) == 1 else tuple_(*self.columns)
+        bound = values[0] if len(values) == 1 else tuple_(*values)
+        return key < bound if forward == self.descending else key > bound
+
+    async def fetch(self, session: AsyncSession, direction: str = FORWARD, cursor: str = START) -> Page:
+        """The page after (``FORWARD``) or before (``BACKWARD``) ``cursor``"""
+        forward = direction != BACKWARD
+        query = self.query.add_columns(*self.columns)
+        if cursor != START:
+            query = query.where(self._after(self.decode(cursor), forward))
+
+        ascending = forward != self.descending
+        order = [column.asc() if ascending else column.desc() for column in self.columns]
+        rows = (await session.execute(query.order_by(*order).limit(self.size + 1))).all()
+
+        if not rows and cursor != START:
+            # Everything past the cursor is gone; start over
+            return await self.fetch(session)
+
+        more = len(rows) > self.size
+        rows = rows[:self.size]
+        if not forward:
+            rows.reverse()
+
+        keys = len(self.columns)
+        return Page(
+            rows=[tuple(row[:-keys]) for row in rows],
+            has_prev=more if not forward else cursor != START,
+            has_next=more if forward else True,
+            first_cursor=self.encode(rows[0][-keys:]) if rows else None,
+            last_cursor=self.encode(rows[-1][-keys:]) if rows else None
+        )
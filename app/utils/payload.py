@@ -0,0 +1,54 @@
+import base64
+import hashlib
+import hmac
+from dataclasses import dataclass, astuple
+
+PAYLOAD_VERSION = "1"
+SEPARATOR = ":"
+SIGNATURE_BYTES = 12
+
+class InvalidPayload(ValueError):
+    """Invoice payload is malformed or its signature does not match"""
+
+@dataclass(frozen=True)
+class InvoicePayload:
+    """Everything needed to check an invoice without the database
+
+    Encoded as ``1:user:channel:tariff:price:days:catalog_version:signature``,
+    well under Telegram's 128 byte payload limit.
+    """
+
+    user_id: int
+    channel_id: int
+    tariff_id: int
+    price_stars: int
+    duration_days: int
+    catalog_version: int
+
+    def _body(self) -> str:
+        return SEPARATOR.join([PAYLOAD_VERSION, *map(str, astuple(self))])
+
+    def sign(self, secret: bytes) -> str:
+        """Encode the payload with an HMAC-SHA256 signature"""
+        body = self._body()
+        return f"{body}{SEPARATOR}{_signature(secret, body)}"
+
+    @classmethod
+    def verify(cls, payload: str, secret: bytes) -> "InvoicePayload":
+        """Decode a signed payload, raising InvalidPayload if it was not issued by us"""
+        body, _, signature = (payload or "").rpartition(SEPARATOR)
+        if not hmac.compare_digest(signature, _signature(secret, body)):
+            raise InvalidPayload(f"Bad payload signature: {payload}")
+
+        version, *fields = body.split(SEPARATOR)
+        if version != PAYLOAD_VERSION or len(fields) != 6:
+            raise InvalidPayload(f"Unsupported payload: {payload}")
+
+        try:
+            return cls(*map(int, fields))
+        except ValueError:
+            raise InvalidPayload(f"Malformed payload: {payload}")
+
+def _signature(secret: bytes, body: str) -> str:
+    digest = hmac.new(secret, body.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:SIGNATURE_BYTES]).decode()
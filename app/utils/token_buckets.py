@@ -0,0 +1,107 @@
+import asyncio
+import time
+from array import array
+
+# Slots probed from a key's home slot before giving up on finding a free one
+MAX_PROBES = 16
+
+class TokenBucketTable:
+    """Per-key token buckets in a fixed-size open-addressing table
+
+    Keys, token counts and timestamps live in flat arrays, so memory stays
+    at ``capacity`` slots however many users show up. A slot idle for longer
+    than ``idle_ttl`` would have refilled completely anyway, so it is reused
+    for a new key. When every slot near a key's home is busy, the least
+    recently used of them is evicted; the evicted user simply starts again
+    with a full bucket.
+    """
+
+    EMPTY = 0
+
+    def __init__(self, rate: float, burst: float, capacity: int = 8192):
+        if capacity & (capacity - 1):
+            raise ValueError("capacity must be a power of two")
+
+        self.rate = rate
+        self.burst = burst
+        self.capacity = capacity
+        self.idle_ttl = burst / rate
+        self._bits = capacity.bit_length() - 1
+        self._keys = array("q", [self.EMPTY]) * capacity
+        self._tokens = array("d", [0.0]) * capacity
+        self._stamps = array("d", [0.0]) * capacity
+        self._marks = array("d", [0.0]) * capacity
+
+    def _home(self, key: int) -> int:
+        # Fibonacci hashing spreads sequential Telegram IDs over the table
+        return ((key * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> (64 - self._bits)
+
+    def _slot(self, key: int, now: float) -> int:
+        """Slot holding ``key``, claiming one with a full bucket if it has none"""
+        mask = self.capacity - 1
+        index = self._home(key)
+        free = None
+        oldest = index
+
+        for _ in range(MAX_PROBES):
+            slot_key = self._keys[index]
+            if slot_key == key:
+                return index
+            if slot_key == self.EMPTY:
+                # Slots are never emptied again, so the key can't be further on
+                if free is None:
+                    free = index
+                break
+            if free is None and now - self._stamps[index] >= self.idle_ttl:
+                free = index
+            if self._stamps[index] < self._stamps[oldest]:
+                oldest = index
+            index = (index + 1) & mask
+
+        slot = oldest if free is None else free
+        self._keys[slot] = key
+        self._tokens[slot] = self.burst
+        self._stamps[slot] = now
+        self._marks[slot] = 0.0
+        return slot
+
+    def consume(self, key: int, now: float, cost: float = 1.0) -> bool:
+        """Take ``cost`` tokens from the bucket of ``key``; False if there are not enough"""
+        slot = self._slot(key, now)
+        tokens = min(self.burst, self._tokens[slot] + (now - self._stamps[slot]) * self.rate)
+        self._stamps[slot] = now
+
+        if tokens < cost:
+            self._tokens[slot] = tokens
+            return False
+
+        self._tokens[slot] = tokens - cost
+        return True
+
+    def mark(self, key: int, now: float, interval: float) -> bool:
+        """True at most once per ``interval`` per key, e.g. to debounce replies"""
+        slot = self._slot(key, now)
+        if now - self._marks[slot] < interval:
+            return False
+
+        self._marks[slot] = now
+        return True
+
+class RatePacer:
+    """Spaces calls ``1 / rate`` seconds apart, across every caller sharing it"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next = 0.0
+
+    async def wait(self):
+        now = time.monotonic()
+        slot = max(now, self._next)
+        # Claim the slot before sleeping so concurrent callers queue up behind it
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def hold(self, seconds: float):
+        """Let no call through for ``seconds``, e.g. after a 429"""
+        self._next = max(self._next, time.monotonic() + seconds)
@@ -0,0 +1,145 @@
+import bisect
+import logging
+import math
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Awaitable, Dict, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Telegram cancels the payment if the pre-checkout query is not answered within 10 seconds
+PRE_CHECKOUT_DEADLINE = 10.0
+
+# Funnel stages in the order a purchase goes through them
+STAGES = (
+    "callback_tariff_select",
+    "send_invoice",
+    "process_pre_checkout_query",
+    "process_payment",
+    "process_successful_payment",
+    "generate_invite_link",
+    "funnel",
+)
+
+def correlation_id(payload: str, user_id: int) -> str:
+    """Trace id of one user's purchase of one offer
+
+    Reusable invoice links carry the same payload for every payer, so the
+    payer is mixed in.
+    """
+    return f"{zlib.crc32(f'{user_id}:{payload}'.encode()):08x}"
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram in milliseconds, about 20% resolution"""
+
+    # Bucket upper bounds from 1 ms to about a minute
+    BOUNDS = tuple(1.2 ** i for i in range(61))
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, ms: float):
+        self.counts[bisect.bisect_left(self.BOUNDS, ms)] += 1
+        self.count += 1
+        self.max = max(self.max, ms)
+
+    def percentile(self, q: float) -> float:
+        """Estimate of the ``q`` quantile, interpolated within its bucket"""
+        if not self.count:
+            return 0.0
+
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank:
+                lower = self.BOUNDS[index - 1] if index > 0 else 0.0
+                upper = self.BOUNDS[index] if index < len(self.BOUNDS) else self.max
+                estimate = lower + (upper - lower) * (rank - seen) / count
+                return min(estimate, self.max)
+            seen += count
+        return self.max
+
+class Span:
+    """Timing of one stage; the trace id may be set once it is known"""
+
+    __slots__ = ("trace_id",)
+
+    def __init__(self, trace_id: Optional[str]):
+        self.trace_id = trace_id
+
+class FunnelTracer:
+    """Per-stage latency of the payment funnel, from tariff button to invite link
+
+    Stages are tagged with a correlation id derived from the invoice payload,
+    so the time between a tariff click and the delivered link is recorded as
+    the ``funnel`` stage. Pre-checkout answers are checked against Telegram's
+    deadline.
+    """
+
+    def __init__(self, max_traces: int = 1000):
+        self.max_traces = max_traces
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.deadline_misses = 0
+        self._started: "OrderedDict[str, float]" = OrderedDict()
+
+    def record(self, stage: str, seconds: float, trace_id: Optional[str] = None):
+        ms = seconds * 1000
+        self.histograms.setdefault(stage, LatencyHistogram()).observe(ms)
+        logger.debug(f"[{trace_id or '-'}] {stage}: {ms:.1f} ms")
+
+        if stage == "process_pre_checkout_query":
+            if seconds >= PRE_CHECKOUT_DEADLINE:
+                self.deadline_misses += 1
+                logger.error(f"[{trace_id or '-'}] Pre-checkout answered after the deadline: {ms:.0f} ms")
+            elif seconds >= PRE_CHECKOUT_DEADLINE / 2:
+                logger.warning(f"[{trace_id or '-'}] Pre-checkout used over half of its deadline: {ms:.0f} ms")
+
+    @contextmanager
+    def stage(self, stage: str, trace_id: Optional[str] = None):
+        """Time the block as ``stage``"""
+        span = Span(trace_id)
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            self.record(stage, time.perf_counter() - start, span.trace_id)
+
+    async def timed(self, stage: str, awaitable: Awaitable[T], trace_id: Optional[str] = None) -> T:
+        """Await ``awaitable`` and time it as ``stage``"""
+        with self.stage(stage, trace_id):
+            return await awaitable
+
+    def begin(self, trace_id: str):
+        """Mark the start of a purchase"""
+        self._started[trace_id] = time.perf_counter()
+        self._started.move_to_end(trace_id)
+        while len(self._started) > self.max_traces:
+            self._started.popitem(last=False)
+
+    def complete(self, trace_id: str):
+        """Record the whole funnel for a purchase that was started here"""
+        start = self._started.pop(trace_id, None)
+        if start is not None:
+            self.record("funnel", time.perf_counter() - start, trace_id)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Count and p50/p95/p99 in milliseconds per stage"""
+        stages = [stage for stage in STAGES if stage in self.histograms]
+        stages += sorted(set(self.histograms) - set(STAGES))
+        return {
+            stage: {
+                "count": self.histograms[stage].count,
+                "p50": self.histograms[stage].percentile(0.50),
+                "p95": self.histograms[stage].percentile(0.95),
+                "p99": self.histograms[stage].percentile(0.99),
+            }
+            for stage in stages
+        }
+
+tracer = FunnelTracer()
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, List, Optional, Set, Tuple
+
+from aiogram import Bot, Dispatcher, types
+
+from app.config import Settings
+
+logger = logging.getLogger(__name__)
+
+# Lanes, most critical first
+LANE_CRITICAL = 0
+LANE_COMMAND = 1
+LANE_COSMETIC = 2
+LANE_NAMES = ("critical", "command", "cosmetic")
+
+# Share of worker picks each lane gets while all of them have work
+LANE_WEIGHTS = (8, 3, 1)
+
+# Callbacks that only redraw a screen
+COSMETIC_CALLBACKS = frozenset({"help", "back_to_start", "refresh_subscriptions"})
+
+SHED_TEXT = "Бот сейчас перегружен. Пожалуйста, повторите через минуту."
+
+def classify(update: types.Update) -> int:
+    """Lane of an update: payments first, then commands, then cosmetic callbacks"""
+    if update.pre_checkout_query or update.chat_join_request:
+        return LANE_CRITICAL
+    if update.message:
+        return LANE_CRITICAL if update.message.successful_payment else LANE_COMMAND
+    if update.callback_query:
+        prefix = (update.callback_query.data or "").partition(":")[0]
+        return LANE_COSMETIC if prefix in COSMETIC_CALLBACKS else LANE_COMMAND
+    return LANE_COSMETIC
+
+class UpdateLanes:
+    """Weighted priority queues in front of the dispatcher
+
+    A fixed number of workers take updates from three lanes by smooth
+    weighted round-robin, so payments overtake a backlog of commands without
+    starving them. When too many updates are queued, new command and
+    cosmetic updates are shed with a canned reply; critical updates are
+    always queued.
+    """
+
+    def __init__(self):
+        self.workers = 8
+        self.queue_limit = 200
+        self.shed_count = [0, 0, 0]
+        self._bot: Optional[Bot] = None
+        self._process: Optional[Callable[..., Awaitable]] = None
+        self._queues: Tuple[Deque[tuple], ...] = (deque(), deque(), deque())
+        self._credit = [0, 0, 0]
+        self._ready: Optional[asyncio.Semaphore] = None
+        self._tasks: List[asyncio.Task] = []
+        self._replies: Set[asyncio.Task] = set()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self, process: Callable[..., Awaitable], bot: Bot, settings: Settings):
+        """Start the workers; ``process`` is awaited with each update and the extra submit arguments"""
+        self._process = process
+        self._bot = bot
+        self.workers = settings.update_workers
+        self.queue_limit = settings.update_queue_limit
+
+        if not self._tasks:
+            self._ready = asyncio.Semaphore(0)
+            self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+            logger.info(f"Update lanes started: {self.workers} workers, queue limit {self.queue_limit}")
+
+    async def stop(self, timeout: float = 10):
+        """Give queued critical updates up to ``timeout`` seconds, then stop the workers"""
+        if not self._tasks:
+            return
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._queues[LANE_CRITICAL] and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        dropped = sum(len(queue) for queue in self._queues)
+        if dropped:
+            logger.warning(f"Update lanes stopped with {dropped} updates still queued")
+        for queue in self._queues:
+            queue.clear()
+
+    def submit(self, update: types.Update, *args):
+        """Queue an update, or shed it if its lane is over the limit"""
+        lane = classify(update)
+
+        if self._is_overloaded(lane):
+            self.shed_count[lane] += 1
+            logger.debug(f"Shedding {LANE_NAMES[lane]} update {update.update_id}: {self.pending} updates queued")
+            self._reply_shed(update)
+            return
+
+        self._queues[lane].append((update, args))
+        self._ready.release()
+
+    @property
+    def pending(self) -> int:
+        return sum(len(queue) for queue in self._queues)
+
+    def stats(self) -> dict:
+        return {
+            name: {"queued": len(queue), "shed": shed}
+            for name, queue, shed in zip(LANE_NAMES, self._queues, self.shed_count)
+        }
+
+    def _is_overloaded(self, lane: int) -> bool:
+        if lane == LANE_CRITICAL:
+            return False
+        # Cosmetic updates go first, once a quarter of the queue is used
+        limit = self.queue_limit if lane == LANE_COMMAND else self.queue_limit // 4
+        return self.pending >= limit
+
+    def _reply_shed(self, update: types.Update):
+        if self._bot is None:
+            return
+
+        if update.callback_query:
+            reply = self._bot.answer_callback_query(update.callback_query.id, text=SHED_TEXT)
+        elif update.message:
+            reply = self._bot.send_message(update.message.chat.id, SHED_TEXT)
+        else:
+            return
+
+        task = asyncio.ensure_future(reply)
+        self._replies.add(task)
+        task.add_done_callback(self._reply_done)
+
+    def _reply_done(self, task: asyncio.Task):
+        self._replies.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Failed to answer a shed update: {task.exception()}")
+
+    def _pick(self) -> int:
+        # Smooth weighted round-robin over the lanes that have work
+        best = None
+        total = 0
+        for lane, queue in enumerate(self._queues):
+            if queue:
+                self._credit[lane] += LANE_WEIGHTS[lane]
+                total += LANE_WEIGHTS[lane]
+                if best is None or self._credit[lane] > self._credit[best]:
+                    best = lane
+        self._credit[best] -= total
+        return best
+
+    async def _work(self):
+        while True:
+            await self._ready.acquire()
+            update, args = self._queues[self._pick()].popleft()
+            try:
+                await self._process(update, *args)
+            except Exception as e:
+                logger.error(f"Error processing update {update.update_id}: {e}", exc_info=True)
+
+update_lanes = UpdateLanes()
+
+class LaneDispatcher(Dispatcher):
+    """Dispatcher whose long-polling hands updates to ``update_lanes``"""
+
+    async def _process_polling_updates(self, updates, fast: bool = True):
+        if not update_lanes.running:
+            return await super()._process_polling_updates(updates, fast)
+
+        for update in updates:
+            update_lanes.submit(update)
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+"""Cohort retention, churn and renewal rates from the subscription history
+
+Usage: python cohort_report.py [--channel ID] [--months 12] [--columns 6]
+"""
+import argparse
+import asyncio
+
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+
+from app.config import load_settings
+from app.services.analytics import DEFAULT_HORIZON, build_report, render_report
+
+async def main(args):
+    settings = load_settings()
+    engine = create_async_engine(settings.database_url)
+    try:
+        async with AsyncSession(engine) as session:
+            report = await build_report(session, args.channel, horizon=max(args.months, args.columns))
+    finally:
+        await engine.dispose()
+    
+    print(render_report(report, cohorts=args.months, columns=args.columns))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--channel", type=int, default=None, help="database id of the channel, all channels by default")
+    parser.add_argument("--months", type=int, default=DEFAULT_HORIZON, help="latest cohorts to show")
+    parser.add_argument("--columns", type=int, default=6, help="months after the first to show")
+    asyncio.run(main(parser.parse_args()))
@@ -1,33 +1,42 @@
 import logging
-import os
 import asyncio
-from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, executor
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 
+from app.config import load_settings
 from app.models.base import Base
 from app.handlers import register_all_handlers
+from app.middlewares import DbSessionMiddleware, SettingsMiddleware, ThrottlingMiddleware
+from app.services.auth import admin_registry
+from app.services.catalog import catalog
+from app.services.entitlements import entitlements
+from app.services.invite_pool import invite_pool
+from app.services.notifier import admin_notifier
+from app.services.reports import report_runner
+from app.services.broadcast import broadcaster
+from app.services.stats import reconcile_counters
 from app.services.scheduler import setup_scheduler
+from app.utils.update_lanes import LaneDispatcher, update_lanes
 from app.utils.logging import setup_logging
 
-# Load environment variables
-load_dotenv()
+# Load configuration once; handlers get this snapshot through the dispatcher
+settings = load_settings()
 
 # Setup logging
 setup_logging()
 logger = logging.getLogger(__name__)
 
 # Initialize bot and dispatcher
-bot = Bot(token=os.getenv("BOT_TOKEN"))
+bot = Bot(token=settings.bot_token)
 storage = MemoryStorage()
-dp = Dispatcher(bot, storage=storage)
+dp = LaneDispatcher(bot, storage=storage)
 
 # Database setup
 async def init_db():
     engine = create_async_engine(
-        os.getenv("DATABASE_URL").replace("sqlite:///", "sqlite+aiosqlite:///"), 
+        settings.database_url, 
         echo=False
     )
     
@@ -41,6 +50,12 @@ async def init_db():
     
     return async_session
 
+async def process_update(update):
+    """Run one update through the dispatcher from a lane worker"""
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+    await dp.process_update(update)
+
 async def on_startup(dispatcher):
     # Create DB session factory
     session_factory = await init_db()
@@ -48,32 +63,81 @@ async def on_startup(dispatcher):
     # Set session factory for handlers
     dispatcher["session_factory"] = session_factory
     
-    # Set payment provider token
-    dispatcher["payment_provider_token"] = os.getenv("PAYMENT_PROVIDER_TOKEN")
+    # Set configuration snapshot
+    dispatcher["settings"] = settings
+    
+    # Drop floods from a single user before they reach handlers or the database
+    dispatcher.middleware.setup(ThrottlingMiddleware(settings.throttle_rate, settings.throttle_burst))
+    
+    # Open one session per update from the shared pool
+    dispatcher.middleware.setup(DbSessionMiddleware(session_factory))
+    dispatcher.middleware.setup(SettingsMiddleware())
+    
+    # Build the admin set once; admin checks are served from memory
+    admin_registry.configure(settings.admin_ids)
+    await admin_registry.refresh(session_factory)
+    
+    # Load the channel/tariff snapshot used for invoices and pre-checkout
+    await catalog.load(session_factory)
+    
+    # Who may join which channel, for join-request approval
+    await entitlements.load(session_factory)
+    
+    # Dashboard counters start from the base tables
+    await reconcile_counters(session_factory)
+    
+    # Keep single-use invite links ready for every active channel
+    invite_pool.start(bot, settings)
+    
+    # Sale notifications are sent to admins in the background, in digests
+    admin_notifier.start(bot, settings)
+    
+    # Heavy admin reports are built in the background and cached
+    report_runner.start(session_factory, settings)
+    
+    # Broadcasts interrupted by a restart carry on from their cursor
+    await broadcaster.start(bot, session_factory, settings)
     
     # Register all handlers
     register_all_handlers(dispatcher)
     
     # Notify admins about bot startup
-    admin_ids = [int(id.strip()) for id in os.getenv("ADMIN_IDS", "").split(",") if id.strip()]
-    for admin_id in admin_ids:
+    for admin_id in admin_registry.env_admin_ids:
         try:
             await bot.send_message(admin_id, "Bot started successfully!")
         except Exception as e:
             logger.error(f"Failed to notify admin {admin_id}: {e}")
     
     # Set up scheduler for checking expired subscriptions
-    dispatcher["scheduler"] = setup_scheduler(bot, session_factory)
+    dispatcher["scheduler"] = setup_scheduler(bot, session_factory, settings)
+    
+    # Polled updates go through priority lanes: payments before commands before cosmetic callbacks
+    update_lanes.start(process_update, bot, settings)
     
     logger.info("Bot started!")
 
 async def on_shutdown(dispatcher):
     logger.info("Shutting down...")
     
+    # Let queued payments finish, then stop the lane workers
+    await update_lanes.stop()
+    
     # Stop scheduler if running
     if "scheduler" in dispatcher.data:
         dispatcher.data["scheduler"].shutdown(wait=False)
     
+    # Stop refilling and revoke unused invite links
+    await invite_pool.stop()
+    
+    # Send sale notifications that are still queued
+    await admin_notifier.stop()
+    
+    # Drop reports still being built
+    await report_runner.stop()
+    
+    # Pause broadcasts; they resume on the next startup
+    await broadcaster.stop()
+    
     # Close storage
     await dispatcher.storage.close()
     await dispatcher.storage.wait_closed()
@@ -0,0 +1,54 @@
+"""Broadcast jobs and their dead letters
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'broadcasts',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('channel_id', sa.Integer(), nullable=True),
+        sa.Column('text', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('cursor', sa.Integer(), nullable=False),
+        sa.Column('total', sa.Integer(), nullable=False),
+        sa.Column('sent', sa.Integer(), nullable=False),
+        sa.Column('failed', sa.Integer(), nullable=False),
+        sa.Column('admin_chat_id', sa.BigInteger(), nullable=False),
+        sa.Column('status_message_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['channel_id'], ['channels.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table(
+        'broadcast_dead_letters',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('broadcast_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.BigInteger(), nullable=False),
+        sa.Column('error', sa.String(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['broadcast_id'], ['broadcasts.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_broadcast_dead_letters_broadcast_id', 'broadcast_dead_letters', ['broadcast_id'])
+
+
+def downgrade():
+    op.drop_index('ix_broadcast_dead_letters_broadcast_id', table_name='broadcast_dead_letters')
+    op.drop_table('broadcast_dead_letters')
+    op.drop_table('broadcasts')
@@ -0,0 +1,29 @@
+"""Channel access mode and join-request link
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'channels',
+        sa.Column('access_mode', sa.String(), nullable=False, server_default='invite_link')
+    )
+    op.add_column('channels', sa.Column('join_link', sa.String(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('channels', 'join_link')
+    op.drop_column('channels', 'access_mode')
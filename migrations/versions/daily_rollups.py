@@ -0,0 +1,36 @@
+"""Daily subscription and revenue rollups
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'daily_rollups',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('channel_id', sa.Integer(), nullable=False),
+        sa.Column('tariff_id', sa.Integer(), nullable=False),
+        sa.Column('new_subscriptions', sa.Integer(), nullable=False),
+        sa.Column('renewals', sa.Integer(), nullable=False),
+        sa.Column('expirations', sa.Integer(), nullable=False),
+        sa.Column('stars', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['channel_id'], ['channels.id'], ),
+        sa.ForeignKeyConstraint(['tariff_id'], ['tariffs.id'], ),
+        sa.PrimaryKeyConstraint('day', 'channel_id', 'tariff_id')
+    )
+
+
+def downgrade():
+    op.drop_table('daily_rollups')
@@ -0,0 +1,64 @@
+"""Payments ledger and one active subscription per user and channel
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'payments',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('telegram_payment_charge_id', sa.String(), nullable=False),
+        sa.Column('provider_payment_charge_id', sa.String(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('channel_id', sa.Integer(), nullable=False),
+        sa.Column('tariff_id', sa.Integer(), nullable=False),
+        sa.Column('subscription_id', sa.Integer(), nullable=True),
+        sa.Column('total_amount', sa.Integer(), nullable=False),
+        sa.Column('currency', sa.String(), nullable=False),
+        sa.Column('invoice_payload', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.ForeignKeyConstraint(['channel_id'], ['channels.id'], ),
+        sa.ForeignKeyConstraint(['tariff_id'], ['tariffs.id'], ),
+        sa.ForeignKeyConstraint(['subscription_id'], ['subscriptions.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('telegram_payment_charge_id')
+    )
+    
+    # Of any duplicate active subscriptions keep the one that runs longest (the newest on a tie),
+    # so no paid time is lost, before enforcing uniqueness
+    op.execute(
+        "UPDATE subscriptions SET is_active = false "
+        "WHERE is_active = true AND EXISTS ("
+        "SELECT 1 FROM subscriptions AS other "
+        "WHERE other.is_active = true "
+        "AND other.user_id = subscriptions.user_id AND other.channel_id = subscriptions.channel_id "
+        "AND (other.end_date > subscriptions.end_date "
+        "OR (other.end_date = subscriptions.end_date AND other.id > subscriptions.id)))"
+    )
+    op.create_index(
+        'uq_subscriptions_active_user_channel',
+        'subscriptions',
+        ['user_id', 'channel_id'],
+        unique=True,
+        postgresql_where=sa.text('is_active = true'),
+        sqlite_where=sa.text('is_active = 1')
+    )
+
+
+def downgrade():
+    op.drop_index('uq_subscriptions_active_user_channel', table_name='subscriptions')
+    op.drop_table('payments')
@@ -0,0 +1,31 @@
+"""Counters for the admin dashboards
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled in by the reconciliation that runs at startup
+    op.create_table(
+        'stat_counters',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('channel_id', sa.Integer(), nullable=False),
+        sa.Column('value', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('name', 'channel_id')
+    )
+
+
+def downgrade():
+    op.drop_table('stat_counters')
@@ -0,0 +1,30 @@
+"""Index active subscriptions by end date
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_subscriptions_active_end_date',
+        'subscriptions',
+        ['end_date'],
+        postgresql_where=sa.text('is_active = true'),
+        sqlite_where=sa.text('is_active = 1')
+    )
+
+
+def downgrade():
+    op.drop_index('ix_subscriptions_active_end_date', table_name='subscriptions')
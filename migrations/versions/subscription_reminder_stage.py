@@ -0,0 +1,27 @@
+"""Track pre-expiry reminders sent per subscription
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'subscriptions',
+        sa.Column('reminder_stage', sa.Integer(), nullable=False, server_default='0')
+    )
+
+
+def downgrade():
+    op.drop_column('subscriptions', 'reminder_stage')
@@ -0,0 +1,32 @@
+"""Mark subscriptions claimed by the expiry job until the user is kicked
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0011'
+down_revision = '0010'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('subscriptions', sa.Column('revoking_since', sa.DateTime(), nullable=True))
+    op.create_index(
+        'ix_subscriptions_revoking_since',
+        'subscriptions',
+        ['revoking_since'],
+        postgresql_where=sa.text('revoking_since IS NOT NULL'),
+        sqlite_where=sa.text('revoking_since IS NOT NULL')
+    )
+
+
+def downgrade():
+    op.drop_index('ix_subscriptions_revoking_since', table_name='subscriptions')
+    op.drop_column('subscriptions', 'revoking_since')
@@ -0,0 +1,23 @@
+"""Index users by registration time for keyset pagination
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_users_created_at_id', 'users', ['created_at', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_users_created_at_id', table_name='users')
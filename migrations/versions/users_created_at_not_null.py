@@ -0,0 +1,37 @@
+"""Backfill users.created_at and make it NOT NULL
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-19
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The admin user list pages by created_at, which can't be NULL in a cursor
+    op.get_bind().execute(
+        sa.text("UPDATE users SET created_at = COALESCE(last_active, :now) WHERE created_at IS NULL")
+        .bindparams(sa.bindparam("now", datetime.utcnow(), type_=sa.DateTime()))
+    )
+    if op.get_bind().dialect.name == "sqlite":
+        # CURRENT_TIMESTAMP left out the microseconds, and SQLite compares
+        # the text, so those rows sorted wrong against the cursors
+        op.execute("UPDATE users SET created_at = created_at || '.000000' WHERE length(created_at) = 19")
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=True)
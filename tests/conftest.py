@@ -0,0 +1,68 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.models import Base, Channel, Subscription, Tariff, User
+from app.utils.db import get_session
+
+CHANNEL_CHAT_ID = -100
+
+@pytest.fixture
+def run():
+    """Run a coroutine to completion on a loop of the test's own"""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+@pytest.fixture
+def session_factory(run, tmp_path):
+    # A file, not :memory:, so concurrent sessions see the same database
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'bot.db'}")
+
+    async def create_tables():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    run(create_tables())
+    yield sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    run(engine.dispose())
+
+@pytest.fixture
+def catalog_rows(run, session_factory):
+    """One channel with a 30 day tariff; returns ``(channel id, tariff id)``"""
+    async def create():
+        async with get_session(session_factory) as session:
+            channel = Channel(channel_id=CHANNEL_CHAT_ID, name="Channel", is_active=True)
+            session.add(channel)
+            await session.flush()
+            tariff = Tariff(channel_id=channel.id, name="Month", duration_days=30, price_stars=10, is_active=True)
+            session.add(tariff)
+            await session.flush()
+            return channel.id, tariff.id
+
+    return run(create())
+
+@pytest.fixture
+def add_subscription(session_factory):
+    """``await add_subscription(user_id, channel_id, tariff_id, end_date)`` adds a user and an active subscription of theirs"""
+    async def add(user_id: int, channel_id: int, tariff_id: int, end_date: datetime) -> int:
+        async with get_session(session_factory) as session:
+            user = User(user_id=user_id)
+            session.add(user)
+            await session.flush()
+            subscription = Subscription(
+                user_id=user.id,
+                channel_id=channel_id,
+                tariff_id=tariff_id,
+                start_date=end_date - timedelta(days=30),
+                end_date=end_date,
+                is_active=True
+            )
+            session.add(subscription)
+            await session.flush()
+            return subscription.id
+
+    return add
@@ -0,0 +1,80 @@
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.models import Subscription
+from app.services.analytics import SubscriptionHistory, analyze, build_report
+from app.utils.db import get_session
+
+from test_payments import add_user, pay, payment_data
+
+def cohort_report(run, session_factory, channel_id=None, **kwargs):
+    async def build():
+        async with get_session(session_factory) as session:
+            return await build_report(session, channel_id, **kwargs)
+
+    return run(build())
+
+def test_payment_extending_a_subscription_is_a_renewal(run, session_factory, catalog_rows, add_subscription):
+    channel_id, tariff_id = catalog_rows
+    run(add_user(session_factory, 1))
+    run(pay(session_factory, 1, payment_data(1, channel_id, tariff_id, "charge-1")))
+    run(pay(session_factory, 1, payment_data(1, channel_id, tariff_id, "charge-2")))
+    # Someone else let theirs run out
+    run(add_subscription(2, channel_id, tariff_id, datetime.utcnow() - timedelta(days=10)))
+
+    report = cohort_report(run, session_factory)
+
+    assert report.subscriptions == 2
+    assert report.customers == 2
+    assert report.renewal_rate == 0.5
+
+def test_new_subscription_soon_after_the_end_is_a_renewal(run, session_factory, catalog_rows, add_subscription):
+    channel_id, tariff_id = catalog_rows
+    now = datetime.utcnow()
+    first = run(add_subscription(1, channel_id, tariff_id, now - timedelta(days=40)))
+
+    async def resubscribe():
+        async with get_session(session_factory) as session:
+            old = await session.get(Subscription, first)
+            old.is_active = False
+            session.add(Subscription(
+                user_id=old.user_id, channel_id=channel_id, tariff_id=tariff_id,
+                start_date=now - timedelta(days=38), end_date=now - timedelta(days=8), is_active=True
+            ))
+
+    run(resubscribe())
+
+    # The first term was renewed, the second one ran out
+    assert cohort_report(run, session_factory).renewal_rate == 0.5
+
+def test_streamed_chunks_match_the_whole_history(run, session_factory, catalog_rows):
+    _, tariff_id = catalog_rows
+    now = datetime(2026, 10, 19)
+    rng = random.Random(1)
+    rows = []
+    for _ in range(60):
+        start = now - timedelta(days=rng.randrange(400))
+        rows.append((rng.randrange(1, 16), rng.randrange(1, 3), start, start + timedelta(days=rng.choice([30, 90])), 0))
+
+    async def add_rows():
+        async with get_session(session_factory) as session:
+            session.add_all(
+                Subscription(user_id=user_id, channel_id=channel_id, tariff_id=tariff_id,
+                             start_date=start, end_date=end, is_active=False)
+                for user_id, channel_id, start, end, _ in rows
+            )
+
+    run(add_rows())
+
+    # Chunks of 4 rows split most customers' histories across partitions
+    streamed = cohort_report(run, session_factory, now=now, chunk_size=4)
+    whole = analyze(SubscriptionHistory.from_rows(rows), now=now)
+
+    assert streamed.subscriptions == whole.subscriptions == 60
+    assert streamed.customers == whole.customers
+    assert np.array_equal(streamed.cohort_sizes, whole.cohort_sizes)
+    assert np.allclose(streamed.retention, whole.retention, equal_nan=True)
+    assert np.allclose(streamed.churn, whole.churn)
+    assert streamed.renewal_rate == whole.renewal_rate
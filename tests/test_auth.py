@@ -0,0 +1,17 @@
+from app.models import User
+from app.services.auth import AdminRegistry
+from app.utils.db import get_session
+
+def test_reconfigure_drops_removed_env_admins(run, session_factory):
+    async def add_db_admin():
+        async with get_session(session_factory) as session:
+            session.add(User(user_id=3, is_admin=True))
+
+    run(add_db_admin())
+    registry = AdminRegistry([1, 2])
+    run(registry.refresh(session_factory))
+    registry.add(4)
+
+    registry.configure([2])
+
+    assert [user_id for user_id in range(1, 6) if registry.is_admin(user_id)] == [2, 3, 4]
@@ -0,0 +1,108 @@
+import io
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.services import bulk_import
+from app.services.bulk_import import IMPORT_CHANNELS, IMPORT_SUBSCRIPTIONS, RowError, import_csv
+from app.models import Channel, Tariff
+from app.services.catalog import catalog
+from app.utils.db import get_session
+
+from conftest import CHANNEL_CHAT_ID
+
+@pytest.fixture
+def links(monkeypatch):
+    """Access links handed out by the import, instead of asking Telegram"""
+    issued = []
+
+    async def get_access_link(chat_id, key=None):
+        issued.append(key)
+        return f"https://t.me/+{key}"
+
+    monkeypatch.setattr(bulk_import, "get_access_link", get_access_link)
+    return issued
+
+def import_text(run, session_factory, kind, text, batch_size=2):
+    async def upload():
+        await catalog.load(session_factory)
+        async with get_session(session_factory) as session:
+            return await import_csv(session, io.BytesIO(text.encode()), kind, batch_size=batch_size)
+
+    return run(upload())
+
+def errors(summary):
+    return {result.line: result.error for result in summary.errors}
+
+def test_bad_subscription_rows_are_reported_by_line(run, session_factory, catalog_rows, links):
+    _, tariff_id = catalog_rows
+    future = (datetime.utcnow() + timedelta(days=10)).date().isoformat()
+    text = "\n".join([
+        "user_id,channel_id,tariff_id,end_date",
+        f"1,{CHANNEL_CHAT_ID},{tariff_id},",
+        f"abc,{CHANNEL_CHAT_ID},{tariff_id},",
+        f"2,-999,{tariff_id},",
+        f"3,{CHANNEL_CHAT_ID},{tariff_id + 1},",
+        f"4,{CHANNEL_CHAT_ID},{tariff_id},someday",
+        f"5,{CHANNEL_CHAT_ID},{tariff_id},2000-01-01",
+        f"6,{CHANNEL_CHAT_ID},{tariff_id},{future}",
+        f"1,{CHANNEL_CHAT_ID},{tariff_id},",
+    ])
+
+    summary = import_text(run, session_factory, IMPORT_SUBSCRIPTIONS, text)
+
+    assert sorted(errors(summary)) == [3, 4, 5, 6, 7]
+    assert "user_id" in errors(summary)[3]
+    assert "-999" in errors(summary)[4]
+    assert summary.imported == 3
+    assert summary.renewals == 1
+    assert [result.line for result in summary.results] == list(range(2, 10))
+    assert len(links) == 3
+    assert all(result.link for result in summary.results if result.error is None)
+
+def test_inactive_catalog_rows_are_rejected(run, session_factory, catalog_rows, links):
+    channel_id, tariff_id = catalog_rows
+
+    async def add_inactive():
+        async with get_session(session_factory) as session:
+            session.add(Tariff(channel_id=channel_id, name="Old", duration_days=30, price_stars=10, is_active=False))
+            closed = Channel(channel_id=-200, name="Closed", is_active=False)
+            session.add(closed)
+            await session.flush()
+            session.add(Tariff(channel_id=closed.id, name="Month", duration_days=30, price_stars=10, is_active=True))
+
+    run(add_inactive())
+    text = "\n".join([
+        "user_id,channel_id,tariff_id",
+        f"1,{CHANNEL_CHAT_ID},{tariff_id + 1}",
+        f"2,-200,{tariff_id + 2}",
+        f"3,{CHANNEL_CHAT_ID},{tariff_id}",
+    ])
+
+    summary = import_text(run, session_factory, IMPORT_SUBSCRIPTIONS, text)
+
+    assert sorted(errors(summary)) == [2, 3]
+    assert "неактивен" in errors(summary)[2]
+    assert "неактивен" in errors(summary)[3]
+    assert summary.imported == 1
+
+def test_bad_channel_rows_do_not_lose_their_batch(run, session_factory, links):
+    text = "\n".join([
+        "channel_id,name,description",
+        "-101,First,",
+        "-101,Duplicate,",
+        "-102,,",
+        "x,Bad id,",
+        "-103,Third,With a description",
+    ])
+
+    summary = import_text(run, session_factory, IMPORT_CHANNELS, text)
+
+    assert sorted(errors(summary)) == [3, 4, 5]
+    assert summary.imported == 2
+    run(catalog.reload())
+    assert {-101, -103} <= set(catalog.channels_by_chat_id)
+
+def test_missing_required_columns_are_rejected(run, session_factory, links):
+    with pytest.raises(RowError):
+        import_text(run, session_factory, IMPORT_SUBSCRIPTIONS, "user_id,tariff_id\n1,1\n")
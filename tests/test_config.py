@@ -0,0 +1,41 @@
+import dataclasses
+
+import pytest
+
+from app.config import load_settings, reload_settings
+from app.services.auth import admin_registry
+from app.services.invite_pool import invite_pool
+
+@pytest.fixture
+def environment(monkeypatch):
+    """Set environment variables; the services reconfigured by a reload are restored afterwards"""
+    for name in ("env_admin_ids", "admin_ids"):
+        monkeypatch.setattr(admin_registry, name, getattr(admin_registry, name))
+    for name in ("size", "expire_time", "refill_interval"):
+        monkeypatch.setattr(invite_pool, name, getattr(invite_pool, name))
+    return monkeypatch.setenv
+
+def test_settings_are_immutable(environment):
+    environment("ADMIN_IDS", "1, 2")
+    settings = load_settings()
+
+    assert settings.admin_ids == {1, 2}
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        settings.admin_ids = frozenset()
+
+def test_reload_swaps_the_snapshot_and_refreshes_dependents(environment):
+    environment("ADMIN_IDS", "1")
+    dp = {"settings": load_settings()}
+    admin_registry.configure(dp["settings"].admin_ids)
+    old = dp["settings"]
+
+    environment("ADMIN_IDS", "2,3")
+    environment("INVITE_POOL_SIZE", "9")
+    settings = reload_settings(dp)
+
+    assert dp["settings"] is settings
+    assert old.admin_ids == {1}
+    assert settings.admin_ids == {2, 3}
+    assert not admin_registry.is_admin(1)
+    assert admin_registry.is_admin(2) and admin_registry.is_admin(3)
+    assert invite_pool.size == 9
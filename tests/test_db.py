@@ -0,0 +1,78 @@
+import pytest
+
+from app.models import User
+from app.services.stats import USERS_TOTAL, get_counters
+from app.services.user import get_or_create_user
+from app.utils.db import UnitOfWork, after_commit, get_by_filters, get_session
+
+async def find_user(session_factory, user_id):
+    async with get_session(session_factory) as session:
+        return await get_by_filters(session, User, user_id=user_id)
+
+async def counters(session_factory):
+    async with get_session(session_factory) as session:
+        return await get_counters(session)
+
+def test_unit_of_work_commits_on_finish(run, session_factory):
+    async def commit_one():
+        unit = UnitOfWork(session_factory)
+        unit.session.add(User(user_id=1))
+        await unit.finish()
+
+    run(commit_one())
+    assert run(find_user(session_factory, 1)) is not None
+
+def test_unit_of_work_runs_callbacks_only_after_commit(run, session_factory):
+    calls = []
+
+    async def commit_one():
+        unit = UnitOfWork(session_factory)
+        unit.session.add(User(user_id=1))
+        after_commit(unit.session, lambda: calls.append("committed"))
+        assert calls == []
+        await unit.finish()
+
+    run(commit_one())
+    assert calls == ["committed"]
+
+def test_failed_unit_of_work_rolls_back_without_callbacks(run, session_factory):
+    calls = []
+
+    async def fail_one():
+        unit = UnitOfWork(session_factory)
+        unit.session.add(User(user_id=1))
+        after_commit(unit.session, lambda: calls.append("committed"))
+        unit.failed = True
+        await unit.finish()
+
+    run(fail_one())
+    assert calls == []
+    assert run(find_user(session_factory, 1)) is None
+
+def test_unit_of_work_identity_map_serves_repeated_lookups(run, session_factory):
+    async def look_up_twice():
+        unit = UnitOfWork(session_factory)
+        created = await get_or_create_user(unit.session, 1)
+        found = await get_by_filters(unit.session, User, user_id=1)
+        await unit.finish()
+        return created, found
+
+    created, found = run(look_up_twice())
+    assert found is created
+
+def test_counters_change_only_when_the_transaction_commits(run, session_factory):
+    async def create_users():
+        async with get_session(session_factory) as session:
+            await get_or_create_user(session, 1)
+            await get_or_create_user(session, 2)
+
+    async def create_user_and_fail():
+        async with get_session(session_factory) as session:
+            await get_or_create_user(session, 3)
+            raise RuntimeError("handler failed")
+
+    run(create_users())
+    with pytest.raises(RuntimeError):
+        run(create_user_and_fail())
+
+    assert run(counters(session_factory))[USERS_TOTAL] == 2
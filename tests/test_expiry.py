@@ -0,0 +1,153 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+from sqlalchemy.future import select
+
+from app.models import Subscription, User
+from app.services.entitlements import entitlements
+from app.services.scheduler import REVOKE_TIMEOUT, check_expired_subscriptions
+from app.services.subscription import create_subscription
+from app.utils.db import get_session
+
+from conftest import CHANNEL_CHAT_ID
+
+class FakeBot:
+    """Records kicks and notices; kicks take a while and can be made to fail"""
+
+    def __init__(self, failing=(), kick_time=0.0):
+        self.failing = set(failing)
+        self.kick_time = kick_time
+        self.kicked = []
+        self.notified = []
+
+    async def ban_chat_member(self, chat_id, user_id):
+        await asyncio.sleep(self.kick_time)
+        if user_id in self.failing:
+            raise RuntimeError("Telegram is down")
+        self.kicked.append(user_id)
+
+    async def unban_chat_member(self, chat_id, user_id, only_if_banned=False):
+        pass
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.notified.append(chat_id)
+
+async def subscriptions_of(session_factory, user_id):
+    """``(is_active, end_date)`` of every subscription of a user, oldest first"""
+    async with get_session(session_factory) as session:
+        result = await session.execute(
+            select(Subscription.is_active, Subscription.end_date)
+            .join(User, Subscription.user_id == User.id)
+            .where(User.user_id == user_id)
+            .order_by(Subscription.id)
+        )
+        return result.all()
+
+def test_expired_subscriptions_are_revoked(run, session_factory, catalog_rows, add_subscription):
+    channel_id, tariff_id = catalog_rows
+    now = datetime.utcnow()
+    run(add_subscription(1, channel_id, tariff_id, now - timedelta(hours=1)))
+    run(add_subscription(2, channel_id, tariff_id, now + timedelta(days=1)))
+    bot = FakeBot()
+
+    run(check_expired_subscriptions(bot, session_factory))
+
+    assert bot.kicked == [1]
+    assert bot.notified == [1]
+    assert [active for active, _ in run(subscriptions_of(session_factory, 1))] == [False]
+    assert [active for active, _ in run(subscriptions_of(session_factory, 2))] == [True]
+
+def test_failed_kick_is_retried_next_run(run, session_factory, catalog_rows, add_subscription):
+    channel_id, tariff_id = catalog_rows
+    run(add_subscription(1, channel_id, tariff_id, datetime.utcnow() - timedelta(hours=1)))
+
+    run(check_expired_subscriptions(FakeBot(failing={1}), session_factory))
+    assert [active for active, _ in run(subscriptions_of(session_factory, 1))] == [True]
+
+    bot = FakeBot()
+    run(check_expired_subscriptions(bot, session_factory))
+    assert bot.kicked == [1]
+    assert [active for active, _ in run(subscriptions_of(session_factory, 1))] == [False]
+
+def test_renewal_during_expiry_run_is_kept(run, session_factory, catalog_rows, add_subscription):
+    channel_id, tariff_id = catalog_rows
+    run(add_subscription(1, channel_id, tariff_id, datetime.utcnow() - timedelta(hours=1)))
+    bot = FakeBot(kick_time=0.2)
+
+    async def renew_while_kicking():
+        await asyncio.sleep(0.05)
+        async with get_session(session_factory) as session:
+            await create_subscription(session, 1, channel_id, tariff_id, "charge-1", duration_days=30)
+
+    async def expire_and_renew():
+        await asyncio.gather(check_expired_subscriptions(bot, session_factory), renew_while_kicking())
+
+    run(expire_and_renew())
+
+    # The expired row is closed and the payment started a new subscription
+    rows = run(subscriptions_of(session_factory, 1))
+    assert [active for active, _ in rows] == [False, True]
+    assert rows[1][1] > datetime.utcnow() + timedelta(days=29)
+    assert entitlements.is_entitled(1, CHANNEL_CHAT_ID)
+
+def test_renewal_before_expiry_run_is_not_revoked(run, session_factory, catalog_rows, add_subscription):
+    channel_id, tariff_id = catalog_rows
+    run(add_subscription(1, channel_id, tariff_id, datetime.utcnow() - timedelta(hours=1)))
+
+    async def renew():
+        async with get_session(session_factory) as session:
+            await create_subscription(session, 1, channel_id, tariff_id, "charge-1", duration_days=30)
+
+    run(renew())
+    bot = FakeBot()
+    run(check_expired_subscriptions(bot, session_factory))
+
+    assert bot.kicked == []
+    assert [active for active, _ in run(subscriptions_of(session_factory, 1))] == [True]
+
+def test_claim_is_committed_before_the_kicks(run, session_factory, catalog_rows, add_subscription):
+    channel_id, tariff_id = catalog_rows
+    subscription_id = run(add_subscription(1, channel_id, tariff_id, datetime.utcnow() - timedelta(hours=1)))
+    bot = FakeBot(kick_time=0.2)
+
+    async def marks():
+        async with get_session(session_factory) as session:
+            result = await session.execute(select(Subscription.is_active, Subscription.revoking_since))
+            return result.one()
+
+    async def read_while_kicking():
+        await asyncio.sleep(0.05)
+        return await marks()
+
+    async def expire_and_read():
+        _, during = await asyncio.gather(check_expired_subscriptions(bot, session_factory), read_while_kicking())
+        return during, await marks()
+
+    (active, revoking_since), after = run(expire_and_read())
+
+    assert not active and revoking_since is not None
+    assert after == (False, None)
+
+def test_interrupted_revocation_is_claimed_again(run, session_factory, catalog_rows, add_subscription):
+    channel_id, tariff_id = catalog_rows
+    now = datetime.utcnow()
+    interrupted = run(add_subscription(1, channel_id, tariff_id, now - timedelta(days=1)))
+    renewed = run(add_subscription(2, channel_id, tariff_id, now - timedelta(days=1)))
+
+    async def interrupt():
+        async with get_session(session_factory) as session:
+            await session.execute(
+                update(Subscription)
+                .where(Subscription.id.in_([interrupted, renewed]))
+                .values(is_active=False, revoking_since=now - REVOKE_TIMEOUT - timedelta(minutes=1))
+            )
+            await create_subscription(session, 2, channel_id, tariff_id, "charge-1", duration_days=30)
+
+    run(interrupt())
+    bot = FakeBot()
+    run(check_expired_subscriptions(bot, session_factory))
+
+    # User 2 paid since, so only user 1 is kicked
+    assert bot.kicked == [1]
+    assert [active for active, _ in run(subscriptions_of(session_factory, 2))] == [False, True]
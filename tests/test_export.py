@@ -0,0 +1,65 @@
+import csv
+import gzip
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models import Channel
+from app.services.export import FORMAT_CSV, FORMAT_JSONL, export_table
+from app.utils.db import get_session
+
+END_DATE = datetime(2030, 1, 1, 12, 30, 15, 123456)
+
+def add_channels(run, session_factory, names):
+    async def add():
+        async with get_session(session_factory) as session:
+            session.add_all(Channel(channel_id=-1000 - index, name=name, is_active=True) for index, name in enumerate(names))
+
+    run(add())
+
+def export(run, session_factory, table, fmt, path, chunk_size):
+    async def stream():
+        async with get_session(session_factory) as session:
+            return await export_table(session, table, fmt, str(path), chunk_size=chunk_size)
+
+    return run(stream())
+
+@pytest.mark.parametrize("fmt", [FORMAT_CSV, FORMAT_JSONL])
+def test_export_round_trips_across_chunks(run, session_factory, tmp_path, fmt):
+    names = ["Plain", "Comma, quote \" and\nnewline", "Канал ✨"] + [f"Channel {n}" for n in range(7)]
+    add_channels(run, session_factory, names)
+    path = tmp_path / f"channels.{fmt}.gz"
+
+    assert export(run, session_factory, "channels", fmt, path, chunk_size=3) == len(names)
+
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as file:
+        if fmt == FORMAT_CSV:
+            rows = list(csv.DictReader(file))
+        else:
+            rows = [json.loads(line) for line in file]
+    assert [row["name"] for row in rows] == names
+    assert [int(row["channel_id"]) for row in rows] == [-1000 - index for index in range(len(names))]
+
+def test_export_writes_dates_as_iso(run, session_factory, catalog_rows, add_subscription, tmp_path):
+    channel_id, tariff_id = catalog_rows
+    run(add_subscription(1, channel_id, tariff_id, END_DATE))
+    path = tmp_path / "subscriptions.jsonl.gz"
+
+    export(run, session_factory, "subscriptions", FORMAT_JSONL, path, chunk_size=100)
+
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        (row,) = [json.loads(line) for line in file]
+    assert row["telegram_user_id"] == 1
+    assert datetime.fromisoformat(row["end_date"]) == END_DATE
+    assert datetime.fromisoformat(row["start_date"]) == END_DATE - timedelta(days=30)
+
+def test_empty_csv_export_has_only_the_header(run, session_factory, tmp_path):
+    path = tmp_path / "payments.csv.gz"
+
+    assert export(run, session_factory, "payments", FORMAT_CSV, path, chunk_size=10) == 0
+
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as file:
+        header, *rows = csv.reader(file)
+    assert header[:2] == ["id", "telegram_payment_charge_id"]
+    assert rows == []
@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.services.forecast import HORIZON_MINUTES, ExpiryForecast, ExpiryForecaster
+
+START = datetime(2024, 1, 1, 12, 0)
+
+def make_forecaster(expirations_per_minute: int = 0) -> ExpiryForecaster:
+    forecaster = ExpiryForecaster()
+    forecaster.forecast = ExpiryForecast(
+        start=START,
+        channel_ids=np.array([1], dtype=np.int64),
+        per_minute=np.full((1, HORIZON_MINUTES), expirations_per_minute, dtype=np.int64)
+    )
+    return forecaster
+
+def test_concurrency_without_forecast_follows_backlog():
+    assert ExpiryForecaster().concurrency(START, 600, 20) == 10
+
+def test_concurrency_follows_forecast():
+    # 60 minutes of 10 expirations a minute
+    assert make_forecaster(10).concurrency(START + timedelta(hours=1), 0, 20) == 10
+
+def test_concurrency_covers_backlog_older_than_forecast():
+    # Rows that expired before the forecast was made, e.g. after downtime
+    assert make_forecaster(0).concurrency(START + timedelta(hours=1), 600, 20) == 10
+
+def test_concurrency_is_capped():
+    assert make_forecaster(100).concurrency(START + timedelta(hours=1), 0, 4) == 4
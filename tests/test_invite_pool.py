@@ -0,0 +1,67 @@
+from collections import deque
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from app.services.catalog import catalog
+from app.services.invite_pool import InviteLinkPool, PooledLink
+
+from conftest import CHANNEL_CHAT_ID
+
+class FakeBot:
+    def __init__(self):
+        self.minted = 0
+        self.revoked = []
+
+    async def create_chat_invite_link(self, chat_id, expire_date, member_limit):
+        self.minted += 1
+        return SimpleNamespace(invite_link=f"https://t.me/+{chat_id}-{self.minted}")
+
+    async def revoke_chat_invite_link(self, chat_id, invite_link):
+        self.revoked.append(invite_link)
+
+def make_pool(run, session_factory, size=3):
+    run(catalog.load(session_factory))
+    pool = InviteLinkPool()
+    pool.bot = FakeBot()
+    pool.size = size
+    return pool
+
+def test_refill_tops_up_active_channels(run, session_factory, catalog_rows):
+    pool = make_pool(run, session_factory)
+
+    run(pool.refill())
+    assert pool.bot.minted == 3
+
+    link = run(pool.acquire(CHANNEL_CHAT_ID, key="charge-1"))
+    assert link == f"https://t.me/+{CHANNEL_CHAT_ID}-1"
+    # A retry of the same payment gets the same link, without using up another one
+    assert run(pool.acquire(CHANNEL_CHAT_ID, key="charge-1")) == link
+    assert run(pool.acquire(CHANNEL_CHAT_ID, key="charge-2")) != link
+
+    run(pool.refill())
+    assert pool.bot.minted == 5
+
+def test_empty_pool_mints_on_the_spot(run, session_factory, catalog_rows):
+    pool = make_pool(run, session_factory)
+
+    assert run(pool.acquire(CHANNEL_CHAT_ID)) == f"https://t.me/+{CHANNEL_CHAT_ID}-1"
+
+def test_stale_links_are_revoked_not_handed_out(run, session_factory, catalog_rows):
+    pool = make_pool(run, session_factory)
+    stale = PooledLink(CHANNEL_CHAT_ID, "https://t.me/+stale", datetime.now() + timedelta(minutes=5))
+    pool._pools[CHANNEL_CHAT_ID] = deque([stale])
+
+    assert run(pool.acquire(CHANNEL_CHAT_ID)) != stale.invite_link
+
+    run(pool.revoke_expired())
+    assert pool.bot.revoked == [stale.invite_link]
+
+def test_stop_revokes_links_never_handed_out(run, session_factory, catalog_rows):
+    pool = make_pool(run, session_factory)
+    run(pool.refill())
+    handed_out = run(pool.acquire(CHANNEL_CHAT_ID))
+
+    run(pool.stop())
+
+    assert len(pool.bot.revoked) == 2
+    assert handed_out not in pool.bot.revoked
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+from sqlalchemy import update
+
+from app.models import Tariff
+from app.services.catalog import catalog
+from app.services.invoice import invoice_links
+from app.utils.db import get_session
+from app.utils.payload import InvoicePayload
+
+SECRET = b"secret"
+
+class FakeBot:
+    def __init__(self, fail_first=False):
+        self.fail_first = fail_first
+        self.payloads = []
+
+    async def create_invoice_link(self, payload, **kwargs):
+        await asyncio.sleep(0.01)
+        self.payloads.append(payload)
+        if self.fail_first and len(self.payloads) == 1:
+            raise RuntimeError("Telegram is down")
+        return f"https://t.me/$link{len(self.payloads)}"
+
+def load_catalog(run, session_factory):
+    run(catalog.load(session_factory))
+    invoice_links.invalidate()
+
+def get_link(bot, tariff_id):
+    return invoice_links.get(bot, catalog.get_tariff(tariff_id), "", SECRET)
+
+def test_link_is_created_once_per_tariff(run, session_factory, catalog_rows):
+    _, tariff_id = catalog_rows
+    load_catalog(run, session_factory)
+    bot = FakeBot()
+
+    async def click_three_times():
+        return await asyncio.gather(*(get_link(bot, tariff_id) for _ in range(3)))
+
+    assert run(click_three_times()) == ["https://t.me/$link1"] * 3
+    assert run(get_link(bot, tariff_id)) == "https://t.me/$link1"
+    assert len(bot.payloads) == 1
+
+def test_catalog_change_invalidates_links(run, session_factory, catalog_rows):
+    _, tariff_id = catalog_rows
+    load_catalog(run, session_factory)
+    bot = FakeBot()
+    run(get_link(bot, tariff_id))
+
+    async def change_price():
+        async with get_session(session_factory) as session:
+            await session.execute(update(Tariff).where(Tariff.id == tariff_id).values(price_stars=20))
+        await catalog.reload()
+
+    run(change_price())
+
+    assert run(get_link(bot, tariff_id)) == "https://t.me/$link2"
+    offer = InvoicePayload.verify(bot.payloads[-1], SECRET)
+    assert offer.price_stars == 20
+    assert offer.catalog_version == catalog.version
+
+def test_failed_link_creation_is_retried(run, session_factory, catalog_rows):
+    _, tariff_id = catalog_rows
+    load_catalog(run, session_factory)
+    bot = FakeBot(fail_first=True)
+
+    with pytest.raises(RuntimeError):
+        run(get_link(bot, tariff_id))
+
+    assert run(get_link(bot, tariff_id)) == "https://t.me/$link2"
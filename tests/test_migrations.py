@@ -0,0 +1,47 @@
+import importlib.util
+from datetime import datetime
+from pathlib import Path
+
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy import create_engine, insert, select, text
+
+from app.models import Base, Subscription
+
+VERSIONS = Path(__file__).parent.parent / "migrations" / "versions"
+
+def run_upgrade(connection, name):
+    spec = importlib.util.spec_from_file_location(name, VERSIONS / f"{name}.py")
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    with Operations.context(MigrationContext.configure(connection)):
+        migration.upgrade()
+
+def test_payments_ledger_keeps_the_longest_duplicate_subscription(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'bot.db'}")
+    rows = [
+        # user 1: the older row was paid further ahead than the newer one
+        dict(id=1, user_id=1, end_date=datetime(2030, 3, 1)),
+        dict(id=2, user_id=1, end_date=datetime(2030, 2, 1)),
+        # user 2: same end date, the newer row wins
+        dict(id=3, user_id=2, end_date=datetime(2030, 1, 1)),
+        dict(id=4, user_id=2, end_date=datetime(2030, 1, 1)),
+        dict(id=5, user_id=3, end_date=datetime(2030, 1, 1)),
+    ]
+    with engine.begin() as connection:
+        # The schema as it was before revision 0003
+        Base.metadata.create_all(connection)
+        connection.execute(text("DROP INDEX uq_subscriptions_active_user_channel"))
+        connection.execute(text("DROP TABLE payments"))
+        connection.execute(insert(Subscription), [
+            dict(row, channel_id=1, tariff_id=1, start_date=datetime(2029, 1, 1), is_active=True) for row in rows
+        ])
+
+        run_upgrade(connection, "payments_ledger")
+
+        active = connection.execute(
+            select(Subscription.id).where(Subscription.is_active == True).order_by(Subscription.id)
+        ).scalars().all()
+    engine.dispose()
+
+    assert active == [1, 4, 5]
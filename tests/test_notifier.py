@@ -0,0 +1,58 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.auth import admin_registry
+from app.services.notifier import AdminNotifier, Sale
+
+class FakeBot:
+    def __init__(self, send_time=0.0):
+        self.send_time = send_time
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.send_time)
+        self.sent.append((chat_id, text))
+
+@pytest.fixture(autouse=True)
+def one_admin(monkeypatch):
+    monkeypatch.setattr(admin_registry, "admin_ids", frozenset({1}))
+
+def sale(name: str) -> Sale:
+    return Sale(full_name=name, username=name, channel_name="Channel", amount=10, currency="XTR", end_date=datetime(2026, 1, 1))
+
+def settings(digest_interval: float):
+    return SimpleNamespace(admin_digest_interval=digest_interval)
+
+def test_stop_sends_the_batch_being_collected_at_once(run):
+    bot = FakeBot()
+    notifier = AdminNotifier()
+
+    async def notify_and_stop():
+        notifier.start(bot, settings(60))
+        notifier.notify_sale(sale("a"))
+        notifier.notify_sale(sale("b"))
+        await asyncio.sleep(0.01)
+        await asyncio.wait_for(notifier.stop(), 1)
+
+    run(notify_and_stop())
+
+    assert len(bot.sent) == 1
+    assert "Новые подписки: 2" in bot.sent[0][1]
+
+def test_stop_waits_for_the_digest_being_sent(run):
+    bot = FakeBot(send_time=0.1)
+    notifier = AdminNotifier()
+
+    async def stop_while_sending():
+        notifier.start(bot, settings(0))
+        notifier.notify_sale(sale("a"))
+        await asyncio.sleep(0.05)
+        notifier.notify_sale(sale("b"))
+        await notifier.stop()
+
+    run(stop_while_sending())
+
+    assert [text.splitlines()[2] for _, text in bot.sent] == ["Пользователь: a (@a)", "Пользователь: b (@b)"]
@@ -0,0 +1,90 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.future import select
+
+from app.handlers.admin import ADMIN_LISTINGS
+from app.handlers.base import cmd_create_user
+from app.models import User
+from app.utils.db import get_session
+from app.utils.pagination import BACKWARD, FORWARD, INTEGER, TIMESTAMP, KeysetPaginator
+
+USERS = ADMIN_LISTINGS["users"].paginator
+
+async def add_users(session_factory, count, created_at):
+    async with get_session(session_factory) as session:
+        session.add_all(User(user_id=user_id, created_at=created_at) for user_id in range(1, count + 1))
+
+async def walk(session_factory, paginator, direction=FORWARD, cursor="-"):
+    """Every page from ``cursor`` on in ``direction``, as lists of Telegram ids"""
+    pages = []
+    async with get_session(session_factory) as session:
+        while True:
+            page = await paginator.fetch(session, direction, cursor)
+            pages.append([row[0] for row in page.rows])
+            more = page.has_next if direction == FORWARD else page.has_prev
+            if not more:
+                return pages, page
+            cursor = page.last_cursor if direction == FORWARD else page.first_cursor
+
+def test_equal_keys_are_neither_skipped_nor_repeated(run, session_factory):
+    # Every user registered in the same microsecond; only the id tells them apart
+    run(add_users(session_factory, 25, created_at=datetime(2024, 1, 1)))
+
+    pages, last = run(walk(session_factory, USERS))
+
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert sum(pages, []) == list(range(25, 0, -1))
+
+    back, _ = run(walk(session_factory, USERS, BACKWARD, last.first_cursor))
+    assert back == [list(range(15, 5, -1)), list(range(25, 15, -1))]
+
+def test_null_created_at_is_rejected(run, session_factory):
+    async def insert_null():
+        async with get_session(session_factory) as session:
+            await session.execute(insert(User).values(user_id=1, created_at=None))
+
+    with pytest.raises(IntegrityError):
+        run(insert_null())
+
+def test_users_from_createuser_page_with_orm_users(run, session_factory):
+    run(add_users(session_factory, 6, created_at=datetime.utcnow().replace(microsecond=0)))
+
+    async def answer(text):
+        pass
+
+    async def create_users():
+        for user_id in range(7, 13):
+            user = SimpleNamespace(id=user_id, username=None, first_name=None, last_name=None)
+            async with get_session(session_factory) as session:
+                await cmd_create_user(SimpleNamespace(from_user=user, answer=answer), session)
+
+    run(create_users())
+
+    pages, _ = run(walk(session_factory, USERS))
+
+    assert sorted(sum(pages, [])) == list(range(1, 13))
+
+def test_cursor_round_trip():
+    paginator = KeysetPaginator(select(User.user_id), keys=[(User.created_at, TIMESTAMP), (User.id, INTEGER)])
+    values = [datetime(2024, 1, 1, 12, 30, 15, 123456), 42]
+
+    assert paginator.decode(paginator.encode(values)) == values
+    with pytest.raises(ValueError):
+        paginator.decode("123")
+
+def test_cursor_past_the_end_starts_over(run, session_factory):
+    run(add_users(session_factory, 3, created_at=datetime(2024, 1, 1)))
+    stale = USERS.encode([datetime(2000, 1, 1), 1])
+
+    async def fetch():
+        async with get_session(session_factory) as session:
+            return await USERS.fetch(session, FORWARD, stale)
+
+    page = run(fetch())
+
+    assert [row[0] for row in page.rows] == [3, 2, 1]
+    assert not page.has_prev
@@ -0,0 +1,46 @@
+import pytest
+
+from app.services.catalog import Catalog
+from app.utils.payload import InvalidPayload, InvoicePayload
+
+SECRET = b"secret"
+
+def make_payload(**overrides) -> InvoicePayload:
+    fields = dict(user_id=1, channel_id=2, tariff_id=3, price_stars=10, duration_days=30, catalog_version=7)
+    fields.update(overrides)
+    return InvoicePayload(**fields)
+
+def test_signed_payload_round_trips():
+    payload = make_payload()
+    signed = payload.sign(SECRET)
+
+    assert len(signed) <= 128
+    assert InvoicePayload.verify(signed, SECRET) == payload
+
+def test_tampered_payload_is_rejected():
+    signed = make_payload(price_stars=10).sign(SECRET)
+    body, _, signature = signed.rpartition(":")
+    tampered = body.replace(":10:30:", ":1:30:") + ":" + signature
+
+    with pytest.raises(InvalidPayload):
+        InvoicePayload.verify(tampered, SECRET)
+
+def test_payload_signed_with_another_secret_is_rejected():
+    with pytest.raises(InvalidPayload):
+        InvoicePayload.verify(make_payload().sign(b"other"), SECRET)
+
+@pytest.mark.parametrize("payload", [None, "", "1:2:3", "channel_1_tariff_2"])
+def test_malformed_payload_is_rejected(payload):
+    with pytest.raises(InvalidPayload):
+        InvoicePayload.verify(payload, SECRET)
+
+def test_offer_stays_current_until_its_tariff_changes(run, session_factory, catalog_rows):
+    channel_id, tariff_id = catalog_rows
+    catalog = Catalog()
+    run(catalog.load(session_factory))
+
+    assert catalog.is_offer_current(tariff_id, channel_id, 10, 30, catalog.version)
+    # An offer from an older catalog version is fine while its tariff is unchanged
+    assert catalog.is_offer_current(tariff_id, channel_id, 10, 30, catalog.version + 1)
+    assert not catalog.is_offer_current(tariff_id, channel_id, 5, 30, catalog.version + 1)
+    assert not catalog.is_offer_current(tariff_id, channel_id + 1, 10, 30, catalog.version)
@@ -0,0 +1,82 @@
+import asyncio
+from types import SimpleNamespace
+
+from sqlalchemy import func
+from sqlalchemy.future import select
+
+from app.models import Payment, Subscription, User
+from app.services.subscription import process_successful_payment
+from app.utils.db import get_session
+from app.utils.payload import InvoicePayload
+
+SETTINGS = SimpleNamespace(payload_secret=b"secret")
+
+def payment_data(user_id: int, channel_id: int, tariff_id: int, charge_id: str) -> dict:
+    payload = InvoicePayload(
+        user_id=user_id, channel_id=channel_id, tariff_id=tariff_id,
+        price_stars=10, duration_days=30, catalog_version=0
+    )
+    return {
+        "invoice_payload": payload.sign(SETTINGS.payload_secret),
+        "telegram_payment_charge_id": charge_id,
+        "total_amount": 10,
+        "currency": "XTR",
+    }
+
+async def add_user(session_factory, user_id: int):
+    async with get_session(session_factory) as session:
+        session.add(User(user_id=user_id))
+
+async def pay(session_factory, user_id: int, data: dict) -> dict:
+    async with get_session(session_factory) as session:
+        return await process_successful_payment(None, session, user_id, data, SETTINGS)
+
+async def subscriptions_and_payments(session_factory):
+    async with get_session(session_factory) as session:
+        subscriptions = (await session.execute(select(Subscription))).scalars().all()
+        payments = await session.scalar(select(func.count(Payment.id)))
+    return subscriptions, payments
+
+def test_redelivered_payment_is_applied_once(run, session_factory, catalog_rows):
+    channel_id, tariff_id = catalog_rows
+    data = payment_data(1, channel_id, tariff_id, "charge-1")
+    run(add_user(session_factory, 1))
+
+    first = run(pay(session_factory, 1, data))
+    second = run(pay(session_factory, 1, data))
+
+    assert not first["duplicate"]
+    assert second["duplicate"]
+    assert second["end_date"] == first["end_date"]
+    subscriptions, payments = run(subscriptions_and_payments(session_factory))
+    assert payments == 1
+    assert len(subscriptions) == 1
+    assert subscriptions[0].end_date == first["end_date"]
+
+def test_concurrent_deliveries_of_one_payment_extend_once(run, session_factory, catalog_rows):
+    channel_id, tariff_id = catalog_rows
+    data = payment_data(1, channel_id, tariff_id, "charge-1")
+    run(add_user(session_factory, 1))
+
+    async def deliver_three_times():
+        return await asyncio.gather(*(pay(session_factory, 1, data) for _ in range(3)))
+
+    results = run(deliver_three_times())
+
+    assert sorted(result["duplicate"] for result in results) == [False, True, True]
+    subscriptions, payments = run(subscriptions_and_payments(session_factory))
+    assert payments == 1
+    assert len(subscriptions) == 1
+    assert all(result["end_date"] == subscriptions[0].end_date for result in results)
+
+def test_second_payment_extends_the_active_subscription(run, session_factory, catalog_rows):
+    channel_id, tariff_id = catalog_rows
+    run(add_user(session_factory, 1))
+
+    first = run(pay(session_factory, 1, payment_data(1, channel_id, tariff_id, "charge-1")))
+    second = run(pay(session_factory, 1, payment_data(1, channel_id, tariff_id, "charge-2")))
+
+    subscriptions, payments = run(subscriptions_and_payments(session_factory))
+    assert payments == 2
+    assert len(subscriptions) == 1
+    assert (second["end_date"] - first["end_date"]).days == 30
@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytz
+from sqlalchemy.future import select
+
+from app.models import Subscription
+from app.services.reminders import claim_reminders, send_expiry_reminders
+from app.services.sender import message_sender
+from app.services.subscription import create_subscription
+from app.utils.db import get_session
+
+SETTINGS = SimpleNamespace(timezone=pytz.utc, payment_provider_token="", payload_secret=b"secret")
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(chat_id)
+
+async def claim(session_factory, stage, now):
+    async with get_session(session_factory) as session:
+        return await claim_reminders(session, stage, now)
+
+async def stages(session_factory):
+    async with get_session(session_factory) as session:
+        result = await session.execute(select(Subscription.id, Subscription.reminder_stage).order_by(Subscription.id))
+        return dict(result.all())
+
+def test_each_stage_is_claimed_once(run, session_factory, catalog_rows, add_subscription):
+    channel_id, tariff_id = catalog_rows
+    now = datetime.utcnow()
+    in_two_days = run(add_subscription(1, channel_id, tariff_id, now + timedelta(days=2)))
+    in_twelve_hours = run(add_subscription(2, channel_id, tariff_id, now + timedelta(hours=12)))
+    run(add_subscription(3, channel_id, tariff_id, now + timedelta(days=5)))
+
+    assert run(claim(session_factory, 1, now)) == [in_two_days]
+    assert run(claim(session_factory, 1, now)) == []
+    assert run(claim(session_factory, 2, now)) == [in_twelve_hours]
+    assert run(claim(session_factory, 2, now)) == []
+
+    # A day and a half later the first one is due for its last reminder
+    later = now + timedelta(hours=36)
+    assert run(claim(session_factory, 2, later)) == [in_two_days]
+    assert run(stages(session_factory)) == {in_two_days: 2, in_twelve_hours: 2, 3: 0}
+
+def test_concurrent_claims_never_overlap(run, session_factory, catalog_rows, add_subscription):
+    channel_id, tariff_id = catalog_rows
+    now = datetime.utcnow()
+    ids = [run(add_subscription(user_id, channel_id, tariff_id, now + timedelta(days=2))) for user_id in range(1, 31)]
+
+    async def claim_twice():
+        return await asyncio.gather(claim(session_factory, 1, now), claim(session_factory, 1, now))
+
+    first, second = run(claim_twice())
+
+    assert not set(first) & set(second)
+    assert sorted(first + second) == ids
+
+def test_reminders_are_sent_once_until_renewal(run, session_factory, catalog_rows, add_subscription):
+    channel_id, tariff_id = catalog_rows
+    run(add_subscription(1, channel_id, tariff_id, datetime.utcnow() + timedelta(days=2)))
+    bot = FakeBot()
+    message_sender.configure(bot, rate=1000)
+
+    run(send_expiry_reminders(bot, session_factory, SETTINGS))
+    run(send_expiry_reminders(bot, session_factory, SETTINGS))
+    assert bot.sent == [1]
+
+    async def renew():
+        async with get_session(session_factory) as session:
+            await create_subscription(session, 1, channel_id, tariff_id, "charge-1", duration_days=30)
+
+    # The extended end date starts over from the first reminder
+    run(renew())
+    assert list(run(stages(session_factory)).values()) == [0]
@@ -0,0 +1,46 @@
+import pytest
+from sqlalchemy.future import select
+
+from app.models import DailyRollup
+from app.services.revenue import get_revenue_report, record_subscription
+from app.services.subscription import process_successful_payment
+from app.utils.db import get_session
+
+from test_payments import SETTINGS, add_user, pay, payment_data
+
+async def report(session_factory):
+    async with get_session(session_factory) as session:
+        return await get_revenue_report(session, 7)
+
+def test_rollups_change_only_when_the_payment_commits(run, session_factory, catalog_rows):
+    channel_id, tariff_id = catalog_rows
+    run(add_user(session_factory, 1))
+
+    async def pay_and_fail():
+        async with get_session(session_factory) as session:
+            await process_successful_payment(None, session, 1, payment_data(1, channel_id, tariff_id, "charge-1"), SETTINGS)
+            raise RuntimeError("handler failed")
+
+    with pytest.raises(RuntimeError):
+        run(pay_and_fail())
+    assert run(report(session_factory)).total.stars == 0
+
+    run(pay(session_factory, 1, payment_data(1, channel_id, tariff_id, "charge-2")))
+    run(pay(session_factory, 1, payment_data(1, channel_id, tariff_id, "charge-3")))
+
+    total = run(report(session_factory)).total
+    assert (total.new_subscriptions, total.renewals, total.stars) == (1, 1, 20)
+
+def test_payment_transaction_does_not_write_the_rollup_row(run, session_factory, catalog_rows):
+    channel_id, tariff_id = catalog_rows
+
+    async def record_twice():
+        async with get_session(session_factory) as session:
+            await record_subscription(session, channel_id, tariff_id, renewal=False, stars=10)
+            await record_subscription(session, channel_id, tariff_id, renewal=True, stars=10)
+            await session.flush()
+            assert (await session.execute(select(DailyRollup))).scalars().all() == []
+
+    run(record_twice())
+    total = run(report(session_factory)).total
+    assert (total.new_subscriptions, total.renewals, total.stars) == (1, 1, 20)
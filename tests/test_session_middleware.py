@@ -0,0 +1,39 @@
+from aiogram.dispatcher.handler import current_handler
+
+from app.middlewares.session import DbSessionMiddleware, current_uow
+
+async def without_session(message):
+    pass
+
+async def with_session(message, session):
+    pass
+
+def process(run, session_factory, handler) -> dict:
+    """Data a message handler would be called with, plus whether a session was opened"""
+    middleware = DbSessionMiddleware(session_factory)
+
+    async def process_message():
+        data = {}
+        await middleware.on_pre_process_update(None, data)
+        token = current_handler.set(handler)
+        try:
+            await middleware.on_process_message(None, data)
+        finally:
+            current_handler.reset(token)
+        opened = current_uow.get()._session is not None
+        await middleware.on_post_process_update(None, [], data)
+        return data, opened
+
+    return run(process_message())
+
+def test_session_is_not_opened_for_handlers_without_it(run, session_factory):
+    data, opened = process(run, session_factory, without_session)
+
+    assert "session" not in data
+    assert not opened
+
+def test_session_is_injected_into_handlers_that_take_it(run, session_factory):
+    data, opened = process(run, session_factory, with_session)
+
+    assert opened
+    assert data["session"] is not None
@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+import pytest
+
+from app.utils.token_buckets import RatePacer, TokenBucketTable
+
+def test_bucket_allows_burst_then_refills():
+    table = TokenBucketTable(rate=1, burst=3, capacity=16)
+
+    assert [table.consume(42, now=0.0) for _ in range(4)] == [True, True, True, False]
+    assert not table.consume(42, now=0.5)
+    assert table.consume(42, now=1.5)
+
+def test_buckets_are_per_key():
+    table = TokenBucketTable(rate=1, burst=1, capacity=16)
+
+    assert table.consume(1, now=0.0)
+    assert not table.consume(1, now=0.0)
+    assert table.consume(2, now=0.0)
+
+def test_full_table_evicts_instead_of_growing():
+    table = TokenBucketTable(rate=1, burst=1, capacity=4)
+
+    for key in range(1, 100):
+        assert table.consume(key, now=0.0)
+    # Key 1 was evicted long ago and starts again with a full bucket
+    assert table.consume(1, now=0.0)
+
+def test_mark_debounces_per_interval():
+    table = TokenBucketTable(rate=1, burst=1, capacity=16)
+
+    assert table.mark(7, now=10.0, interval=5)
+    assert not table.mark(7, now=12.0, interval=5)
+    assert table.mark(7, now=15.0, interval=5)
+
+def test_capacity_must_be_a_power_of_two():
+    with pytest.raises(ValueError):
+        TokenBucketTable(rate=1, burst=1, capacity=10)
+
+def test_pacer_spaces_concurrent_callers():
+    pacer = RatePacer(rate=50)
+    stamps = []
+
+    async def call():
+        await pacer.wait()
+        stamps.append(time.monotonic())
+
+    async def five_calls():
+        await asyncio.gather(*(call() for _ in range(5)))
+
+    asyncio.run(five_calls())
+
+    gaps = [later - earlier for earlier, later in zip(stamps, stamps[1:])]
+    assert min(gaps) >= 0.015
+
+def test_pacer_hold_delays_the_next_call():
+    pacer = RatePacer(rate=1000)
+    pacer.hold(0.05)
+
+    started = time.monotonic()
+    asyncio.run(pacer.wait())
+
+    assert time.monotonic() - started >= 0.04
@@ -4,20 +4,30 @@ import asyncio
 from aiogram import Bot, Dispatcher, types
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 import os
-from dotenv import load_dotenv
 import requests
 import atexit
 import time
 import json
 
+from app.config import load_settings
 from app.models.base import Base
 from app.handlers import register_all_handlers
+from app.middlewares import DbSessionMiddleware, SettingsMiddleware, ThrottlingMiddleware
+from app.services.auth import admin_registry
+from app.services.catalog import catalog
+from app.services.entitlements import entitlements
+from app.services.invite_pool import invite_pool
+from app.services.notifier import admin_notifier
+from app.services.reports import report_runner
+from app.services.broadcast import broadcaster
+from app.services.stats import reconcile_counters
 from app.services.scheduler import setup_scheduler
+from app.utils.update_lanes import update_lanes
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 
-# Загружаем переменные окружения
-load_dotenv()
+# Загружаем конфигурацию один раз при старте
+settings = load_settings()
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -27,7 +37,7 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 
 # Инициализируем бота
-bot = Bot(token=os.getenv("BOT_TOKEN"))
+bot = Bot(token=settings.bot_token)
 storage = MemoryStorage()
 dp = Dispatcher(bot, storage=storage)
 
@@ -39,12 +49,8 @@ scheduler = None
 async def init_db():
     logger.info("ENTERING init_db")
     # Получаем URL базы данных и убеждаемся, что драйвер асинхронный
-    db_url = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///bot_database.db")
+    db_url = settings.database_url
     logger.info(f"Using database URL (type: {type(db_url)}): {db_url[:db_url.find(':')] + '://...elided.../' + db_url.split('/')[-1] if db_url else 'None'}")
-    # Заменяем обычный SQLite на асинхронный SQLite, если нужно
-    if db_url and db_url.startswith("sqlite:///"):
-        db_url = db_url.replace("sqlite:///", "sqlite+aiosqlite:///")
-        logger.info(f"Adjusted SQLite URL: {db_url}")
     
     if not db_url:
          logger.error("DATABASE_URL is not set!")
@@ -63,8 +69,7 @@ async def init_db():
         logger.info("Connection established.")
         
         # Check if we need to reset the database (drop and recreate tables)
-        db_reset = os.getenv("DB_RESET", "").lower() in ("true", "1", "yes")
-        if db_reset:
+        if settings.db_reset:
             logger.warning("DB_RESET is enabled! Dropping all tables...")
             await conn.run_sync(Base.metadata.drop_all)
             logger.warning("All tables dropped. Will recreate with new schema.")
@@ -92,12 +97,46 @@ async def on_startup():
         logger.info("init_db finished successfully.")
         
         # Устанавливаем сессию и токен платежей
-        logger.info("Setting dp values (session_factory, payment_token, engine)...")
+        logger.info("Setting dp values (session_factory, settings, engine)...")
         dp["session_factory"] = session_factory
-        dp["payment_provider_token"] = os.getenv("PAYMENT_PROVIDER_TOKEN")
+        dp["settings"] = settings
         dp["engine"] = engine
+        for key in ['session_factory', 'settings', 'engine']:
+            bot[key] = dp[key]
         logger.info("dp values set.")
         
+        # Отсекаем флуд от одного пользователя до обработчиков и базы данных
+        dp.middleware.setup(ThrottlingMiddleware(settings.throttle_rate, settings.throttle_burst))
+        
+        # Одна сессия на апдейт из общего пула соединений
+        dp.middleware.setup(DbSessionMiddleware(session_factory))
+        dp.middleware.setup(SettingsMiddleware())
+        
+        # Собираем множество админов один раз, проверки идут из памяти
+        admin_registry.configure(settings.admin_ids)
+        await admin_registry.refresh(session_factory)
+        
+        # Снимок каналов и тарифов для счетов и pre-checkout
+        await catalog.load(session_factory)
+        
+        # Кто может вступить в какой канал, для одобрения заявок
+        await entitlements.load(session_factory)
+        
+        # Счётчики для админ-статистики сверяются с таблицами
+        await reconcile_counters(session_factory)
+        
+        # Пул одноразовых пригласительных ссылок для активных каналов
+        invite_pool.start(bot, settings)
+        
+        # Уведомления админам о продажах отправляются в фоне, дайджестами
+        admin_notifier.start(bot, settings)
+        
+        # Тяжёлые админ-отчёты строятся в фоне и кэшируются
+        report_runner.start(session_factory, settings)
+        
+        # Рассылки, прерванные перезапуском, продолжаются с сохранённого курсора
+        await broadcaster.start(bot, session_factory, settings)
+        
         # Регистрируем обработчики
         logger.info("Registering handlers...")
         register_all_handlers(dp)
@@ -107,19 +146,23 @@ async def on_startup():
         # Настраиваем планировщик
         logger.info("Setting up scheduler...")
         global scheduler
-        scheduler = setup_scheduler(bot, session_factory)
+        scheduler = setup_scheduler(bot, session_factory, settings)
         logger.info("Scheduler set up.")
         
+        # Очереди приоритетов: платежи, затем команды, затем косметические callback-и
+        # (process_update объявлена ниже в модуле, поэтому берем ее при вызове)
+        update_lanes.start(lambda update, chat_id=None: process_update(update, chat_id), bot, settings)
+        
         # Автоматически настраиваем webhook для Render
         try:
             logger.info("Setting up webhook...")
             # Получаем URL приложения из переменных окружения
-            app_url = os.environ.get('RENDER_EXTERNAL_URL')
+            app_url = settings.app_url
             if not app_url:
-                app_url = os.environ.get('APP_URL', 'https://paytonbot.onrender.com')
+                app_url = 'https://paytonbot.onrender.com'
                 logger.warning(f"RENDER_EXTERNAL_URL not found, using fallback URL: {app_url}")
             
-            bot_token = os.getenv("BOT_TOKEN")
+            bot_token = settings.bot_token
             webhook_url = f"{app_url}/webhook/{bot_token}"
             
             logger.info(f"Настраиваем webhook на {webhook_url}")
@@ -147,6 +190,25 @@ async def on_startup():
 async def on_shutdown():
     logger.info("Shutting down bot...")
     
+    # Даем завершиться платежам в очереди и останавливаем обработчики очередей
+    await update_lanes.stop()
+    
+    # Stop scheduler if running
+    if scheduler:
+        scheduler.shutdown(wait=False)
+    
+    # Stop refilling and revoke unused invite links
+    await invite_pool.stop()
+    
+    # Отправляем уведомления о продажах, оставшиеся в очереди
+    await admin_notifier.stop()
+    
+    # Отменяем отчёты, которые ещё строятся
+    await report_runner.stop()
+    
+    # Приостанавливаем рассылки, они продолжатся при следующем запуске
+    await broadcaster.stop()
+    
     # Close storage
     await dp.storage.close()
     await dp.storage.wait_closed()
@@ -154,10 +216,6 @@ async def on_shutdown():
     # Close bot session
     await bot.session.close()
     
-    # Stop scheduler if running
-    if scheduler:
-        scheduler.shutdown(wait=False)
-    
     # Close database connection
     if "engine" in dp.data:
         await dp.data["engine"].dispose()
@@ -194,7 +252,6 @@ loop_thread = threading.Thread(target=run_event_loop, daemon=True)
 loop_thread.start()
 
 # Добавляем небольшую паузу, чтобы цикл событий успел запуститься (ВОЗВРАЩЕНО И УВЕЛИЧЕНО)
-import time
 time.sleep(2)
 
 # Global flag instead of storing the result (ВОЗВРАЩЕНО)
@@ -244,8 +301,36 @@ def ensure_dp_initialized():
         logger.info("Initialization task loop_task is still running...")
         return dp
 
+async def process_update(update, chat_id=None):
+    """Process a single update on the shared event loop"""
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+    
+    try:
+        await dp.process_update(update)
+        logger.debug(f"Update {update.update_id} processed successfully")
+    except Exception as e:
+        logger.error(f"[DEBUG] Error processing update {update.update_id}: {e}", exc_info=True)
+        
+        # Fallback: Try direct message sending for failed commands
+        if chat_id and update.message and update.message.text and update.message.text.startswith('/'):
+            try:
+                fallback_text = "Извините, произошла ошибка при обработке команды. Попробуйте позже."
+                await asyncio.get_running_loop().run_in_executor(None, send_direct_message, chat_id, fallback_text)
+                logger.info(f"[DEBUG] Sent fallback message to {chat_id}")
+            except Exception as fallback_error:
+                logger.error(f"[DEBUG] Fallback message failed: {fallback_error}", exc_info=True)
+
+def submit_update(update, chat_id=None):
+    """Queue an update in its priority lane; runs on the shared event loop"""
+    if update_lanes.running:
+        update_lanes.submit(update, chat_id)
+    else:
+        # Still starting up, process right away
+        asyncio.ensure_future(process_update(update, chat_id))
+
 # Эндпоинт для вебхука
-@app.route('/webhook/' + os.getenv("BOT_TOKEN"), methods=['POST'])
+@app.route('/webhook/' + settings.bot_token, methods=['POST'])
 def webhook():
     # Проверяем статус инициализации
     dispatcher = ensure_dp_initialized()
@@ -253,90 +338,28 @@ def webhook():
         logger.error("Dispatcher is None after ensure_dp_initialized, returning 500")
         return Response("Bot initialization error", status=500)
     
-    logger.info(f"Using dispatcher object ID in webhook: {id(dispatcher)}")
-    
     if request.headers.get('content-type') == 'application/json':
         json_string = request.get_data().decode('utf-8')
         
         try:
             json_data = json.loads(json_string)
             
-            # Log the raw update for debugging
-            logger.info(f"[DEBUG] Raw update: {json_string[:200]}...")
-            
             # Create the Update object
             update = types.Update(**json_data)
             
-            # Log important update info for debugging
-            update_type = "unknown"
+            # Chat to answer if the update fails; user content is never logged
             chat_id = None
             
             if update.message:
-                update_type = "message"
                 chat_id = update.message.chat.id
-                if update.message.text:
-                    update_type += f" with text: {update.message.text}"
             elif update.callback_query:
-                update_type = f"callback_query with data: {update.callback_query.data}"
                 chat_id = update.callback_query.message.chat.id if update.callback_query.message else None
             
-            logger.info(f"[DEBUG] Processing update {update.update_id} of type: {update_type}, chat_id: {chat_id}")
+            logger.debug(f"Received update {update.update_id} for chat {chat_id}")
             
-            # Store references to the necessary objects for the thread
-            dispatcher_ref = dispatcher
-            bot_ref = bot
-            
-            # Use a background task to process the update
-            def process_update_task():
-                try:
-                    # Create a new event loop for this thread
-                    task_loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(task_loop)
-                    
-                    # Set the bot as current in this thread context - THIS IS THE CRITICAL FIX
-                    bot_ref.set_current(bot_ref)
-                    
-                    # Make sure dispatcher has the bot reference
-                    if hasattr(dispatcher_ref, '_bot'):
-                        # Override the bot reference to ensure it's correct
-                        dispatcher_ref._bot = bot_ref
-                    
-                    # Ensure bot data is available in the context
-                    if not hasattr(bot_ref, 'data') or not bot_ref.data:
-                        logger.info(f"[DEBUG] Copying data to bot in thread: {list(dp.data.keys() if dp.data else [])}")
-                        # Copy the data from the main dp to the bot in this thread
-                        if not hasattr(bot_ref, 'data'):
-                            bot_ref.data = {}
-                        # Copy essential data items
-                        for key in ['session_factory', 'payment_provider_token', 'engine']:
-                            if key in dp.data:
-                                bot_ref.data[key] = dp.data[key]
-                    
-                    # Process the update in this dedicated event loop
-                    task_loop.run_until_complete(dispatcher_ref.process_update(update))
-                    logger.info(f"[DEBUG] Update {update.update_id} processed successfully in dedicated task")
-                    
-                    # Close the event loop when done
-                    task_loop.close()
-                except Exception as e:
-                    logger.error(f"[DEBUG] Error processing update {update.update_id} in task: {e}", exc_info=True)
-                    
-                    # Fallback: Try direct message sending for failed commands
-                    if chat_id and update.message and update.message.text and update.message.text.startswith('/'):
-                        try:
-                            fallback_text = "Извините, произошла ошибка при обработке команды. Попробуйте позже."
-                            send_direct_message(chat_id, fallback_text)
-                            logger.info(f"[DEBUG] Sent fallback message to {chat_id}")
-                        except Exception as fallback_error:
-                            logger.error(f"[DEBUG] Fallback message failed: {fallback_error}", exc_info=True)
-            
-            # Start a thread to process the update
-            import threading
-            update_thread = threading.Thread(target=process_update_task)
-            update_thread.daemon = True
-            update_thread.start()
-            
-            logger.info(f"[DEBUG] Started background thread for update {update.update_id}")
+            # Process the update on the shared event loop so handlers reuse
+            # the engine and connection pool created in on_startup
+            loop.call_soon_threadsafe(submit_update, update, chat_id)
             
             # Return immediately to acknowledge receipt
             return Response(status=200)
@@ -385,7 +408,8 @@ def status():
             "loop_running": loop and loop.is_running(),
             "handlers_registered": handlers_count,
             "dp_data_keys": list(dp.data.keys()) if dp and hasattr(dp, 'data') else [],
-            "webhook_url": f"{os.environ.get('RENDER_EXTERNAL_URL', 'Unknown')}/webhook/{os.getenv('BOT_TOKEN')}"
+            "update_lanes": update_lanes.stats(),
+            "webhook_url": f"{settings.app_url or 'Unknown'}/webhook/{settings.bot_token}"
         }
         
         return Response(json.dumps(status_info, indent=2), mimetype='application/json')
@@ -398,7 +422,7 @@ def send_direct_message(chat_id, text, parse_mode='HTML', reply_markup=None):
     """Send message directly via Telegram API"""
     try:
         logger.info(f"[DEBUG] Attempting to send direct message to chat_id: {chat_id}")
-        bot_token = os.getenv("BOT_TOKEN")
+        bot_token = settings.bot_token
         if not bot_token:
             logger.error("[DEBUG] BOT_TOKEN environment variable is not set!")
             return {"error": "BOT_TOKEN not set"}
@@ -417,17 +441,13 @@ def send_direct_message(chat_id, text, parse_mode='HTML', reply_markup=None):
         if reply_markup:
             payload['reply_markup'] = reply_markup
             
-        # Log the request we're about to make
-        logger.info(f"[DEBUG] Sending request to {send_url} with payload: {payload}")
-        
         response = requests.post(send_url, json=payload, timeout=10)
         
-        # Log both status code and response content
-        logger.info(f"[DEBUG] Direct message API response: Status {response.status_code}, Content: {response.text[:200]}")
+        logger.debug(f"Direct message API response: Status {response.status_code}")
         
         if response.status_code == 200:
             result = response.json()
-            logger.info(f"[DEBUG] Direct message sent successfully: {result}")
+            logger.debug(f"Direct message sent to chat {chat_id}")
             return result
         else:
             logger.error(f"[DEBUG] Direct message API error: Status {response.status_code}, Response: {response.text}")
@@ -443,7 +463,7 @@ def send_direct_message(chat_id, text, parse_mode='HTML', reply_markup=None):
 def test_bot_command():
     try:
         # Create a test update that simulates a /start command
-        bot_token = os.getenv("BOT_TOKEN")
+        bot_token = settings.bot_token
         
         # Get bot info to extract bot user id
         response = requests.get(f"https://api.telegram.org/bot{bot_token}/getMe")